@@ -0,0 +1,807 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the DV routing protocol hot paths
+
+Usage:
+    All benchmarks:    python3 bench_dv.py
+    Single benchmark:  python3 bench_dv.py encode
+"""
+
+import argparse
+import importlib.util
+import itertools
+import logging
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import timeit
+import tracemalloc
+from array import array
+from collections import defaultdict
+
+from dv import SPLIT_HORIZON_MODES, TRIGGERED_UPDATE_DELAY
+from message import INFINITY, AddressIndex, UpdateEncoder, decode_update
+from logs import PacketLog, logger, setup_logging, stop_logging
+from metrics import Metrics, TimedLock
+from profiling import MemoryProfiler, SamplingProfiler
+from router import RoutingEntry
+from sim import Simulator, random_topology
+from timers import DeadlineHeap
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+
+
+def make_servers(num_servers):
+    """Build an all_servers dictionary with num_servers entries"""
+    return {
+        server_id: {'ip': f"10.{server_id >> 16 & 255}.{server_id >> 8 & 255}.{server_id & 255}",
+                    'port': 5000 + server_id % 60000}
+        for server_id in range(1, num_servers + 1)
+    }
+
+
+def make_entries(num_servers):
+    """Build a list of (destination_id, cost) tuples"""
+    return [(server_id, server_id % 50) for server_id in range(1, num_servers + 1)]
+
+
+def legacy_encode(server_ip, server_port, all_servers, entries):
+    """Original per-send encoding (inet_aton per entry, bytes +=)"""
+    message = struct.pack('!II', len(entries), server_port)
+    message += socket.inet_aton(server_ip)
+    for dest_id, cost in entries:
+        dest_info = all_servers[dest_id]
+        message += socket.inet_aton(dest_info['ip'])
+        message += struct.pack('!IIII', dest_info['port'], 0, dest_id, int(min(cost, INFINITY)))
+    return message
+
+
+class LegacyRoutingEntry:
+    """Original routing table entry, with a per-instance __dict__ and its own next hop tuple"""
+    def __init__(self, destination_id, next_hop_id, cost):
+        self.destination_id = destination_id
+        self.next_hop_id = next_hop_id
+        self.next_hop_ids = () if next_hop_id is None else (next_hop_id,)
+        self.cost = cost
+        self.last_update_time = time.time()
+        self.backup_next_hop_id = None
+        self.backup_cost = float('inf')
+
+
+def legacy_decode(data):
+    """Original per-entry decoding (slice, inet_ntoa and unpack per entry)"""
+    num_fields, sender_port = struct.unpack('!II', data[0:8])
+    sender_ip = socket.inet_ntoa(data[8:12])
+    offset = 12
+    entries = {}
+    for _ in range(num_fields):
+        dest_ip = socket.inet_ntoa(data[offset:offset + 4])
+        dest_port, padding, dest_id, cost = struct.unpack('!IIII', data[offset + 4:offset + 20])
+        offset += 20
+        entries[dest_id] = cost
+    return sender_port, sender_ip, entries
+
+
+def make_network(topology, split_horizon, max_metric=INFINITY):
+    """Build an in-process Simulator of a topology
+
+    Args:
+        topology: server_id -> {neighbor_id: cost}
+        split_horizon: Split horizon mode for every server
+        max_metric: Max metric for every server
+
+    Returns:
+        Simulator whose servers map server_id -> SimDVServer
+    """
+    return Simulator(topology, CONVERGENCE_UPDATE_INTERVAL, seed=0, latency=0,
+                     split_horizon=split_horizon, max_metric=max_metric)
+
+
+def time_call(func, min_time=0.2):
+    """Return seconds per call of func"""
+    timer = timeit.Timer(func)
+    number, elapsed = timer.autorange()
+    while elapsed < min_time:
+        number *= 2
+        elapsed = timer.timeit(number)
+    return elapsed / number
+
+
+def bench_encode(sizes):
+    """Compare the legacy encoder with the cached UpdateEncoder"""
+    print("\n=== Encode update message ===")
+    print(f"{'entries':>8s} {'legacy (us)':>12s} {'cached (us)':>12s} {'ns/entry':>9s} {'speedup':>8s}")
+    for size in sizes:
+        all_servers = make_servers(size)
+        entries = make_entries(size)
+
+        encoder = UpdateEncoder('127.0.0.1', 5001)
+        encoder.rebuild(all_servers)
+        assert encoder.encode(entries) == legacy_encode('127.0.0.1', 5001, all_servers, entries)
+
+        legacy = time_call(lambda: legacy_encode('127.0.0.1', 5001, all_servers, entries))
+        cached = time_call(lambda: encoder.encode(entries))
+        print(f"{size:8d} {legacy * 1e6:12.1f} {cached * 1e6:12.1f} "
+              f"{cached * 1e9 / size:9.1f} {legacy / cached:7.1f}x")
+
+
+def bench_decode(sizes):
+    """Compare the legacy per-entry decoder with the array-based decode_update"""
+    print("\n=== Decode update message ===")
+    print(f"{'entries':>8s} {'legacy (us)':>12s} {'array (us)':>12s} {'ns/entry':>9s} {'speedup':>8s}")
+    for size in sizes:
+        encoder = UpdateEncoder('127.0.0.1', 5001)
+        encoder.rebuild(make_servers(size))
+        data = encoder.encode(make_entries(size))
+
+        message = decode_update(data)
+        assert dict(zip(message.dest_ids, message.costs)) == legacy_decode(data)[2]
+
+        legacy = time_call(lambda: legacy_decode(data))
+        decoded = time_call(lambda: decode_update(data))
+        print(f"{size:8d} {legacy * 1e6:12.1f} {decoded * 1e6:12.1f} "
+              f"{decoded * 1e9 / size:9.1f} {legacy / decoded:7.1f}x")
+
+
+def bench_sender(sizes):
+    """Compare a linear scan of all_servers with the AddressIndex lookup"""
+    print("\n=== Sender identification ===")
+    print(f"{'servers':>8s} {'scan (us)':>12s} {'index (us)':>12s} {'speedup':>8s}")
+    for size in sizes:
+        all_servers = make_servers(size)
+        index = AddressIndex()
+        index.rebuild(all_servers)
+
+        # worst case for the scan: the sender is the last server
+        info = all_servers[size]
+        encoder = UpdateEncoder(info['ip'], info['port'])
+        data = encoder.encode([])
+
+        def scan():
+            sender_port, sender_ip = legacy_decode(data)[:2]
+            for sid, info in all_servers.items():
+                if info['ip'] == sender_ip and info['port'] == sender_port:
+                    return sid
+
+        def lookup():
+            return index.lookup_packed(decode_update(data).sender_address)
+
+        assert scan() == lookup() == size
+        scanned = time_call(scan)
+        looked_up = time_call(lookup)
+        print(f"{size:8d} {scanned * 1e6:12.2f} {looked_up * 1e6:12.2f} {scanned / looked_up:7.1f}x")
+
+
+def bench_wire(sizes):
+    """Compare the v1 and compact v2 wire formats (size, encode and decode time)"""
+    print("\n=== Wire format v1 vs v2 ===")
+    print(f"{'entries':>8s} {'v1 B/ent':>9s} {'v2 B/ent':>9s} {'v1 enc':>9s} {'v2 enc':>9s} "
+          f"{'v1 dec':>9s} {'v2 dec':>9s}   (times in us)")
+    for size in sizes:
+        encoder = UpdateEncoder('127.0.0.1', 5001)
+        encoder.rebuild(make_servers(size))
+        entries = make_entries(size)
+        max_size = 65507
+
+        v1 = encoder.encode_segments(entries, 1, max_size, version=1)
+        v2 = encoder.encode_segments(entries, 1, max_size, version=2)
+        for datagrams in (v1, v2):
+            decoded = {}
+            for data in datagrams:
+                message = decode_update(data)
+                decoded.update((dest_id, INFINITY if cost >= message.infinity else cost)
+                               for dest_id, cost in zip(message.dest_ids, message.costs))
+            assert decoded == dict(entries)
+
+        v1_bytes = sum(map(len, v1)) / size
+        v2_bytes = sum(map(len, v2)) / size
+        v1_encode = time_call(lambda: encoder.encode_segments(entries, 1, max_size, version=1))
+        v2_encode = time_call(lambda: encoder.encode_segments(entries, 1, max_size, version=2))
+        v1_decode = time_call(lambda: [decode_update(data) for data in v1])
+        v2_decode = time_call(lambda: [decode_update(data) for data in v2])
+        print(f"{size:8d} {v1_bytes:9.1f} {v2_bytes:9.1f} {v1_encode * 1e6:9.1f} {v2_encode * 1e6:9.1f} "
+              f"{v1_decode * 1e6:9.1f} {v2_decode * 1e6:9.1f}")
+
+
+# name -> (topology, failed link, (server, destination) route to report)
+CONVERGENCE_SCENARIOS = {
+    # a cheap path breaks and the expensive backup link takes over
+    'backup': ({1: {2: 1, 3: 20}, 2: {1: 1, 3: 1}, 3: {1: 20, 2: 1}}, (2, 3), (1, 3)),
+    # the end of a line becomes unreachable
+    'line': ({1: {2: 1}, 2: {1: 1, 3: 1}, 3: {2: 1, 4: 1}, 4: {3: 1}}, (3, 4), (1, 4)),
+}
+# (split horizon mode, max metric) pairs to compare, the first one is the baseline
+CONVERGENCE_VARIANTS = [(mode, INFINITY) for mode in SPLIT_HORIZON_MODES]
+CONVERGENCE_VARIANTS.insert(1, ('none', 32))
+MAX_CONVERGENCE_ROUNDS = 1000
+CONVERGENCE_UPDATE_INTERVAL = 3600  # no full update runs while the triggered updates are counted
+
+
+def converge_after_failure(topology, failed_link, route, split_horizon, max_metric=INFINITY):
+    """Converge a network, fail one link and count the update rounds until it is stable again
+
+    Datagrams arrive as soon as they are sent, so the simulated time to
+    converge is a number of rounds of triggered updates, each taking
+    TRIGGERED_UPDATE_DELAY seconds.
+
+    Returns:
+        (rounds, datagrams sent, final cost of route), rounds is None if the
+        network did not converge within MAX_CONVERGENCE_ROUNDS
+    """
+    simulator = make_network(topology, split_horizon, max_metric)
+
+    # initial convergence with full updates
+    for _ in range(len(topology) + 1):
+        simulator.full_update()
+        simulator.converge()
+
+    first, second = failed_link
+    simulator.command(first, f"disable {second}")
+    simulator.command(second, f"disable {first}")
+    simulator.network.datagrams_sent = 0
+
+    seconds = simulator.converge(MAX_CONVERGENCE_ROUNDS * TRIGGERED_UPDATE_DELAY)
+    rounds = None if seconds is None else round(seconds / TRIGGERED_UPDATE_DELAY)
+    server_id, dest_id = route
+    cost = simulator.servers[server_id].routing_table[dest_id].cost
+    return rounds, simulator.network.datagrams_sent, cost
+
+
+def bench_convergence(sizes):
+    """Compare convergence after a link failure for each split horizon mode and max metric"""
+    print("\n=== Convergence after link failure ===")
+    print(f"{'scenario':>9s} {'mode':>7s} {'max':>7s} {'rounds':>7s} {'seconds':>8s} {'datagrams':>10s} "
+          f"{'route':>6s} {'saved':>16s}")
+    for name, (topology, failed_link, route) in CONVERGENCE_SCENARIOS.items():
+        baseline = None
+        for index, (mode, max_metric) in enumerate(CONVERGENCE_VARIANTS):
+            rounds, datagrams, cost = converge_after_failure(topology, failed_link, route, mode, max_metric)
+            if rounds is None:
+                rounds_str = f">{MAX_CONVERGENCE_ROUNDS}"
+                seconds_str = f">{MAX_CONVERGENCE_ROUNDS * TRIGGERED_UPDATE_DELAY:.0f}"
+                cost_str = '-'
+            else:
+                rounds_str = str(rounds)
+                seconds_str = f"{rounds * TRIGGERED_UPDATE_DELAY:.1f}"
+                cost_str = 'inf' if cost == float('inf') else str(int(cost))
+
+            if index == 0:
+                baseline = rounds
+                saved = ''
+            elif rounds is None:
+                saved = ''
+            elif baseline is None:
+                saved = f">{MAX_CONVERGENCE_ROUNDS - rounds} rounds"
+            else:
+                saved = f"{baseline - rounds} rounds"
+            print(f"{name:>9s} {mode:>7s} {max_metric:7d} {rounds_str:>7s} {seconds_str:>8s} {datagrams:10d} "
+                  f"{cost_str:>6s} {saved:>16s}")
+
+
+ENGINE_NEIGHBORS = 16
+
+
+def make_vectors(size, count):
+    """Return destination IDs 1 to size and count random vectors for each of ENGINE_NEIGHBORS neighbors
+
+    The vectors are seeded with size, so every benchmark sees the same ones.
+    """
+    rng = random.Random(size)
+    dest_ids = array('I', range(1, size + 1))
+    vectors = [[array('I', (rng.randint(1, 50) for _ in dest_ids)) for _ in range(count)]
+               for _ in range(ENGINE_NEIGHBORS)]
+    return dest_ids, vectors
+
+
+def make_large_server(num_servers, num_neighbors, engine, dest_ids=None, vectors=None):
+    """Build a SimDVServer with num_servers destinations and num_neighbors neighbors
+
+    The server starts from a two-server simulation and its tables are
+    rebuilt at full size. It is stopped, so it sends nothing, and applies
+    the first of each neighbor's vectors if vectors are given.
+    """
+    server = Simulator({1: {2: 1}, 2: {1: 1}}, 30, split_horizon='none').servers[1]
+    server.all_servers = make_servers(num_servers)
+    server.neighbors = {neighbor_id: dict(server.all_servers[neighbor_id], cost=neighbor_id % 7 + 1)
+                        for neighbor_id in range(2, num_neighbors + 2)}
+    server.routing_table = {}
+    server.initialize_routing_table()
+    server.engine = server.create_engine(engine)
+    with server.lock:
+        server.publish_snapshot(full=True)
+    server.running = False
+    if vectors is not None:
+        for neighbor_id, neighbor_vectors in zip(server.neighbors, vectors):
+            server.update_routing_table(neighbor_id, dest_ids, neighbor_vectors[0])
+    return server
+
+
+def bench_engine(sizes):
+    """Compare the dict and NumPy engines applying a full vector from every neighbor"""
+    print(f"\n=== Route engine ({ENGINE_NEIGHBORS} neighbors, one full vector each) ===")
+    if importlib.util.find_spec('numpy') is None:
+        print("NumPy is not installed, skipping")
+        return
+
+    print(f"{'entries':>8s} {'dict (ms)':>12s} {'numpy (ms)':>12s} {'ns/entry':>9s} {'speedup':>8s}")
+    for size in sizes:
+        size = max(size, ENGINE_NEIGHBORS + 1)
+        # two vectors per neighbor, applied alternately so every round changes routes
+        dest_ids, vectors = make_vectors(size, 2)
+
+        times = {}
+        tables = {}
+        for engine in ('dict', 'numpy'):
+            server = make_large_server(size, ENGINE_NEIGHBORS, engine)
+            neighbor_ids = list(server.neighbors)
+            state = [0]
+
+            def apply_vectors():
+                state[0] ^= 1
+                for neighbor_id, pair in zip(neighbor_ids, vectors):
+                    server.update_routing_table(neighbor_id, dest_ids, pair[state[0]])
+
+            times[engine] = time_call(apply_vectors)
+            if state[0]:
+                apply_vectors()
+            # next hops can differ between engines on ties, which depend on the number of runs
+            tables[engine] = {dest_id: entry.cost for dest_id, entry in server.routing_table.items()}
+
+        assert tables['dict'] == tables['numpy']
+        entries = size * ENGINE_NEIGHBORS
+        print(f"{size:8d} {times['dict'] * 1e3:12.2f} {times['numpy'] * 1e3:12.2f} "
+              f"{times['numpy'] * 1e9 / entries:9.1f} {times['dict'] / times['numpy']:7.1f}x")
+
+
+def bench_failure(sizes):
+    """Compare finding the routes through a failed neighbor by table scan and with routes_via"""
+    print(f"\n=== Routes through a failed neighbor ({ENGINE_NEIGHBORS} neighbors) ===")
+    print(f"{'entries':>8s} {'routes':>7s} {'scan (us)':>12s} {'index (us)':>12s} {'speedup':>8s}")
+    for size in sizes:
+        size = max(size, ENGINE_NEIGHBORS + 1)
+        dest_ids, vectors = make_vectors(size, 1)
+        server = make_large_server(size, ENGINE_NEIGHBORS, 'dict', dest_ids, vectors)
+
+        neighbor_id = next(iter(server.neighbors))
+        table = server.routing_table
+
+        def scan():
+            return {dest_id for dest_id, entry in table.items() if entry.next_hop_id == neighbor_id}
+
+        def lookup():
+            return set(server.routes_via.get(neighbor_id, ()))
+
+        routes = scan()
+        assert routes == lookup()
+        scanned = time_call(scan)
+        looked_up = time_call(lookup)
+        print(f"{size:8d} {len(routes):7d} {scanned * 1e6:12.2f} {looked_up * 1e6:12.2f} "
+              f"{scanned / looked_up:7.1f}x")
+
+
+FAILOVER_REPEATS = 3
+
+
+def bench_failover(sizes):
+    """Compare recomputing the routes through a failed neighbor with switching to backups"""
+    print(f"\n=== Failover of a neighbor ({ENGINE_NEIGHBORS} neighbors) ===")
+    print(f"{'entries':>8s} {'routes':>7s} {'backups':>8s} {'recompute (us)':>15s} {'backup (us)':>12s} "
+          f"{'speedup':>8s} {'switch (us)':>12s} {'speedup':>8s}")
+    for size in sizes:
+        size = max(size, ENGINE_NEIGHBORS + 1)
+        dest_ids, vectors = make_vectors(size, 1)
+
+        times = {'recompute': [], 'backup': [], 'switch': []}
+        for _ in range(FAILOVER_REPEATS):
+            for method in ('recompute', 'backup'):
+                server = make_large_server(size, ENGINE_NEIGHBORS, 'dict', dest_ids, vectors)
+
+                neighbor_id = next(iter(server.neighbors))
+                routes = list(server.routes_via[neighbor_id])
+                backups = sum(server.usable_backup(server.routing_table[dest_id])[0] is not None
+                              for dest_id in routes)
+
+                # what disable does, with and without the backups, up to the published snapshot
+                start = time.perf_counter()
+                with server.lock:
+                    server.neighbors[neighbor_id]['cost'] = float('inf')
+                    server.drop_neighbor_vector(neighbor_id)
+                    if method == 'backup':
+                        # fail_over, timing the published switch on its own
+                        switched = server.switch_to_backups(neighbor_id)
+                        server.publish_snapshot(link_changed=neighbor_id)
+                        times['switch'].append(time.perf_counter() - start)
+                        server.recompute_routes_via(neighbor_id)
+                        server.recompute_routes(switched + list(server.routes_with_backup(neighbor_id)))
+                    else:
+                        server.recompute_routes_via(neighbor_id)
+                    server.publish_snapshot(link_changed=neighbor_id)
+                times[method].append(time.perf_counter() - start)
+
+        recomputed = min(times['recompute'])
+        backed_up = min(times['backup'])
+        switched = min(times['switch'])
+        print(f"{size:8d} {len(routes):7d} {backups:8d} {recomputed * 1e6:15.1f} {backed_up * 1e6:12.1f} "
+              f"{recomputed / backed_up:7.1f}x {switched * 1e6:12.1f} {recomputed / switched:7.1f}x")
+
+
+def bench_liveness(sizes):
+    """Compare scanning every neighbor's last update time with the DeadlineHeap"""
+    print("\n=== Neighbor liveness (no neighbor expired) ===")
+    print(f"{'neighbors':>9s} {'scan (us)':>10s} {'heap (us)':>10s} {'refresh (ns)':>13s} {'speedup':>8s}")
+    for size in sizes:
+        now = 1000.0
+        timeout = 15.0
+        last_update = {neighbor_id: now - neighbor_id % 10 for neighbor_id in range(size)}
+        deadlines = DeadlineHeap()
+        for neighbor_id, last in last_update.items():
+            deadlines.set(neighbor_id, last + timeout)
+
+        def scan():
+            return [neighbor_id for neighbor_id, last in last_update.items() if now - last > timeout]
+
+        def check():
+            return deadlines.pop_expired(now)
+
+        refreshed = iter(range(1 << 62))
+
+        def refresh():
+            deadlines.set(next(refreshed) % size, now + timeout)
+
+        assert scan() == check() == []
+        scanned = time_call(scan)
+        checked = time_call(check)
+        refresh_time = time_call(refresh)
+        print(f"{size:9d} {scanned * 1e6:10.2f} {checked * 1e6:10.2f} {refresh_time * 1e9:13.1f} "
+              f"{scanned / checked:7.1f}x")
+
+
+ECMP_NEXT_HOPS = [2, 4, 8]
+
+
+def bench_ecmp(sizes):
+    """Measure flow lookups over equal-cost next hops, their balance, and flows moved by a failure"""
+    print("\n=== ECMP flow hashing ===")
+    print(f"{'flows':>8s} {'hops':>5s} {'lookup (ns)':>12s} {'min share':>10s} {'max share':>10s} "
+          f"{'moved':>7s} {'ideal':>7s}")
+    for size in sizes:
+        flows = [('10.0.0.1', f'10.0.{i >> 8 & 255}.{i & 255}', 1024 + i % 50000) for i in range(size)]
+        for hops in ECMP_NEXT_HOPS:
+            entry = RoutingEntry(destination_id=100, next_hop_id=1, cost=4)
+            entry.next_hop_ids = tuple(range(1, hops + 1))
+            before = [entry.select_next_hop(flow) for flow in flows]
+
+            flow_iter = itertools.cycle(flows)
+
+            def lookup():
+                return entry.select_next_hop(next(flow_iter))
+
+            lookup_time = time_call(lookup)
+
+            shares = defaultdict(int)
+            for next_hop_id in before:
+                shares[next_hop_id] += 1
+
+            # fail the last next hop: only its flows should move
+            entry.next_hop_ids = entry.next_hop_ids[:-1]
+            moved = sum(entry.select_next_hop(flow) != next_hop_id for flow, next_hop_id in zip(flows, before))
+
+            print(f"{size:8d} {hops:5d} {lookup_time * 1e9:12.1f} {min(shares.values()) / size:10.3f} "
+                  f"{max(shares.values()) / size:10.3f} {moved / size:7.3f} {1 / hops:7.3f}")
+
+
+SNAPSHOT_READ_TIME = 0.5  # seconds of lookups per method
+SNAPSHOT_BATCH = 64  # changed routes per published snapshot
+
+
+def bench_snapshot(sizes):
+    """Compare lookups under self.lock with lookups in the published snapshot while updates arrive"""
+    print(f"\n=== Route lookups during updates ({ENGINE_NEIGHBORS} neighbors sending full vectors) ===")
+    print(f"{'entries':>8s} {'locked (ns)':>12s} {'snapshot (ns)':>14s} {'speedup':>8s} "
+          f"{'publish (us)':>13s}")
+    for size in sizes:
+        size = max(size, ENGINE_NEIGHBORS + 1)
+        dest_ids, vectors = make_vectors(size, 2)
+        server = make_large_server(size, ENGINE_NEIGHBORS, 'dict')
+        neighbor_ids = list(server.neighbors)
+
+        def locked_lookup(dest_id):
+            # what lookups cost before snapshots
+            with server.lock:
+                entry = server.routing_table.get(dest_id)
+                return None if entry is None else entry.select_next_hop()
+
+        times = {}
+        for name, lookup in (('locked', locked_lookup), ('snapshot', server.lookup)):
+            stop = threading.Event()
+
+            def receive():
+                state = 0
+                while not stop.is_set():
+                    state ^= 1
+                    for neighbor_id, pair in zip(neighbor_ids, vectors):
+                        server.update_routing_table(neighbor_id, dest_ids, pair[state])
+
+            writer = threading.Thread(target=receive)
+            writer.start()
+            lookups = 0
+            start = time.perf_counter()
+            deadline = start + SNAPSHOT_READ_TIME
+            while time.perf_counter() < deadline:
+                for dest_id in range(1, 101):
+                    lookup(dest_id)
+                lookups += 100
+            times[name] = (time.perf_counter() - start) / lookups
+            stop.set()
+            writer.join()
+
+        changed = list(server.routing_table)[:SNAPSHOT_BATCH]
+
+        def publish():
+            with server.lock:
+                server.snapshot_pending.update(changed)
+                server.publish_snapshot()
+
+        published = time_call(publish)
+        print(f"{size:8d} {times['locked'] * 1e9:12.1f} {times['snapshot'] * 1e9:14.1f} "
+              f"{times['locked'] / times['snapshot']:7.1f}x {published * 1e6:13.1f}")
+
+
+def traced_size(build):
+    """Return the bytes allocated by build() and still held by its result"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del result
+    return size
+
+
+def bench_memory(sizes):
+    """Compare the memory per route of the legacy and slotted routing entries"""
+    print(f"\n=== Routing table memory ({ENGINE_NEIGHBORS} neighbors) ===")
+    print(f"{'routes':>8s} {'legacy (B)':>11s} {'slotted (B)':>12s} {'snapshot (B)':>13s} {'saving':>7s}")
+    for size in sizes:
+        def build(entry_class):
+            def table():
+                # every route has a cost and a backup, as after convergence
+                routing_table = {}
+                for dest_id in range(1, size + 1):
+                    entry = entry_class(dest_id, dest_id % ENGINE_NEIGHBORS + 2, float(dest_id % 50 + 1))
+                    entry.backup_next_hop_id = (dest_id + 1) % ENGINE_NEIGHBORS + 2
+                    entry.backup_cost = entry.cost + 1
+                    routing_table[dest_id] = entry
+                return routing_table
+            return table
+
+        legacy = traced_size(build(LegacyRoutingEntry))
+        slotted = traced_size(build(RoutingEntry))
+
+        routing_table = build(RoutingEntry)()
+        snapshot = traced_size(lambda: {dest_id: (entry.cost, entry.next_hop_id, entry.next_hop_ids,
+                                                  entry.backup_next_hop_id)
+                                        for dest_id, entry in routing_table.items()})
+        print(f"{size:8d} {legacy / size:11.1f} {slotted / size:12.1f} {snapshot / size:13.1f} "
+              f"{legacy / slotted:6.1f}x")
+
+
+def bench_logging(sizes):
+    """Compare printing per-packet events with the queued, rate-limited PacketLog"""
+    print("\n=== Per-packet event logging (caller side, line-buffered output) ===")
+    print(f"{'senders':>8s} {'print (ns)':>11s} {'off (ns)':>9s} {'queued (ns)':>12s} {'limited (ns)':>13s}")
+    with open(os.devnull, 'w', buffering=1) as devnull:
+        for size in sizes:
+            senders = itertools.cycle(range(size))
+
+            def printed():
+                print(f"RECEIVED A MESSAGE FROM SERVER {next(senders)}", file=devnull)
+
+            def logged(packet_log):
+                def log():
+                    sender_id = next(senders)
+                    packet_log.log(sender_id, "RECEIVED A MESSAGE FROM SERVER %d", sender_id)
+
+                # a fresh writer thread each time, so no backlog is written during the next measurement
+                setup_logging('info', devnull)
+                try:
+                    return time_call(log)
+                finally:
+                    stop_logging()
+
+            print_time = time_call(printed)
+            off_time = logged(PacketLog(logging.DEBUG))
+            # a rate no sender reaches, so every event is queued
+            queued_time = logged(PacketLog(logging.INFO, rate=1e12, burst=1e12))
+            limited_time = logged(PacketLog(logging.INFO, rate=1, burst=1))
+            print(f"{size:8d} {print_time * 1e9:11.1f} {off_time * 1e9:9.1f} {queued_time * 1e9:12.1f} "
+                  f"{limited_time * 1e9:13.1f}")
+
+
+def bench_metrics(sizes):
+    """Measure what the metrics add to the hot paths"""
+    print("\n=== Metrics overhead per operation ===")
+    print(f"{'neighbors':>9s} {'counter (ns)':>13s} {'histogram (ns)':>15s} {'lock (ns)':>10s} "
+          f"{'timed lock (ns)':>16s} {'render (us)':>12s}")
+    for size in sizes:
+        metrics = Metrics()
+        counter = metrics.counter('bench_total', 'Counter', 'neighbor')
+        histogram = metrics.histogram('bench_seconds', 'Histogram')
+        neighbors = itertools.cycle(range(size))
+        durations = itertools.cycle([1e-6 * 2 ** (i % 20) for i in range(1000)])
+
+        lock = threading.Lock()
+        timed_lock = TimedLock(metrics.histogram('bench_lock_wait_seconds', 'Lock wait'))
+
+        def locked(lock):
+            def acquire():
+                with lock:
+                    pass
+            return acquire
+
+        counter_time = time_call(lambda: counter.inc(1, next(neighbors)))
+        histogram_time = time_call(lambda: histogram.observe(next(durations)))
+        lock_time = time_call(locked(lock))
+        timed_lock_time = time_call(locked(timed_lock))
+        render_time = time_call(metrics.render)
+        print(f"{size:9d} {counter_time * 1e9:13.1f} {histogram_time * 1e9:15.1f} {lock_time * 1e9:10.1f} "
+              f"{timed_lock_time * 1e9:16.1f} {render_time * 1e6:12.1f}")
+
+
+def bench_profiling(sizes):
+    """Measure how much the profile and memprofile commands slow down update_routing_table"""
+    print(f"\n=== Profiling overhead ({ENGINE_NEIGHBORS} neighbors, one full vector each) ===")
+    print(f"{'entries':>8s} {'off (ms)':>9s} {'profile (ms)':>13s} {'memprofile (ms)':>16s} "
+          f"{'sample (us)':>12s}")
+    for size in sizes:
+        size = max(size, ENGINE_NEIGHBORS + 1)
+        dest_ids, vectors = make_vectors(size, 2)
+        server = make_large_server(size, ENGINE_NEIGHBORS, 'dict')
+        neighbor_ids = list(server.neighbors)
+        state = [0]
+
+        def apply_vectors():
+            state[0] ^= 1
+            for neighbor_id, pair in zip(neighbor_ids, vectors):
+                server.update_routing_table(neighbor_id, dest_ids, pair[state[0]])
+
+        off_time = time_call(apply_vectors)
+
+        profiler = SamplingProfiler()
+        profiler.start()
+        profile_time = time_call(apply_vectors)
+        profiler.stop()
+        sample_time = time_call(profiler.sample)
+
+        memory_profiler = MemoryProfiler()
+        memory_profiler.start()
+        memprofile_time = time_call(apply_vectors)
+        memory_profiler.stop()
+
+        print(f"{size:8d} {off_time * 1e3:9.2f} {profile_time * 1e3:13.2f} {memprofile_time * 1e3:16.2f} "
+              f"{sample_time * 1e6:12.1f}")
+
+
+SIMULATE_DEGREE = 4  # average neighbors per server
+SIMULATE_MAX_SERVERS = 1000  # about 1 KB per server and destination: 1 GB at 1,000 servers, 100 GB at 10,000
+
+
+def bench_simulate(sizes):
+    """Converge random networks of sizes servers in the in-process simulator, then fail one link"""
+    print(f"\n=== Simulated networks (average degree {SIMULATE_DEGREE}) ===")
+    print(f"{'servers':>8s} {'build (s)':>10s} {'sim (s)':>8s} {'cpu (s)':>8s} {'datagrams':>10s} {'MB':>7s} "
+          f"{'fail sim (s)':>13s} {'fail cpu (s)':>13s}")
+    for size in sizes:
+        if size > SIMULATE_MAX_SERVERS:
+            print(f"{size:8d} skipped, more than {SIMULATE_MAX_SERVERS} servers")
+            continue
+        size = max(size, SIMULATE_DEGREE + 1)
+        start = time.perf_counter()
+        simulator = Simulator(random_topology(size, SIMULATE_DEGREE, seed=size), seed=size)
+        build_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        simulator.full_update()
+        seconds = simulator.converge()
+        converge_time = time.perf_counter() - start
+        network = simulator.network
+        datagrams, sent_bytes = network.datagrams_sent, network.bytes_sent
+
+        # servers 1 and 2 are linked by the ring every random topology starts from
+        start = time.perf_counter()
+        simulator.command(1, "disable 2")
+        simulator.command(2, "disable 1")
+        fail_seconds = simulator.converge()
+        fail_time = time.perf_counter() - start
+        print(f"{size:8d} {build_time:10.2f} {seconds:8.2f} {converge_time:8.2f} {datagrams:10d} "
+              f"{sent_bytes / 1e6:7.1f} {fail_seconds:13.2f} {fail_time:13.2f}")
+
+
+HOUR_MAX_SERVERS = 100  # an hour of full updates costs about servers squared times 120 route updates
+HOUR_MAX_METRIC = 256  # above any path cost of these networks, and bounds counting to infinity after the crash
+
+
+def simulate_hour(size, seed):
+    """Simulate an hour of a random network with jitter, losses, a crash and a link change
+
+    Returns:
+        (events run, digest of the final tables and traffic)
+    """
+    simulator = Simulator(random_topology(size, SIMULATE_DEGREE, seed=seed), seed=seed, jitter=0.01, loss=0.01,
+                          max_metric=HOUR_MAX_METRIC)
+    simulator.schedule_command(600, size, "crash")
+    simulator.schedule_command(1200, 1, f"update 1 2 {INFINITY}")
+    simulator.schedule_command(1800, 1, "update 1 2 1")
+    simulator.run(3600)
+
+    tables = tuple(tuple(sorted(server.snapshot.routes.items())) for server in simulator.servers.values())
+    network = simulator.network
+    digest = hash((tables, network.datagrams_sent, network.bytes_sent, network.datagrams_lost))
+    return simulator.clock.events_run, digest
+
+
+def bench_hour(sizes):
+    """Simulate an hour of protocol time twice with the same seed and compare the results"""
+    print("\n=== One simulated hour (1% loss, 10 ms jitter, a crash and a link change) ===")
+    print(f"{'servers':>8s} {'events':>9s} {'cpu (s)':>8s} {'x real time':>12s} {'reproduced':>11s}")
+    # the crash makes neighbors log timeout warnings
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    for size in sizes:
+        if size > HOUR_MAX_SERVERS:
+            print(f"{size:8d} skipped, more than {HOUR_MAX_SERVERS} servers")
+            continue
+        size = max(size, SIMULATE_DEGREE + 1)
+        start = time.perf_counter()
+        events, digest = simulate_hour(size, seed=size)
+        cpu_time = time.perf_counter() - start
+        reproduced = simulate_hour(size, seed=size) == (events, digest)
+        print(f"{size:8d} {events:9d} {cpu_time:8.2f} {3600 / cpu_time:12.0f} {'yes' if reproduced else 'NO':>11s}")
+    logger.setLevel(level)
+
+
+BENCHMARKS = {
+    'convergence': bench_convergence,
+    'decode': bench_decode,
+    'ecmp': bench_ecmp,
+    'hour': bench_hour,
+    'engine': bench_engine,
+    'failover': bench_failover,
+    'failure': bench_failure,
+    'liveness': bench_liveness,
+    'logging': bench_logging,
+    'memory': bench_memory,
+    'metrics': bench_metrics,
+    'profiling': bench_profiling,
+    'simulate': bench_simulate,
+    'sender': bench_sender,
+    'snapshot': bench_snapshot,
+    'wire': bench_wire,
+    'encode': bench_encode,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the DV routing protocol')
+    parser.add_argument('benchmarks', nargs='*',
+                        help=f"Benchmarks to run: {', '.join(sorted(BENCHMARKS))} (default: all)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Routing table sizes to benchmark')
+
+    args = parser.parse_args()
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark: {', '.join(unknown)}")
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+Convergence tracking for the Distance Vector Routing Protocol
+
+Every local topology event (a link cost update, a disabled link, a
+neighbor timeout, the first update from a neighbor) gets an id. Route
+changes are attributed to every event that is still open, and an event
+is closed once the table has not changed for a quiet period: it
+converged at its last route change.
+"""
+
+from collections import deque
+
+CONVERGENCE_QUIET_INTERVALS = 2  # update intervals without a route change before an event is closed
+CONVERGENCE_HISTORY = 50  # closed events kept for the convergence command
+EVENT_KINDS = ('update', 'disable', 'timeout', 'neighbor-up')
+CONVERGENCE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0)
+
+
+class ConvergenceEvent:
+    """A local topology event and the route changes seen after it"""
+
+    def __init__(self, event_id, kind, neighbor_id, start):
+        self.event_id = event_id
+        self.kind = kind  # one of EVENT_KINDS
+        self.neighbor_id = neighbor_id
+        self.start = start
+        self.last_change = None  # time of the last route change while the event was open
+        self.changes = 0  # batches of route changes while the event was open
+        self.converged = None  # time the table converged, once the event is closed
+
+    def duration(self):
+        """Return the seconds from the event to convergence, or None while it is open"""
+        return None if self.converged is None else self.converged - self.start
+
+
+class ConvergenceTracker:
+    """
+    Open and closed convergence events of one server
+
+    The caller serializes access (DVServer holds self.lock).
+    """
+
+    def __init__(self, quiet_period, events_counter=None, duration_histogram=None,
+                 history=CONVERGENCE_HISTORY):
+        """
+        Args:
+            quiet_period: Seconds without a route change after which open events are closed
+            events_counter: Optional CounterMetric of events, by kind
+            duration_histogram: Optional HistogramMetric of convergence times
+            history: Number of closed events to keep
+        """
+        self.quiet_period = quiet_period
+        self.events_counter = events_counter
+        self.duration_histogram = duration_histogram
+        self.next_id = 1
+        self.open_events = []
+        self.closed_events = deque(maxlen=history)
+
+    def event(self, kind, neighbor_id, now):
+        """Start tracking a topology event
+
+        Args:
+            kind: One of EVENT_KINDS
+            neighbor_id: Neighbor the event is about
+            now: Time of the event
+
+        Returns:
+            The new ConvergenceEvent
+        """
+        event = ConvergenceEvent(self.next_id, kind, neighbor_id, now)
+        self.next_id += 1
+        self.open_events.append(event)
+        if self.events_counter is not None:
+            self.events_counter.inc(1, kind)
+        return event
+
+    def table_changed(self, now):
+        """Record a batch of route changes at time now"""
+        for event in self.open_events:
+            event.last_change = now
+            event.changes += 1
+
+    def check(self, now):
+        """Close the open events whose table has been quiet for quiet_period"""
+        if not self.open_events:
+            return
+
+        still_open = []
+        for event in self.open_events:
+            last_change = event.start if event.last_change is None else event.last_change
+            if now - last_change < self.quiet_period:
+                still_open.append(event)
+                continue
+            event.converged = last_change
+            self.closed_events.append(event)
+            if self.duration_histogram is not None:
+                self.duration_histogram.observe(event.duration())
+        self.open_events = still_open
+
+    def events(self):
+        """Return the closed events, oldest first, followed by the open ones"""
+        return list(self.closed_events) + self.open_events
@@ -1,23 +1,60 @@
 
 import sys
+import importlib.util
 import socket
 import threading
 import time
-import struct
 import select
-from collections import defaultdict
+from collections import Counter, defaultdict
 import argparse
-from router import RoutingEntry
+import logging
+import random
+from router import RouteSnapshot, RoutingEntry, shared_next_hops
 from parse_topology import TopologyParser
+from timers import DeadlineHeap
+from logs import DEFAULT_LOG_LEVEL, LOG_LEVELS, PacketLog, logger, setup_logging
+from metrics import Metrics, TimedLock, serve_metrics
+from convergence import CONVERGENCE_BUCKETS, CONVERGENCE_QUIET_INTERVALS, ConvergenceTracker
+from profiling import MemoryProfiler, SamplingProfiler
+from message import (INFINITY, DEFAULT_MAX_DATAGRAM, CAPABILITY_COMPACT, COMPACT_VERSION, AddressIndex,
+                     SegmentTracker, UpdateEncoder, decode_update, pack_address, set_sequence,
+                     unpack_address)
 
 # constants
-INFINITY = 999999  # used for binary packet encoding
 TIMEOUT_MULTIPLIER = 3  # number of intervals before neighbor timeout
+TIMEOUT_GRACE = 0.5  # fraction of an interval added, so the last missed update arrives before the deadline
+TRIGGERED_UPDATE_DELAY = 0.1  # seconds to collect changes before a triggered update
+DEFAULT_RECEIVE_BATCH = 64  # most datagrams drained from the socket per batch
+SPLIT_HORIZON_MODES = ('none', 'split', 'poison')  # how routes are advertised back to their next hop
+DEFAULT_SPLIT_HORIZON = 'poison'
+ENGINES = ('dict', 'numpy')  # route computation engines; numpy needs NumPy installed
+COMMANDS = "update, step, packets, batches, metrics, convergence, profile, memprofile, display, disable, crash"
 
 
 class DVServer:
 
-    def __init__(self, topology_file, update_interval):
+    def __init__(self, topology_file, update_interval, max_datagram_size=DEFAULT_MAX_DATAGRAM,
+                 wire_version=COMPACT_VERSION, receive_batch=DEFAULT_RECEIVE_BATCH,
+                 split_horizon=DEFAULT_SPLIT_HORIZON, engine='dict', max_metric=INFINITY,
+                 topology=None, transport=None, clock=None):
+        """
+        Args:
+            topology_file: Topology file name (None if topology is given)
+            update_interval: Seconds between full updates
+            max_datagram_size: Largest datagram sent or received
+            wire_version: Highest wire format version to negotiate
+            receive_batch: Most datagrams drained per batch
+            split_horizon: One of SPLIT_HORIZON_MODES
+            engine: One of ENGINES
+            max_metric: Route costs at or above this are unreachable
+            topology: Parsed topology (as returned by TopologyParser.parse) to use
+                instead of reading topology_file
+            transport: Object with sendto(data, address) and close() to send
+                datagrams through instead of a UDP socket; whoever delivers
+                datagrams to this server calls process_batch()
+            clock: Object with time() and sleep(seconds) to use instead of the
+                time module, e.g. a simulated clock
+        """
         # Server identification
         self.server_id = None
         self.server_ip = None
@@ -25,43 +62,122 @@ class DVServer:
         
         # Routing table: destination_id -> RoutingEntry
         self.routing_table = {}
+        self.changed_destinations = set()  # destinations changed since the last update was sent
+        self.split_withdrawals = {}  # destination_id -> full updates that still withdraw it ('split' only)
+        self.table_version = 0  # bumped by every change to what the table advertises
+        self.routes_via = defaultdict(set)  # next_hop_id -> destinations routed through it (any equal-cost hop)
+        self.backups_via = defaultdict(set)  # backup_next_hop_id -> destinations with it as backup (dict engine)
+        self.snapshot = RouteSnapshot(0, {})  # latest published copy of the table, read without the lock
+        self.snapshot_pending = set()  # destinations changed since the snapshot was published
+        self.routes_changed = False  # a route changed since the snapshot was published
         
         # Neighbor information
         self.neighbors = {}  # neighbor_id -> {'ip': ip, 'port': port, 'cost': cost}
         self.neighbor_last_update = {}  # neighbor_id -> timestamp
+        self.neighbor_deadlines = DeadlineHeap()  # neighbor_id -> time it times out
+        self.neighbor_versions = {}  # neighbor_id -> wire format version to send
+        self.pending_addresses = defaultdict(set)  # neighbor_id -> server IDs whose address changed
+        self.neighbor_vectors = {}  # neighbor_id -> {destination_id: cost} last advertised by it
+        self.neighbors_heard = set()  # neighbors heard from since the start or their last failure
+        self.engine = None  # NumpyRouteEngine holding the vectors instead, or None
         
         # Network information
         self.all_servers = {}  # server_id -> {'ip': ip, 'port': port}
+        self.address_index = AddressIndex()  # (ip, port) / packed address -> server_id
         
         # Configuration
         self.update_interval = update_interval
         self.topology_file = topology_file
+        self.topology = topology  # parsed topology used instead of topology_file, or None
+        self.clock = time if clock is None else clock  # time() and sleep() for all protocol timing
+        self.max_datagram_size = max_datagram_size  # largest datagram sent or received
+        self.wire_version = wire_version  # highest wire format version to negotiate
+        self.receive_batch = receive_batch  # most datagrams drained per batch
+        self.split_horizon = split_horizon  # one of SPLIT_HORIZON_MODES
+        self.max_metric = max_metric  # route costs at or above this are unreachable
         
         # Statistics
-        self.packets_received = 0
+        self.packets_received = 0  # since the last packets command, guarded by self.lock
+        self.batch_sizes = Counter()  # datagrams per receive batch -> number of batches
+        self.metrics = Metrics()
+        self.received_packets = self.metrics.counter(
+            'dv_received_packets_total', 'Datagrams received, by sending neighbor', 'neighbor')
+        self.received_bytes = self.metrics.counter(
+            'dv_received_bytes_total', 'Bytes received, by sending neighbor', 'neighbor')
+        self.sent_packets = self.metrics.counter(
+            'dv_sent_packets_total', 'Datagrams sent, by neighbor', 'neighbor')
+        self.sent_bytes = self.metrics.counter(
+            'dv_sent_bytes_total', 'Bytes sent, by neighbor', 'neighbor')
+        self.decode_errors = self.metrics.counter(
+            'dv_decode_errors_total', 'Received datagrams that could not be decoded')
+        self.unknown_senders = self.metrics.counter(
+            'dv_unknown_senders_total', 'Received datagrams from an unknown server address')
+        self.table_mutations = self.metrics.counter(
+            'dv_table_mutations_total', 'Changes to a route cost or next hop')
+        self.lock_wait = self.metrics.histogram(
+            'dv_lock_wait_seconds', 'Time spent waiting for the routing table lock')
+        self.encode_time = self.metrics.histogram(
+            'dv_encode_seconds', 'Time to encode one update message (all its segments)')
+        self.decode_time = self.metrics.histogram(
+            'dv_decode_seconds', 'Time to decode one received datagram')
+        self.convergence = ConvergenceTracker(
+            CONVERGENCE_QUIET_INTERVALS * update_interval,
+            self.metrics.counter('dv_topology_events_total', 'Local topology events, by kind', 'kind'),
+            self.metrics.histogram('dv_convergence_seconds',
+                                   'Time from a local topology event to the last route change it caused',
+                                   CONVERGENCE_BUCKETS))
+
+        # On-demand profilers for the profile and memprofile commands
+        self.profiler = SamplingProfiler()
+        self.memory_profiler = MemoryProfiler()
+
+        # Rate-limited per-packet log events, keyed by neighbor or sender address
+        self.received_log = PacketLog(logging.INFO)
+        self.sent_log = PacketLog(logging.DEBUG)
+        self.dropped_log = PacketLog(logging.WARNING)
         
         # Socket for UDP communication
         self.socket = None
+
+        # Encoder for outgoing update messages (created once topology is known)
+        self.encoder = None
+
+        # Segmented advertisements: random start so a restart is not mistaken for stale data
+        self.advertisement_sequence = random.getrandbits(32)
+        self.segment_tracker = SegmentTracker()
+
+        # Encoded full advertisement: (wire version, neighbor_id or None) -> (table_version, datagrams)
+        self.advertisement_cache = {}
         
         # Threading
         self.running = True
-        self.lock = threading.Lock()
+        self.lock = TimedLock(self.lock_wait)
+        self.send_lock = threading.Lock()  # serializes sends, which share the encoder buffer
+        self.update_event = threading.Event()  # set when a triggered update is pending
         
         # Parse topology file
         self.parse_topology_file()
 
         # Initialize routing table
         self.initialize_routing_table()
+        self.engine = self.create_engine(engine)
+        with self.lock:
+            self.publish_snapshot(full=True)
 
-        # Create UDP socket
-        self.create_socket()
+        # Create UDP socket, unless datagrams go through another transport
+        if transport is None:
+            self.create_socket()
+        else:
+            self.socket = transport
 
 
     def parse_topology_file(self):
         """Parse topology file and populate server and neighbor information"""
         try:
-            parser = TopologyParser(self.topology_file)
-            topology_data = parser.parse()
+            topology_data = self.topology
+            if topology_data is None:
+                parser = TopologyParser(self.topology_file)
+                topology_data = parser.parse()
 
             # extract server information
             self.server_id = topology_data['my_server_id']
@@ -69,8 +185,7 @@ class DVServer:
             self.server_port = topology_data['my_port']
 
             # store all servers in network
-            for server_id, (ip, port) in topology_data['servers'].items():
-                self.all_servers[server_id] = {'ip': ip, 'port': port}
+            self.load_server_list(topology_data['servers'])
 
             # store neighbor information with costs
             for neighbor_id, cost in topology_data['neighbors'].items():
@@ -81,16 +196,34 @@ class DVServer:
                     'cost': cost
                 }
                 # initialize last update time
-                self.neighbor_last_update[neighbor_id] = time.time()
+                self.neighbor_last_update[neighbor_id] = self.clock.time()
+                self.neighbor_deadlines.set(neighbor_id, self.clock.time() + self.neighbor_timeout())
+                # start with v1 until the neighbor shows it supports the compact format
+                self.neighbor_versions[neighbor_id] = 1
 
-            print(f"Server {self.server_id} initialized at {self.server_ip}:{self.server_port}")
-            print(f"Neighbors: {list(self.neighbors.keys())}")
+            logger.info("Server %d initialized at %s:%d", self.server_id, self.server_ip, self.server_port)
+            logger.info("Neighbors: %s", list(self.neighbors.keys()))
 
         except Exception as e:
-            print(f"Error parsing topology file: {e}")
+            logger.error("Error parsing topology file: %s", e)
             sys.exit(1)
 
 
+    def load_server_list(self, servers):
+        """Store the server list, and build the message encoder and address index from it
+
+        Args:
+            servers: Dictionary of server_id -> (ip, port)
+        """
+        for server_id, (ip, port) in servers.items():
+            self.all_servers[server_id] = {'ip': ip, 'port': port}
+
+        capabilities = CAPABILITY_COMPACT if self.wire_version >= COMPACT_VERSION else 0
+        self.encoder = UpdateEncoder(self.server_ip, self.server_port, capabilities, self.max_metric)
+        self.encoder.rebuild(self.all_servers)
+        self.address_index.rebuild(self.all_servers)
+
+
     def initialize_routing_table(self):
         """Initialize routing table with direct neighbor costs and infinity for others
 
@@ -103,11 +236,16 @@ class DVServer:
             * last_update_time: Timestamp of last update
         """
         with self.lock:
+            self.routes_via.clear()
+            self.backups_via.clear()
+            now = self.clock.time()
+
             # add route to self (cost 0)
             self.routing_table[self.server_id] = RoutingEntry(
                 destination_id=self.server_id,
                 next_hop_id=self.server_id,
-                cost=0
+                cost=0,
+                now=now
             )
 
             # add routes to direct neighbors
@@ -115,8 +253,10 @@ class DVServer:
                 self.routing_table[neighbor_id] = RoutingEntry(
                     destination_id=neighbor_id,
                     next_hop_id=neighbor_id,  # direct neighbor (next hop is itself)
-                    cost=neighbor_info['cost']
+                    cost=neighbor_info['cost'],
+                    now=now
                 )
+                self.routes_via[neighbor_id].add(neighbor_id)
 
             # add routes to non-neighbors with inf cost
             for server_id in self.all_servers.keys():
@@ -124,147 +264,537 @@ class DVServer:
                     self.routing_table[server_id] = RoutingEntry(
                         destination_id=server_id,
                         next_hop_id=None,  # no path known
-                        cost=float('inf')
+                        cost=float('inf'),
+                        now=now
                     )
 
 
+    def create_engine(self, name):
+        """Create the route computation engine
+
+        Args:
+            name: 'dict' for the built-in per-destination computation, or
+                'numpy' for the vectorized NumpyRouteEngine
+
+        Returns:
+            Engine object, or None for 'dict'
+        """
+        if name == 'numpy':
+            from dv_numpy import NumpyRouteEngine
+            with self.lock:
+                return NumpyRouteEngine(self)
+        return None
+
+
     def create_socket(self):
         """Create and bind UDP socket to server's port"""
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.socket.bind((self.server_ip, self.server_port))
-            print(f"UDP socket bound to {self.server_ip}:{self.server_port}")
+            logger.info("UDP socket bound to %s:%d", self.server_ip, self.server_port)
         except Exception as e:
-            print(f"Error creating socket: {e}")
+            logger.error("Error creating socket: %s", e)
             sys.exit(1) 
     
     
 
+    def start_metrics_endpoint(self, port):
+        """Serve self.metrics over HTTP on a local port, if port is not None"""
+        if port is None:
+            return
+        httpd = serve_metrics(self.metrics, port)
+        logger.info("Metrics at http://127.0.0.1:%d/metrics", httpd.server_address[1])
+
+
     def parse_update_message(self, data, sender_addr):
         """Parse a received distance vector update message
 
         DATA STRUCTURE: Distance Vector Update Message (Binary Format)
         Format per PDF specification:
-        - Number of update fields (4 bytes)
+        - Number of update fields (4 bytes, top bit set for a segment)
         - Server port (4 bytes)
         - Server IP (4 bytes)
+        - Segments only: sequence (4 bytes), segment index (2), segment count (2)
         - For each entry:
             * Server IP address (4 bytes)
             * Server port (4 bytes)
-            * Padding 0x0 (4 bytes)
+            * Padding 0x0 (4 bytes, capability bits of the sender)
             * Server ID (4 bytes)
             * Cost (4 bytes)
-        """
-        try:
-            offset = 0
 
-            # parse header: num_fields, sender_port, sender_ip
-            num_fields, sender_port = struct.unpack('!II', data[offset:offset+8])
-            offset += 8
+        Neighbors that support it send the compact v2 format instead (see
+        message.py). Segments are applied independently as they arrive;
+        duplicate and stale segments are dropped.
 
-            sender_ip_bytes = data[offset:offset+4]
-            sender_ip = socket.inet_ntoa(sender_ip_bytes)
-            offset += 4
+        Returns:
+            Tuple of (sender_id, message) where message is the decoded
+            UpdateMessage, or (None, None) if the message is invalid
+        """
+        try:
+            start = time.perf_counter()
+            message = decode_update(data)
+            self.decode_time.observe(time.perf_counter() - start)
 
-            # find sender_id by matching IP and port
-            sender_id = None
-            for sid, info in self.all_servers.items():
-                if info['ip'] == sender_ip and info['port'] == sender_port:
-                    sender_id = sid
-                    break
+            # find sender_id from the packed IP and port in the header
+            sender_id = self.address_index.lookup_packed(message.sender_address)
 
             if sender_id is None:
-                print(f"Warning: Received message from unknown server {sender_ip}:{sender_port}")
-                return None, []
-
-            # parse routing entries
-            entries = {}
-            for _ in range(num_fields):
-                # parse: dest_ip (4), dest_port (4), padding (4), dest_id (4), cost (4)
-                dest_ip_bytes = data[offset:offset+4]
-                dest_ip = socket.inet_ntoa(dest_ip_bytes)
-                offset += 4
+                self.unknown_senders.inc()
+                sender_ip, sender_port = unpack_address(message.sender_address)
+                self.dropped_log.log(sender_addr, "Warning: Received message from unknown server %s:%d",
+                                     sender_ip, sender_port)
+                return None, None
 
-                dest_port, padding, dest_id, cost = struct.unpack('!IIII', data[offset:offset+16])
-                offset += 16
+            if message.segment is not None and not self.segment_tracker.accept(sender_id, *message.segment):
+                return None, None
 
-                # convert INFINITY constant back to float('inf')
-                if cost >= INFINITY:
-                    cost = float('inf')
+            self.negotiate_wire_version(sender_id, message)
 
-                entries[dest_id] = cost
+            # apply address changes announced in compact messages
+            for server_id, packed in message.addresses:
+                ip, port = unpack_address(packed)
+                if self.all_servers.get(server_id) != {'ip': ip, 'port': port}:
+                    self.set_server_address(server_id, ip, port)
 
-            return sender_id, entries
+            return sender_id, message
 
         except Exception as e:
-            print(f"Error parsing update message: {e}")
-            return None, [] 
+            self.decode_errors.inc()
+            self.dropped_log.log(sender_addr, "Error parsing update message: %s", e)
+            return None, None 
     
 
 
-    def create_update_message(self):
+    def negotiate_wire_version(self, sender_id, message):
+        """Pick the wire format to send to a neighbor based on a message from it
+
+        A neighbor gets compact (v2) messages once it sends v2 itself or
+        advertises the capability in a v1 message, and falls back to v1 as
+        soon as it sends v1 without the capability.
+
+        Args:
+            sender_id: ID of the neighbor that sent the message
+            message: Decoded UpdateMessage
+        """
+        if sender_id not in self.neighbors or message.capabilities is None:
+            return
+
+        supports_compact = message.version >= COMPACT_VERSION or message.capabilities & CAPABILITY_COMPACT
+        version = COMPACT_VERSION if supports_compact and self.wire_version >= COMPACT_VERSION else 1
+
+        if self.neighbor_versions.get(sender_id) != version:
+            logger.info("Neighbor %d now uses wire format v%d", sender_id, version)
+            self.neighbor_versions[sender_id] = version
+
+
+    def collect_changed_entries(self, full=False):
+        """Collect the routing entries changed since the last update and clear them
+
+        With 'split', a route left out of an update keeps its old cost at the
+        neighbor, so a changed destination is withdrawn again in each of the
+        next TIMEOUT_MULTIPLIER full updates, in case the update that
+        withdrew it was lost. More lost updates than that time the link out.
+
+        Args:
+            full: Collect for a full update: the destinations still to withdraw
+                with 'split', nothing otherwise
+
+        Returns:
+            List of (destination_id, cost, next_hop_ids) tuples
+        """
+        with self.lock:
+            dest_ids = self.changed_destinations
+            if self.split_horizon == 'split':
+                withdrawals = self.split_withdrawals
+                for dest_id in dest_ids:
+                    withdrawals[dest_id] = TIMEOUT_MULTIPLIER
+                if full:
+                    dest_ids = list(withdrawals)
+                    for dest_id in dest_ids:
+                        withdrawals[dest_id] -= 1
+                        if not withdrawals[dest_id]:
+                            del withdrawals[dest_id]
+            elif full:
+                dest_ids = ()
+            routes = [(dest_id, self.routing_table[dest_id].cost, self.routing_table[dest_id].next_hop_ids)
+                      for dest_id in dest_ids]
+            self.changed_destinations.clear()
+        return routes
+
+
+    def advertised_entries(self, routes, neighbor_id=None, withdraw=False):
+        """Apply the split horizon mode to the routes advertised to one neighbor
+
+        With 'split', routes with the neighbor among their next hops are left
+        out; with 'poison', they are advertised as unreachable. Since neighbors
+        keep the last vector they received, a left-out route would keep its
+        old cost there, so with 'split' the changed routes (withdraw=True)
+        are poisoned instead, see collect_changed_entries().
+
+        Args:
+            routes: List of (destination_id, cost, next_hop_ids) tuples
+            neighbor_id: Neighbor the entries are for (None for no filtering)
+            withdraw: The routes changed since the last update
+
+        Returns:
+            List of (destination_id, cost) tuples
+        """
+        if neighbor_id is None or self.split_horizon == 'none':
+            return [(dest_id, cost) for dest_id, cost, _ in routes]
+
+        if self.split_horizon == 'poison' or withdraw:
+            inf = float('inf')
+            return [(dest_id, inf if neighbor_id in next_hop_ids else cost)
+                    for dest_id, cost, next_hop_ids in routes]
+
+        return [(dest_id, cost) for dest_id, cost, next_hop_ids in routes if neighbor_id not in next_hop_ids]
+
+
+    def advertisement_target(self, neighbor_id):
+        """Return the neighbor to tailor advertisements for, or None if all neighbors share one"""
+        return None if self.split_horizon == 'none' else neighbor_id
+
+
+    def full_advertisement(self, version, neighbor_id=None):
+        """Return the encoded full routing table for a wire version
+
+        The table is read from the published snapshot, without the lock.
+        The encoding is cached and only redone when the snapshot's version
+        changes, so sending an unchanged table costs no encoding work. Segmented
+        datagrams are encoded with sequence 0 and must be given the real
+        sequence number with set_sequence before sending.
+
+        Args:
+            version: Wire format version (1 or 2)
+            neighbor_id: Neighbor to apply split horizon for (None for the plain table)
+
+        Returns:
+            List of datagrams
+        """
+        key = (version, neighbor_id)
+        snapshot = self.snapshot
+        cached = self.advertisement_cache.get(key)
+        if cached is not None and cached[0] == snapshot.version:
+            return cached[1]
+
+        entries = self.advertised_entries(snapshot.table_routes(), neighbor_id)
+        datagrams = self.create_update_message(entries, 0, version)
+        self.advertisement_cache[key] = (snapshot.version, datagrams)
+        return datagrams
+
+
+    def create_update_message(self, entries, sequence, version=1, addresses=None):
         """Create a distance vector update message in binary format
 
-        Returns bytes following the DV message format specification
+        Tables that do not fit in one datagram of max_datagram_size bytes are
+        split into segments.
+
+        Args:
+            entries: List of (destination_id, cost) tuples
+            sequence: Advertisement sequence number
+            version: Wire format version (1 or 2)
+            addresses: Server IDs whose address changed (v2 only)
+
+        Returns list of datagrams following the DV message format specification
+        """
+        if addresses:
+            addresses = [(server_id, pack_address(self.all_servers[server_id]['ip'],
+                                                  self.all_servers[server_id]['port']))
+                         for server_id in sorted(addresses)]
+
+        start = time.perf_counter()
+        datagrams = self.encoder.encode_segments(entries, sequence, self.max_datagram_size,
+                                                 version, addresses)
+        self.encode_time.observe(time.perf_counter() - start)
+        return datagrams
+
+
+    def set_server_address(self, server_id, ip, port):
+        """Add a server or change its address
+
+        Keeps the cached message encoding and the address index in sync
+        with the server list
+
+        Args:
+            server_id: ID of the server
+            ip: IP address of the server
+            port: Port of the server
         """
         with self.lock:
-            # get routing table entries (exclude self for distance vector)
-            entries = [(dest_id, entry) for dest_id, entry in self.routing_table.items()]
-
-        # build message
-        num_fields = len(entries)
-        sender_port = self.server_port
-        sender_ip_bytes = socket.inet_aton(self.server_ip)
-
-        # pack header: num_fields, sender_port, sender_ip
-        message = struct.pack('!II', num_fields, sender_port)
-        message += sender_ip_bytes
-
-        # pack each routing entry
-        for dest_id, entry in entries:
-            # get destination server info
-            if dest_id in self.all_servers:
-                dest_info = self.all_servers[dest_id]
-                dest_ip_bytes = socket.inet_aton(dest_info['ip'])
-                dest_port = dest_info['port']
-            else:
-                # unlikely, but handle gracefully
-                dest_ip_bytes = socket.inet_aton('0.0.0.0')
-                dest_port = 0
+            self.all_servers[server_id] = {'ip': ip, 'port': port}
+            if server_id in self.neighbors:
+                self.neighbors[server_id]['ip'] = ip
+                self.neighbors[server_id]['port'] = port
+            self.encoder.rebuild(self.all_servers)
+            self.address_index.add(server_id, ip, port)
+            self.table_version += 1
+            self.publish_snapshot()
 
-            # convert cost: float('inf') -> INFINITY constant
-            cost = entry.cost
-            if cost == float('inf'):
-                cost = INFINITY
+            # compact messages carry the new address to every neighbor once
+            for neighbor_id in self.neighbors:
+                self.pending_addresses[neighbor_id].add(server_id)
 
-            # pack: dest_ip (4), dest_port (4), padding (4), dest_id (4), cost (4)
-            message += dest_ip_bytes
-            message += struct.pack('!IIII', dest_port, 0, dest_id, int(cost))
 
-        return message
+    def send_update_to_neighbors(self, changed_only=False):
+        """Send routing update to all neighbors
 
+        Each neighbor gets the wire format negotiated with it. Without split
+        horizon, messages are encoded once per format and shared between
+        neighbors; otherwise each neighbor gets its own advertisement. Full
+        updates reuse the cached encoding while the table is unchanged.
 
-    def send_update_to_neighbors(self):
-        """Send routing update to all neighbors"""
+        Args:
+            changed_only: Send a triggered update with only the changed destinations
+        """
         if not self.running:
             return
 
-        message = self.create_update_message()
-        print(message)
+        with self.send_lock:
+            if changed_only:
+                routes = self.collect_changed_entries()
+                if not routes:
+                    return
+            else:
+                # a full update carries every changed destination too, except withdrawals with 'split'
+                withdrawals = self.collect_changed_entries(full=True)
+                if withdrawals:
+                    self.send_withdrawals(withdrawals)
 
-        # send to each neighbor
-        for neighbor_id, neighbor_info in self.neighbors.items():
+            self.advertisement_sequence += 1
+            sequence = self.advertisement_sequence
+
+            encoded = {}  # (wire version, target neighbor) -> datagrams
+
+            # send to each neighbor
+            for neighbor_id, neighbor_info in list(self.neighbors.items()):
+                try:
+                    version = self.neighbor_versions.get(neighbor_id, 1)
+                    addresses = self.pending_addresses.pop(neighbor_id, None)
+                    target = self.advertisement_target(neighbor_id)
+
+                    if version == COMPACT_VERSION and addresses:
+                        if changed_only:
+                            entries = self.advertised_entries(routes, target, withdraw=True)
+                        else:
+                            entries = self.advertised_entries(self.snapshot.table_routes(), target)
+                        messages = self.create_update_message(entries, sequence, version, addresses)
+                    else:
+                        key = (version, target)
+                        if key not in encoded:
+                            if changed_only:
+                                entries = self.advertised_entries(routes, target, withdraw=True)
+                                encoded[key] = self.create_update_message(entries, sequence, version)
+                            else:
+                                encoded[key] = [set_sequence(message, sequence)
+                                                for message in self.full_advertisement(version, target)]
+                        messages = encoded[key]
+
+                    neighbor_addr = (neighbor_info['ip'], neighbor_info['port'])
+                    for message in messages:
+                        self.socket.sendto(message, neighbor_addr)
+                        self.sent_bytes.inc(len(message), neighbor_id)
+                    self.sent_packets.inc(len(messages), neighbor_id)
+                    self.sent_log.log(neighbor_id, "SENT %d DATAGRAM(S) (v%d) TO SERVER %d AT %s:%d",
+                                      len(messages), version, neighbor_id, *neighbor_addr)
+                except Exception as e:
+                    logger.error("Error sending update to neighbor %d: %s", neighbor_id, e)
+
+
+    def send_withdrawals(self, routes):
+        """Send the routes that 'split' must still withdraw, ahead of a full update
+
+        Only the routes through a neighbor are sent to it, as unreachable;
+        the full update carries the others. The caller must hold self.send_lock.
+
+        Args:
+            routes: List of (destination_id, cost, next_hop_ids) tuples
+        """
+        self.advertisement_sequence += 1
+        sequence = self.advertisement_sequence
+        inf = float('inf')
+        for neighbor_id, neighbor_info in list(self.neighbors.items()):
             try:
+                entries = [(dest_id, inf) for dest_id, _, next_hop_ids in routes if neighbor_id in next_hop_ids]
+                if not entries:
+                    continue
+                version = self.neighbor_versions.get(neighbor_id, 1)
                 neighbor_addr = (neighbor_info['ip'], neighbor_info['port'])
-                print(f"NEIGHBOR ADDR: {neighbor_addr}")
-                self.socket.sendto(message, neighbor_addr)
-                print(f"SOCKET SENT!")
+                messages = self.create_update_message(entries, sequence, version)
+                for message in messages:
+                    self.socket.sendto(message, neighbor_addr)
+                    self.sent_bytes.inc(len(message), neighbor_id)
+                self.sent_packets.inc(len(messages), neighbor_id)
             except Exception as e:
-                print(f"Error sending update to neighbor {neighbor_id}: {e}") 
+                logger.error("Error sending withdrawals to neighbor %d: %s", neighbor_id, e)
     
 
     
-    def update_routing_table(self, sender_id, entries):
+    def set_route(self, entry, next_hop_id, cost, now=None, next_hop_ids=None):
+        """Change a routing table entry and record the change
+
+        The caller must hold self.lock. Changed destinations are sent in the
+        next triggered update, any change bumps table_version, and the
+        routes_via index follows next hop changes.
+
+        Args:
+            entry: RoutingEntry to change
+            next_hop_id: New next hop (None if unreachable)
+            cost: New cost
+            now: Update timestamp, to share one clock reading between many routes
+            next_hop_ids: Sorted tuple of all equal-cost next hops, including
+                next_hop_id (default: just next_hop_id)
+        """
+        if next_hop_ids is None:
+            next_hop_ids = () if next_hop_id is None else (next_hop_id,)
+
+        if entry.next_hop_ids != next_hop_ids or entry.next_hop_id != next_hop_id:
+            self.table_mutations.inc()
+            self.routes_changed = True
+            self.changed_destinations.add(entry.destination_id)
+            self.snapshot_pending.add(entry.destination_id)
+            self.table_version += 1
+
+            dest_id = entry.destination_id
+            for old_hop in entry.next_hop_ids:
+                if old_hop not in next_hop_ids:
+                    via = self.routes_via[old_hop]
+                    via.discard(dest_id)
+                    if not via:
+                        del self.routes_via[old_hop]
+            for new_hop in next_hop_ids:
+                self.routes_via[new_hop].add(dest_id)
+        elif entry.cost != cost:
+            self.table_mutations.inc()
+            self.routes_changed = True
+            self.changed_destinations.add(entry.destination_id)
+            self.snapshot_pending.add(entry.destination_id)
+            self.table_version += 1
+        entry.next_hop_id = next_hop_id
+        entry.next_hop_ids = shared_next_hops(next_hop_ids)
+        entry.cost = cost
+        entry.last_update_time = self.clock.time() if now is None else now
+
+
+    def set_routes(self, entries, next_hop_ids, costs, all_next_hop_ids, now):
+        """Change many routing table entries at once, see set_route
+
+        Every entry must actually change; the change is recorded once for
+        the whole batch and only the routes_via index is kept per route.
+        The caller must hold self.lock.
+
+        Args:
+            entries: List of RoutingEntry to change
+            next_hop_ids: New next hop of each entry (None if unreachable)
+            costs: New cost of each entry
+            all_next_hop_ids: Shared tuple of all equal-cost next hops of each
+                entry (see router.shared_next_hops)
+            now: Update timestamp
+        """
+        if not entries:
+            return
+        self.table_mutations.inc(len(entries))
+        self.routes_changed = True
+        self.table_version += len(entries)
+        dest_ids = [entry.destination_id for entry in entries]
+        self.changed_destinations.update(dest_ids)
+        self.snapshot_pending.update(dest_ids)
+
+        routes_via = self.routes_via
+        for entry, dest_id, next_hop_id, cost, hops in zip(entries, dest_ids, next_hop_ids, costs,
+                                                            all_next_hop_ids):
+            old_hops = entry.next_hop_ids
+            if old_hops != hops:
+                for old_hop in old_hops:
+                    if old_hop not in hops:
+                        via = routes_via[old_hop]
+                        via.discard(dest_id)
+                        if not via:
+                            del routes_via[old_hop]
+                for new_hop in hops:
+                    routes_via[new_hop].add(dest_id)
+            entry.next_hop_id = next_hop_id
+            entry.next_hop_ids = hops
+            entry.cost = cost
+            entry.last_update_time = now
+
+
+    def set_backup(self, entry, backup_next_hop_id, backup_cost):
+        """Change a route's backup next hop, keeping the backups_via index
+
+        The caller must hold self.lock. The numpy engine finds backups in its
+        own arrays instead, see routes_with_backup().
+
+        Args:
+            entry: RoutingEntry to change
+            backup_next_hop_id: New backup next hop (None for no backup)
+            backup_cost: Cost through the backup next hop
+        """
+        old_backup = entry.backup_next_hop_id
+        if old_backup != backup_next_hop_id:
+            dest_id = entry.destination_id
+            if old_backup is not None:
+                via = self.backups_via[old_backup]
+                via.discard(dest_id)
+                if not via:
+                    del self.backups_via[old_backup]
+            if backup_next_hop_id is not None:
+                self.backups_via[backup_next_hop_id].add(dest_id)
+            entry.backup_next_hop_id = backup_next_hop_id
+        entry.backup_cost = backup_cost
+
+
+    def trigger_update(self):
+        """Request a triggered update if any destination has changed"""
+        if self.changed_destinations:
+            self.update_event.set()
+
+
+    def publish_snapshot(self, full=False, link_changed=None):
+        """Publish a RouteSnapshot of the table if it changed since the last one
+
+        The caller must hold self.lock. Copy-on-write: the new snapshot
+        copies the routes of the previous one and rebuilds only the
+        destinations changed since, then replaces self.snapshot in a single
+        assignment, so readers without the lock see either the old or the
+        new table and never a mix of both.
+
+        Route changes are also reported to the convergence tracker here,
+        once per batch.
+
+        Args:
+            full: Rebuild every route
+            link_changed: Neighbor whose link cost or vector just changed: the
+                routes with it as backup are rebuilt too, since the change can
+                make their backups unusable (or usable again) without
+                changing the routes
+        """
+        if self.routes_changed:
+            self.routes_changed = False
+            self.convergence.table_changed(self.clock.time())
+
+        if link_changed is not None:
+            self.snapshot_pending.update(self.routes_with_backup(link_changed))
+
+        snapshot = self.snapshot
+        if full:
+            pending = self.routing_table
+            routes = {}
+        else:
+            pending = self.snapshot_pending
+            if not pending:
+                if snapshot.version != self.table_version:
+                    self.snapshot = RouteSnapshot(self.table_version, snapshot.routes)
+                return
+            routes = dict(snapshot.routes)
+
+        entries = [self.routing_table[dest_id] for dest_id in pending]
+        for entry, backup in zip(entries, self.usable_backups(entries)):
+            routes[entry.destination_id] = (entry.cost, entry.next_hop_id, entry.next_hop_ids, backup)
+        self.snapshot_pending = set()
+        self.snapshot = RouteSnapshot(self.table_version, routes)
+
+
+    def update_routing_table(self, sender_id, dest_ids, costs, infinity=INFINITY):
         """Update routing table using Bellman-Ford algorithm
 
         Bellman-Ford equation: D_x(y) = min_v{c(x,v) + D_v(y)}
@@ -273,87 +803,401 @@ class DVServer:
         - c(x,v) = cost from x to neighbor v
         - D_v(y) = cost from neighbor v to destination y
 
+        The latest vector from every neighbor is kept, so a destination can
+        fall back to the next-best neighbor as soon as its route gets worse.
+
         Args:
             sender_id: ID of the neighbor sending the update
-            entries: Dictionary of {destination_id: cost} from sender's routing table
+            dest_ids: Destination IDs from sender's routing table
+            costs: Sender's cost to each destination (parallel to dest_ids)
+            infinity: Cost value meaning unreachable in costs
+
+        Returns:
+            True if the routing table changed
         """
+        with self.lock:
+            table_changed = self.apply_update(sender_id, dest_ids, costs, infinity)
+            self.publish_snapshot()
+
+        if table_changed:
+            self.trigger_update()
+
+        return table_changed 
+
+
+    def apply_update(self, sender_id, dest_ids, costs, infinity=INFINITY):
+        """Apply one received distance vector to the routing table
+
+        The sender's vector is merged into the stored copy, and only the
+        destinations whose advertised cost changed are recomputed. The
+        caller must hold self.lock; see update_routing_table.
+
+        Returns:
+            True if the routing table changed
+        """
+        if self.engine is not None:
+            return self.engine.apply_update(sender_id, dest_ids, costs, infinity)
+
         # verify sender is a neighbor
         if sender_id not in self.neighbors:
-            return
+            return False
+
+        vector = self.neighbor_vectors.setdefault(sender_id, {})
+        affected = []
+        unreachable = min(infinity, self.max_metric)
+
+        # for each destination in the received distance vector
+        for dest_id, sender_cost in zip(dest_ids, costs):
+            # skip if destination is self, or the sender (its cost to itself is 0)
+            if dest_id == self.server_id or dest_id == sender_id:
+                continue
 
-        # Ggt cost to sender (neighbor)
-        cost_to_sender = self.neighbors[sender_id]['cost']
+            # convert the wire infinity, and costs at the max metric, back to float('inf')
+            if sender_cost >= unreachable:
+                sender_cost = float('inf')
+
+            if vector.get(dest_id) != sender_cost:
+                vector[dest_id] = sender_cost
+                affected.append(dest_id)
 
         table_changed = False
+        for dest_id in affected:
+            if self.recompute_route(dest_id):
+                table_changed = True
 
-        with self.lock:
-            # for each destination in the received distance vector
-            for dest_id, sender_cost in entries.items():
-                # skip if destination is self
-                if dest_id == self.server_id:
+        return table_changed
+
+
+    def recompute_route(self, dest_id):
+        """Recompute the route to a destination from the stored neighbor vectors
+
+        D_x(y) = min_v{c(x,v) + D_v(y)} over all neighbors v. On a tie the
+        current next hop is kept, and all tied neighbors become the route's
+        equal-cost next hops. A cost at or above max_metric means
+        unreachable. The caller must hold self.lock.
+
+        The cheapest other neighbor whose reported distance D_v(y) is below
+        the new cost (the feasibility condition) is kept as the backup next
+        hop: it cannot be routing through this server, so fail_over can
+        switch to it without waiting for new advertisements.
+
+        Args:
+            dest_id: Destination to recompute
+
+        Returns:
+            True if the route changed
+        """
+        if dest_id == self.server_id:
+            return False
+
+        entry = self.routing_table.get(dest_id)
+        if entry is None:
+            # unknown destination, initialize with inf
+            entry = RoutingEntry(destination_id=dest_id, next_hop_id=None, cost=float('inf'),
+                                 now=self.clock.time())
+            self.routing_table[dest_id] = entry
+            self.snapshot_pending.add(dest_id)
+            self.table_version += 1
+
+        best_cost = float('inf')
+        best_next_hop = None
+        candidates = []  # (neighbor_id, cost, reported distance)
+        for neighbor_id, neighbor_info in self.neighbors.items():
+            # a neighbor's cost to itself is 0, even before it has advertised
+            if neighbor_id == dest_id:
+                reported = 0
+            else:
+                vector = self.neighbor_vectors.get(neighbor_id)
+                if vector is None or dest_id not in vector:
                     continue
+                reported = vector[dest_id]
+            cost = neighbor_info['cost'] + reported
+            candidates.append((neighbor_id, cost, reported))
+
+            if cost < best_cost or (cost == best_cost and neighbor_id == entry.next_hop_id):
+                best_cost = cost
+                best_next_hop = neighbor_id
+
+        if best_cost >= self.max_metric:
+            best_cost = float('inf')
+            best_next_hop = None
+            next_hop_ids = ()
+        else:
+            next_hop_ids = tuple(sorted(neighbor_id for neighbor_id, cost, _ in candidates if cost == best_cost))
+
+        # feasible successor: reported distance below the new cost
+        backup_cost = float('inf')
+        backup_next_hop = None
+        for neighbor_id, cost, reported in candidates:
+            if neighbor_id != best_next_hop and reported < best_cost and cost < backup_cost:
+                backup_cost = cost
+                backup_next_hop = neighbor_id
+        if backup_cost >= self.max_metric:
+            backup_cost = float('inf')
+            backup_next_hop = None
+        published = self.snapshot.routes.get(dest_id)
+        if published is None or published[3] != backup_next_hop:
+            # also when unchanged here: the published backup may have been unusable when it was taken
+            self.snapshot_pending.add(dest_id)
+        self.set_backup(entry, backup_next_hop, backup_cost)
+
+        if (entry.cost == best_cost and entry.next_hop_id == best_next_hop
+                and entry.next_hop_ids == next_hop_ids):
+            return False
+
+        self.set_route(entry, best_next_hop, best_cost, next_hop_ids=next_hop_ids)
+        return True
+
+
+    def recompute_routes(self, dest_ids):
+        """Recompute the routes to some destinations from the stored neighbor vectors
+
+        The caller must hold self.lock.
 
-                # calculate new cost via this neighbor
-                # new_cost = cost(self -> sender) + cost(sender -> dest)
-                new_cost = cost_to_sender + sender_cost
-
-                # get current cost to destination
-                if dest_id in self.routing_table:
-                    current_entry = self.routing_table[dest_id]
-                    current_cost = current_entry.cost
-                else:
-                    # unknown destination, initialize with inf
-                    current_cost = float('inf')
-                    self.routing_table[dest_id] = RoutingEntry(
-                        destination_id=dest_id,
-                        next_hop_id=None,
-                        cost=float('inf')
-                    )
-                    current_entry = self.routing_table[dest_id]
+        Args:
+            dest_ids: Destinations to recompute
 
-                # update if new path is better
-                if new_cost < current_cost:
-                    current_entry.next_hop_id = sender_id
-                    current_entry.cost = new_cost
-                    current_entry.last_update_time = time.time()
-                    table_changed = True
+        Returns:
+            True if any route changed
+        """
+        if self.engine is not None:
+            return self.engine.recompute_routes(dest_ids)
 
-                # if current path goes through sender, update cost even if not better
-                # (sender's view of the network changed)
-                elif current_entry.next_hop_id == sender_id and new_cost != current_cost:
-                    current_entry.cost = new_cost
-                    current_entry.last_update_time = time.time()
-                    table_changed = True
+        table_changed = False
+        for dest_id in dest_ids:
+            if self.recompute_route(dest_id):
+                table_changed = True
+        return table_changed
 
-        return table_changed 
-    
+
+    def recompute_routes_via(self, neighbor_id):
+        """Recompute every route that a link cost change to a neighbor can affect
+
+        That is the neighbor itself, the destinations it advertises, and the
+        destinations currently routed through it. The caller must hold self.lock.
+
+        Args:
+            neighbor_id: Neighbor whose link cost or vector changed
+
+        Returns:
+            True if any route changed
+        """
+        if self.engine is not None:
+            return self.engine.recompute_routes_via(neighbor_id)
+
+        affected = {neighbor_id}
+        affected.update(self.neighbor_vectors.get(neighbor_id, ()))
+        affected.update(self.routes_via.get(neighbor_id, ()))
+
+        table_changed = False
+        for dest_id in affected:
+            if self.recompute_route(dest_id):
+                table_changed = True
+        return table_changed
+
+
+    def fail_over(self, neighbor_id):
+        """Move the routes through a failed neighbor to their backup next hops
+
+        Routes that have other equal-cost next hops just drop the neighbor,
+        routes with a usable feasible successor switch to it at once (see
+        switch_to_backups), and the switch is published so lookups stop
+        using the neighbor before any Bellman-Ford runs. Then every route
+        that went via the neighbor, and the neighbor itself, is recomputed
+        from the remaining vectors: a backup is loop-free but not always the
+        cheapest remaining route, and a failed neighbor sends no further
+        vector that would correct it. The routes that had the neighbor as
+        backup are recomputed too, to find another feasible successor. The
+        caller must hold self.lock and have set the neighbor's cost to inf
+        and dropped its vector.
+
+        Args:
+            neighbor_id: Neighbor that failed
+
+        Returns:
+            True if any route changed
+        """
+        switched = self.switch_to_backups(neighbor_id)
+        if switched:
+            self.publish_snapshot(link_changed=neighbor_id)
+
+        # only the routes left without a next hop still go via the neighbor
+        table_changed = self.recompute_routes_via(neighbor_id)
+        if self.recompute_routes(switched + list(self.routes_with_backup(neighbor_id))):
+            table_changed = True
+        return table_changed or bool(switched)
+
+
+    def switch_to_backups(self, neighbor_id):
+        """Move the routes through a failed neighbor to their other next hops or backups
+
+        This is the part of fail_over that needs no Bellman-Ford: a route
+        either drops the neighbor from its equal-cost next hops or switches
+        to its backup, after one check of the backup's feasibility. Routes
+        with neither stay in routes_via for the neighbor. The caller must
+        hold self.lock.
+
+        Args:
+            neighbor_id: Neighbor that failed
+
+        Returns:
+            List of the destinations whose route changed
+        """
+        if self.engine is not None:
+            return self.engine.switch_to_backups(neighbor_id)
+
+        switched = []
+        now = self.clock.time()
+        for dest_id in list(self.routes_via.get(neighbor_id, ())):
+            entry = self.routing_table[dest_id]
+            remaining = tuple(next_hop_id for next_hop_id in entry.next_hop_ids if next_hop_id != neighbor_id)
+            if entry.next_hop_id != neighbor_id:
+                # one of several equal-cost next hops failed, the route still goes via the others
+                self.set_route(entry, entry.next_hop_id, entry.cost, now, remaining)
+                if entry.backup_next_hop_id == neighbor_id:
+                    self.set_backup(entry, None, float('inf'))
+                switched.append(dest_id)
+                continue
+
+            backup, backup_cost = self.usable_backup(entry)
+            if backup is not None:
+                if backup not in remaining:
+                    remaining = (backup,)
+                self.set_route(entry, backup, backup_cost, now, remaining)
+                self.set_backup(entry, None, float('inf'))
+                switched.append(dest_id)
+        return switched
+
+
+    def usable_backup(self, entry):
+        """Check a route's backup next hop against the current link costs and vectors
+
+        Backups are only refreshed when their route is recomputed, so the
+        backup neighbor may have failed or changed since. The feasibility
+        condition is checked again here in O(1).
+
+        Args:
+            entry: RoutingEntry to check
+
+        Returns:
+            (backup next hop, cost through it), or (None, inf) if it is not usable
+        """
+        if self.engine is not None:
+            return self.engine.usable_backup(entry)
+
+        backup = entry.backup_next_hop_id
+        if backup is None or backup not in self.neighbors:
+            return None, float('inf')
+
+        dest_id = entry.destination_id
+        if backup == dest_id:
+            reported = 0
+        else:
+            reported = self.neighbor_vectors.get(backup, {}).get(dest_id, float('inf'))
+        cost = self.neighbors[backup]['cost'] + reported
+        if reported >= entry.cost or cost >= self.max_metric:
+            return None, float('inf')
+        return backup, cost
+
+
+    def routes_with_backup(self, neighbor_id):
+        """Return the destinations whose backup next hop is a neighbor
+
+        The caller must hold self.lock.
+        """
+        if self.engine is not None:
+            return self.engine.routes_with_backup(neighbor_id)
+        return self.backups_via.get(neighbor_id, ())
+
+
+    def usable_backups(self, entries):
+        """Return the usable backup next hop (or None) of each entry, see usable_backup()"""
+        if self.engine is not None:
+            return self.engine.usable_backups(entries)
+        return [None if entry.backup_next_hop_id is None else self.usable_backup(entry)[0]
+                for entry in entries]
+
+
+    def lookup(self, dest_id, flow=None):
+        """Return the next hop to forward a flow to a destination
+
+        Reads the published snapshot, so it never waits for self.lock.
+        Flows are spread over the route's equal-cost next hops with a stable
+        hash (see router.select_next_hop), so packets of one flow keep the
+        same path.
+
+        Args:
+            dest_id: Destination server ID
+            flow: Flow key, or None for the primary next hop
+
+        Returns:
+            Next hop server ID, or None if the destination is unreachable or unknown
+        """
+        return self.snapshot.lookup(dest_id, flow)
+
+
+    def drop_neighbor_vector(self, neighbor_id):
+        """Forget the distance vector last advertised by a neighbor
+
+        The caller must hold self.lock and recompute the routes via the
+        neighbor afterwards.
+        """
+        self.neighbor_vectors.pop(neighbor_id, None)
+        self.neighbors_heard.discard(neighbor_id)
+        if self.engine is not None:
+            self.engine.drop_vector(neighbor_id)
+
+
+
+    def neighbor_timeout(self):
+        """Return the seconds without updates after which a neighbor is considered dead
+
+        That is TIMEOUT_MULTIPLIER intervals plus a grace period: the update
+        due exactly TIMEOUT_MULTIPLIER intervals after the last one is still
+        on its way then, and only if it is lost as well has the neighbor
+        missed TIMEOUT_MULTIPLIER updates in a row.
+        """
+        return (TIMEOUT_MULTIPLIER + TIMEOUT_GRACE) * self.update_interval
+
+
+    def next_neighbor_deadline(self):
+        """Return the time the next neighbor times out, or None if no neighbor can"""
+        with self.lock:
+            return self.neighbor_deadlines.next_deadline()
 
 
     def check_neighbor_timeouts(self):
         """Check for neighbors that haven't sent updates recently
 
         If no update received for 3 consecutive intervals, mark neighbor as dead
-        by setting link cost to infinity
+        by setting link cost to infinity. Its stored vector is dropped and the
+        routes through it switch to their backup next hops, or to the best
+        remaining neighbor.
+
+        Each neighbor has a deadline in neighbor_deadlines that every update
+        from it pushes back, so only the neighbors whose deadline has passed
+        are looked at. Call this when next_neighbor_deadline() is reached.
         """
-        current_time = time.time()
-        timeout_threshold = TIMEOUT_MULTIPLIER * self.update_interval
+        current_time = self.clock.time()
 
         with self.lock:
-            for neighbor_id, last_update in list(self.neighbor_last_update.items()):
-                time_since_update = current_time - last_update
-
-                # check if neighbor has timed out
-                if time_since_update > timeout_threshold:
-                    # set neighbor cost to infinity (but keep entry)
-                    if self.neighbors[neighbor_id]['cost'] != float('inf'):
-                        print(f"Neighbor {neighbor_id} timed out (no update for {time_since_update:.1f}s)")
-                        self.neighbors[neighbor_id]['cost'] = float('inf')
-
-                        # update routing table entries that use this neighbor
-                        for dest_id, entry in self.routing_table.items():
-                            if entry.next_hop_id == neighbor_id:
-                                entry.cost = float('inf')
-                                entry.last_update_time = time.time() 
+            for neighbor_id in self.neighbor_deadlines.pop_expired(current_time):
+                time_since_update = current_time - self.neighbor_last_update[neighbor_id]
+
+                # set neighbor cost to infinity (but keep entry)
+                if self.neighbors[neighbor_id]['cost'] != float('inf'):
+                    logger.warning("Neighbor %d timed out (no update for %.1fs)", neighbor_id, time_since_update)
+                    self.convergence.event('timeout', neighbor_id, current_time)
+                    self.neighbors[neighbor_id]['cost'] = float('inf')
+                    self.segment_tracker.reset(neighbor_id)
+                    self.neighbor_versions[neighbor_id] = 1
+                    self.drop_neighbor_vector(neighbor_id)
+
+                    # move routes through this neighbor to their backups
+                    self.fail_over(neighbor_id)
+                    self.publish_snapshot(link_changed=neighbor_id)
+
+        self.trigger_update()
     
 
     def handle_update_command(self, server1, server2, new_cost):
@@ -390,12 +1234,14 @@ class DVServer:
 
             # update the link cost
             with self.lock:
+                self.convergence.event('update', neighbor_id, self.clock.time())
                 self.neighbors[neighbor_id]['cost'] = new_cost
 
-                # update routing table entry for this neighbor
-                if neighbor_id in self.routing_table:
-                    self.routing_table[neighbor_id].cost = new_cost
-                    self.routing_table[neighbor_id].last_update_time = time.time()
+                # recompute the routes the new cost can affect
+                self.recompute_routes_via(neighbor_id)
+                self.publish_snapshot(link_changed=neighbor_id)
+
+            self.trigger_update()
 
             return f"update {server1} {server2} {new_cost} SUCCESS"
 
@@ -420,25 +1266,81 @@ class DVServer:
             if server_id not in self.neighbors:
                 return f"disable {server_id} Error: Server {server_id} is not a neighbor"
 
-            # set link cost to infinity
+            # set link cost to infinity and forget the neighbor's vector
             with self.lock:
+                self.convergence.event('disable', server_id, self.clock.time())
                 self.neighbors[server_id]['cost'] = float('inf')
+                self.drop_neighbor_vector(server_id)
 
-                # update routing table
-                if server_id in self.routing_table:
-                    self.routing_table[server_id].cost = float('inf')
-                    self.routing_table[server_id].last_update_time = time.time()
+                # move routes through this neighbor to their backups
+                self.fail_over(server_id)
+                self.publish_snapshot(link_changed=server_id)
 
-                # update all routes that go through this neighbor
-                for dest_id, entry in self.routing_table.items():
-                    if entry.next_hop_id == server_id:
-                        entry.cost = float('inf')
-                        entry.last_update_time = time.time()
+            self.trigger_update()
 
             return f"disable {server_id} SUCCESS"
 
         except ValueError as e:
             return f"disable {server_id} Error: Invalid server ID - {e}" 
+
+
+    def handle_profile_command(self, args):
+        """Handle the profile command to sample the stacks of all threads
+
+        profile start starts sampling, profile stop stops it and
+        profile dump <file> writes the samples so far to a report file.
+
+        Args:
+            args: Command arguments after 'profile'
+
+        Returns:
+            Success message or error message
+        """
+        command = ' '.join(['profile'] + args)
+        action = args[0].lower() if args else None
+        try:
+            if action == 'start' and len(args) == 1:
+                self.profiler.start()
+            elif action == 'stop' and len(args) == 1:
+                self.profiler.stop()
+            elif action == 'dump' and len(args) == 2:
+                self.profiler.dump(args[1])
+            else:
+                return "profile Error: Usage: profile start|stop|dump <file>"
+            return f"{command} SUCCESS"
+
+        except (RuntimeError, OSError) as e:
+            return f"{command} Error: {e}"
+
+
+    def handle_memprofile_command(self, args):
+        """Handle the memprofile command to trace memory allocations
+
+        memprofile start starts tracemalloc, memprofile snapshot <file>
+        writes the largest allocation sites (and their growth since the
+        previous snapshot) to a report file, memprofile stop stops tracing.
+
+        Args:
+            args: Command arguments after 'memprofile'
+
+        Returns:
+            Success message or error message
+        """
+        command = ' '.join(['memprofile'] + args)
+        action = args[0].lower() if args else None
+        try:
+            if action == 'start' and len(args) == 1:
+                self.memory_profiler.start()
+            elif action == 'stop' and len(args) == 1:
+                self.memory_profiler.stop()
+            elif action == 'snapshot' and len(args) == 2:
+                self.memory_profiler.snapshot(args[1])
+            else:
+                return "memprofile Error: Usage: memprofile start|snapshot <file>|stop"
+            return f"{command} SUCCESS"
+
+        except (RuntimeError, OSError) as e:
+            return f"{command} Error: {e}"
     
     
     def handle_crash_command(self):
@@ -463,92 +1365,204 @@ class DVServer:
         """Display the current routing table in sorted order
 
         Format: <destination-server-ID> <next-hop-server-ID> <cost-of-path>
-        One entry per line, sorted by destination server ID
+        One entry per line, sorted by destination server ID. A route with
+        several equal-cost next hops shows them all, separated by commas.
+        The table is read from the published snapshot, without the lock.
         """
-        with self.lock:
-            # get all routing entries sorted by destination ID
-            sorted_entries = sorted(self.routing_table.items(), key=lambda x: x[0])
+        # get all routes sorted by destination ID
+        sorted_routes = sorted(self.snapshot.routes.items(), key=lambda x: x[0])
 
         print("display SUCCESS")
-        for dest_id, entry in sorted_entries:
+        for dest_id, (cost, next_hop_id, next_hop_ids, backup) in sorted_routes:
             # format next hop - use '-' if no path known
-            next_hop = entry.next_hop_id if entry.next_hop_id is not None else '-'
+            next_hop = ','.join(map(str, next_hop_ids)) if next_hop_id is not None else '-'
 
             # format cost - use 'inf' for infinity
-            if entry.cost == float('inf'):
+            if cost == float('inf'):
                 cost_str = 'inf'
             else:
-                cost_str = str(int(entry.cost))
+                cost_str = str(int(cost))
 
             print(f"{dest_id} {next_hop} {cost_str}")
 
         # Print detailed routing table view
         print("\n=== Detailed Routing Table ===")
-        for dest_id, entry in sorted_entries:
-            next_hop_str = str(entry.next_hop_id) if entry.next_hop_id is not None else "None"
-            cost_str = "inf" if entry.cost == float('inf') else str(entry.cost)
-            print(f"  Dest: {dest_id:3d} | Next Hop: {next_hop_str:4s} | Cost: {cost_str:>6s}")
+        for dest_id, (cost, next_hop_id, next_hop_ids, backup) in sorted_routes:
+            next_hop_str = ','.join(map(str, next_hop_ids)) if next_hop_id is not None else "None"
+            cost_str = "inf" if cost == float('inf') else str(cost)
+            backup_str = str(backup) if backup is not None else "-"
+            print(f"  Dest: {dest_id:3d} | Next Hop: {next_hop_str:4s} | Cost: {cost_str:>6s} | Backup: {backup_str}")
         print("=" * 30)  
     
 
 
+    def display_convergence(self):
+        """Display the convergence time of recent topology events
+
+        Format: <event-ID> <event> <neighbor-ID> <route-change-batches> <seconds>
+        Seconds is 'pending' while the table is still changing
+        """
+        with self.lock:
+            self.convergence.check(self.clock.time())
+            events = self.convergence.events()
+
+        print("convergence SUCCESS")
+        for event in events:
+            duration = event.duration()
+            duration_str = 'pending' if duration is None else f"{duration:.3f}"
+            print(f"{event.event_id} {event.kind} {event.neighbor_id} {event.changes} {duration_str}")
+
+
+    def periodic_update(self):
+        """Check for neighbor timeouts and converged events, and send a full update to all neighbors"""
+        # check for neighbor timeouts
+        self.check_neighbor_timeouts()
+
+        with self.lock:
+            self.convergence.check(self.clock.time())
+
+        # send updates to all neighbors (full refresh)
+        self.send_update_to_neighbors()
+
+
     def periodic_update_thread(self):
         """Thread for sending periodic routing updates
 
-        Sends updates at regular intervals and checks for neighbor timeouts
+        Sends full updates at regular intervals and checks for neighbor timeouts
+        as soon as the earliest neighbor deadline passes. Between full updates,
+        changed routes are sent promptly as triggered updates carrying only
+        the changed destinations.
         """
+        next_full_update = self.clock.time() + self.update_interval
+
         while self.running:
-            time.sleep(self.update_interval)
+            # wait for the next full update, neighbor deadline or triggered update
+            wake_time = next_full_update
+            next_deadline = self.next_neighbor_deadline()
+            if next_deadline is not None:
+                wake_time = min(wake_time, next_deadline)
+            triggered = self.update_event.wait(max(0, wake_time - self.clock.time()))
 
             if not self.running:
                 break
 
-            # check for neighbor timeouts
-            self.check_neighbor_timeouts()
+            if next_deadline is not None and self.clock.time() >= next_deadline:
+                self.check_neighbor_timeouts()
 
-            # send updates to all neighbors
-            self.send_update_to_neighbors()  
+            if triggered:
+                # give closely spaced changes a moment to accumulate
+                self.clock.sleep(TRIGGERED_UPDATE_DELAY)
+                self.update_event.clear()
+
+            if self.clock.time() >= next_full_update:
+                next_full_update = self.clock.time() + self.update_interval
+                self.periodic_update()
+            else:
+                self.send_update_to_neighbors(changed_only=True)  
     
 
 
     def receive_thread(self):
         """Thread for receiving and processing messages
 
-        Listens for UDP packets and processes distance vector updates
+        Listens for UDP packets and processes distance vector updates. Once
+        the socket is readable, all queued datagrams (up to receive_batch)
+        are drained without blocking, decoded, and applied to the routing
+        table under a single lock acquisition.
         """
+        self.socket.setblocking(False)
+
         while self.running:
             try:
-                # set timeout to check self.running periodically
-                self.socket.settimeout(1.0)
-
-                try:
-                    data, sender_addr = self.socket.recvfrom(4096)
-                except socket.timeout:
+                # wait for data, with a timeout to check self.running periodically
+                readable, _, _ = select.select([self.socket], [], [], 1.0)
+                if not readable:
                     continue
 
+                batch = self.receive_batch_from_socket()
+
                 if not self.running:
                     break
 
-                # increment packet counter
-                self.packets_received += 1
+                if batch:
+                    self.process_batch(batch)
 
-                # parse the update message
-                sender_id, entries = self.parse_update_message(data, sender_addr)
+            except Exception as e:
+                if self.running:
+                    logger.error("Error in receive thread: %s", e)
 
-                if sender_id is not None:
-                    print(f"RECEIVED A MESSAGE FROM SERVER {sender_id}")
 
-                    # update neighbor's last update time
-                    if sender_id in self.neighbor_last_update:
-                        self.neighbor_last_update[sender_id] = time.time()
+    def receive_batch_from_socket(self):
+        """Read every datagram currently queued on the socket, up to receive_batch
 
-                    # update routing table with Bellman-Ford
-                    self.update_routing_table(sender_id, entries)
+        A socket error after some datagrams were read stops the drain, and
+        the datagrams read so far are still returned.
+
+        Returns:
+            List of (data, sender_addr) tuples
+        """
+        batch = []
+        while len(batch) < self.receive_batch:
+            try:
+                batch.append(self.socket.recvfrom(self.max_datagram_size))
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                if not batch:
+                    raise
+                logger.error("Error in receive thread: %s", e)
+                break
+
+        if batch:
+            self.batch_sizes[len(batch)] += 1
+        return batch
+
+
+    def process_batch(self, batch):
+        """Decode a batch of datagrams and apply them under one lock acquisition
+
+        Args:
+            batch: List of (data, sender_addr) tuples
+        """
+        # parse the update messages
+        updates = []
+        for data, sender_addr in batch:
+            sender_id, message = self.parse_update_message(data, sender_addr)
+            if sender_id is not None:
+                self.received_log.log(sender_id, "RECEIVED A MESSAGE FROM SERVER %d", sender_id)
+                self.received_packets.inc(1, sender_id)
+                self.received_bytes.inc(len(data), sender_id)
+                updates.append((sender_id, message))
+
+        table_changed = False
+        with self.lock:
+            # increment packet counter
+            self.packets_received += len(batch)
+            if not updates:
+                return
+
+            now = self.clock.time()
+            deadline = now + self.neighbor_timeout()
+            for sender_id, message in updates:
+                # update neighbor's last update time and push back its timeout
+                if sender_id in self.neighbor_last_update:
+                    self.neighbor_last_update[sender_id] = now
+                    self.neighbor_deadlines.set(sender_id, deadline)
+
+                # the first update from a neighbor whose link is up
+                if (sender_id not in self.neighbors_heard and sender_id in self.neighbors
+                        and self.neighbors[sender_id]['cost'] != float('inf')):
+                    self.neighbors_heard.add(sender_id)
+                    self.convergence.event('neighbor-up', sender_id, now)
+
+                # update routing table with Bellman-Ford
+                if self.apply_update(sender_id, message.dest_ids, message.costs, message.infinity):
+                    table_changed = True
+            self.publish_snapshot()
+
+        if table_changed:
+            self.trigger_update()
 
-            except Exception as e:
-                if self.running:
-                    print(f"Error in receive thread: {e}")  
-    
 
 
     def command_thread(self):
@@ -556,56 +1570,88 @@ class DVServer:
 
         Reads commands from stdin and executes them
         """
-        print("\nServer ready. Enter commands (update, step, packets, display, disable, crash):")
+        print(f"\nServer ready. Enter commands ({COMMANDS}):")
 
         while self.running:
             try:
-                command_line = input().strip()
+                command_line = input()
+                self.execute_command(command_line)
 
-                if not command_line:
-                    continue
+            except EOFError:
+                # handle EOF
+                break
+            except Exception as e:
+                if self.running:
+                    logger.error("Error processing command: %s", e)
 
-                parts = command_line.split()
-                command = parts[0].lower()
 
-                if command == 'update':
-                    if len(parts) != 4:
-                        print("update Error: Usage: update <server-ID1> <server-ID2> <cost>")
-                    else:
-                        result = self.handle_update_command(parts[1], parts[2], parts[3])
-                        print(result)
+    def execute_command(self, command_line):
+        """Execute one user command
 
-                elif command == 'step':
-                    print("step SUCCESS")
-                    self.send_update_to_neighbors()
+        Args:
+            command_line: Command as typed by the user
+        """
+        command_line = command_line.strip()
 
-                elif command == 'packets':
-                    print(f"packets SUCCESS")
-                    print(f"{self.packets_received}")
-                    self.packets_received = 0
+        if not command_line:
+            return
 
-                elif command == 'display':
-                    self.display_routing_table()
+        parts = command_line.split()
+        command = parts[0].lower()
 
-                elif command == 'disable':
-                    if len(parts) != 2:
-                        print("disable Error: Usage: disable <server-ID>")
-                    else:
-                        result = self.handle_disable_command(parts[1])
-                        print(result)
+        if command == 'update':
+            if len(parts) != 4:
+                print("update Error: Usage: update <server-ID1> <server-ID2> <cost>")
+            else:
+                result = self.handle_update_command(parts[1], parts[2], parts[3])
+                print(result)
 
-                elif command == 'crash':
-                    self.handle_crash_command()
+        elif command == 'step':
+            print("step SUCCESS")
+            self.send_update_to_neighbors()
 
-                else:
-                    print(f"Unknown command: {command}")
+        elif command == 'packets':
+            with self.lock:
+                packets_received = self.packets_received
+                self.packets_received = 0
+            print(f"packets SUCCESS")
+            print(f"{packets_received}")
 
-            except EOFError:
-                # handle EOF
-                break
-            except Exception as e:
-                if self.running:
-                    print(f"Error processing command: {e}") 
+        elif command == 'display':
+            self.display_routing_table()
+
+        elif command == 'batches':
+            print("batches SUCCESS")
+            for size, count in sorted(self.batch_sizes.items()):
+                print(f"{size} {count}")
+
+        elif command == 'metrics':
+            with self.lock:
+                self.convergence.check(self.clock.time())
+            print("metrics SUCCESS")
+            print(self.metrics.render(), end='')
+
+        elif command == 'convergence':
+            self.display_convergence()
+
+        elif command == 'profile':
+            print(self.handle_profile_command(parts[1:]))
+
+        elif command == 'memprofile':
+            print(self.handle_memprofile_command(parts[1:]))
+
+        elif command == 'disable':
+            if len(parts) != 2:
+                print("disable Error: Usage: disable <server-ID>")
+            else:
+                result = self.handle_disable_command(parts[1])
+                print(result)
+
+        elif command == 'crash':
+            self.handle_crash_command()
+
+        else:
+            print(f"Unknown command: {command}")
     
     def run(self):
         """Main server execution
@@ -613,11 +1659,11 @@ class DVServer:
         Starts all threads and waits for them to complete
         """
         # start periodic update thread
-        update_thread = threading.Thread(target=self.periodic_update_thread, daemon=True)
+        update_thread = threading.Thread(target=self.periodic_update_thread, name='update', daemon=True)
         update_thread.start()
 
         # start receive thread
-        recv_thread = threading.Thread(target=self.receive_thread, daemon=True)
+        recv_thread = threading.Thread(target=self.receive_thread, name='receive', daemon=True)
         recv_thread.start()
 
         # start command thread (runs in main thread to handle input properly)
@@ -637,13 +1683,57 @@ def main():
     parser = argparse.ArgumentParser(description='Distance Vector Routing Protocol Server')
     parser.add_argument('-t', '--topology', required=True, help='Topology file name')
     parser.add_argument('-i', '--interval', required=True, type=int, help='Routing update interval in seconds')
+    parser.add_argument('-m', '--max-datagram', type=int, default=DEFAULT_MAX_DATAGRAM,
+                        help=f'Maximum update datagram size in bytes, same on all servers (default: {DEFAULT_MAX_DATAGRAM})')
+    parser.add_argument('-w', '--wire-version', type=int, choices=[1, COMPACT_VERSION], default=COMPACT_VERSION,
+                        help='Highest wire format version to use with neighbors that support it (default: 2)')
+    parser.add_argument('-b', '--receive-batch', type=int, default=DEFAULT_RECEIVE_BATCH,
+                        help=f'Most datagrams to drain and apply per batch (default: {DEFAULT_RECEIVE_BATCH})')
+    parser.add_argument('-r', '--runtime', choices=['threads', 'asyncio'], default='threads',
+                        help='Run with one thread per task or on an asyncio event loop (default: threads)')
+    parser.add_argument('-s', '--split-horizon', choices=SPLIT_HORIZON_MODES, default=DEFAULT_SPLIT_HORIZON,
+                        help='Advertise routes back to their next hop normally (none), not at all (split) '
+                             f'or as unreachable (poison) (default: {DEFAULT_SPLIT_HORIZON})')
+    parser.add_argument('-x', '--max-metric', type=float, default=INFINITY,
+                        help='Route cost at or above which a destination is unreachable; a small value '
+                             f'bounds counting to infinity (default: {INFINITY})')
+    parser.add_argument('-e', '--engine', choices=ENGINES, default='dict',
+                        help='Route computation engine; numpy vectorizes Bellman-Ford for large tables (default: dict)')
+    parser.add_argument('-p', '--metrics-port', type=int,
+                        help='Serve metrics in the Prometheus text format on http://127.0.0.1:<port>/metrics '
+                             '(default: off)')
+    parser.add_argument('-l', '--log-level', choices=LOG_LEVELS, default=DEFAULT_LOG_LEVEL,
+                        help='Least severe log messages to show; debug adds every sent update '
+                             f'(default: {DEFAULT_LOG_LEVEL})')
 
     args = parser.parse_args()
 
+    if args.max_datagram < 40 or args.max_datagram > 65507:
+        parser.error("--max-datagram must be between 40 and 65507")
+    if args.receive_batch < 1:
+        parser.error("--receive-batch must be at least 1")
+    if not 0 < args.max_metric <= INFINITY:
+        parser.error(f"--max-metric must be between 0 and {INFINITY}")
+    if args.metrics_port is not None and not 0 <= args.metrics_port <= 65535:
+        parser.error("--metrics-port must be between 0 and 65535")
+    if args.engine == 'numpy' and importlib.util.find_spec('numpy') is None:
+        parser.error("--engine numpy requires NumPy (pip install numpy)")
+
+    setup_logging(args.log_level)
+
     # create and run server
     try:
-        server = DVServer(args.topology, args.interval)
-        server.run()
+        if args.runtime == 'asyncio':
+            from dv_async import AsyncDVServer, run_servers
+            server = AsyncDVServer(args.topology, args.interval, args.max_datagram, args.wire_version,
+                                   args.receive_batch, args.split_horizon, args.engine, args.max_metric)
+            server.start_metrics_endpoint(args.metrics_port)
+            run_servers([server], read_commands=True)
+        else:
+            server = DVServer(args.topology, args.interval, args.max_datagram, args.wire_version,
+                              args.receive_batch, args.split_horizon, args.engine, args.max_metric)
+            server.start_metrics_endpoint(args.metrics_port)
+            server.run()
     except Exception as e:
         print(f"Fatal error: {e}")
         sys.exit(1)
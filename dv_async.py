@@ -0,0 +1,234 @@
+"""
+asyncio runtime for the Distance Vector Routing Protocol
+
+Runs DVServer on an event loop instead of three threads: datagrams arrive
+through a DatagramProtocol, periodic updates, triggered updates and neighbor
+deadlines are loop timers, and commands are read from stdin asynchronously.
+The encoding, decoding and Bellman-Ford logic are the ones in DVServer. Any
+number of servers can share one event loop.
+"""
+
+import asyncio
+import sys
+
+from dv import COMMANDS, DVServer, TRIGGERED_UPDATE_DELAY
+from logs import logger
+
+
+class DVDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Datagram protocol feeding received updates to an AsyncDVServer
+
+    Datagrams that arrive in the same event loop iteration are collected and
+    processed together, in batches of at most receive_batch as in the
+    threaded runtime.
+    """
+
+    def __init__(self, server):
+        """
+        Args:
+            server: AsyncDVServer that owns this endpoint
+        """
+        self.server = server
+        self.batch = []
+
+    def connection_made(self, transport):
+        # the transport has the same sendto(data, addr) as a UDP socket
+        self.server.socket = transport
+        logger.info("UDP endpoint bound to %s:%d", self.server.server_ip, self.server.server_port)
+
+    def datagram_received(self, data, addr):
+        if not self.batch:
+            self.server.loop.call_soon(self.flush)
+        self.batch.append((data, addr))
+
+    def flush(self):
+        """Process the datagrams collected in this loop iteration, up to receive_batch
+
+        The rest are left for the next iteration, so other callbacks can run
+        in between.
+        """
+        if not self.server.running:
+            self.batch = []
+            return
+        limit = self.server.receive_batch
+        batch, self.batch = self.batch[:limit], self.batch[limit:]
+        if self.batch:
+            self.server.loop.call_soon(self.flush)
+        self.server.batch_sizes[len(batch)] += 1
+        try:
+            self.server.process_batch(batch)
+        except Exception as e:
+            logger.error("Error processing updates: %s", e)
+
+    def error_received(self, exc):
+        if self.server.running:
+            logger.error("Error in receive endpoint: %s", exc)
+
+
+class AsyncDVServer(DVServer):
+    """
+    DVServer that runs on an asyncio event loop
+
+    Use start() from a coroutine, or run_servers() to run one or more
+    servers until they crash.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.loop = None
+        self.periodic_handle = None
+        self.triggered_handle = None
+        self.liveness_handle = None
+        self.stopped = None
+        super().__init__(*args, **kwargs)
+
+    def create_socket(self):
+        """The UDP endpoint is created by start() on the event loop"""
+        self.socket = None
+
+    async def start(self):
+        """Bind the UDP endpoint and schedule the periodic update timer"""
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+        await self.loop.create_datagram_endpoint(
+            lambda: DVDatagramProtocol(self),
+            local_addr=(self.server_ip, self.server_port)
+        )
+        self.schedule_periodic_update()
+        self.schedule_liveness_check()
+
+    def schedule_periodic_update(self):
+        """Schedule the next full update"""
+        self.periodic_handle = self.loop.call_later(self.update_interval, self.run_periodic_update)
+
+    def run_periodic_update(self):
+        """Timer callback for the full update every update_interval seconds"""
+        if not self.running:
+            return
+        try:
+            self.periodic_update()
+        except Exception as e:
+            logger.error("Error in periodic update: %s", e)
+        self.schedule_periodic_update()
+        self.schedule_liveness_check()
+
+    def schedule_liveness_check(self):
+        """Schedule a timeout check for when the earliest neighbor deadline passes"""
+        if self.liveness_handle is not None:
+            self.liveness_handle.cancel()
+            self.liveness_handle = None
+        deadline = self.next_neighbor_deadline()
+        if deadline is not None:
+            delay = max(0, deadline - self.clock.time())
+            self.liveness_handle = self.loop.call_later(delay, self.run_liveness_check)
+
+    def run_liveness_check(self):
+        """Timer callback for the earliest neighbor deadline"""
+        self.liveness_handle = None
+        if not self.running:
+            return
+        try:
+            self.check_neighbor_timeouts()
+        except Exception as e:
+            logger.error("Error checking neighbor timeouts: %s", e)
+        self.schedule_liveness_check()
+
+    def trigger_update(self):
+        """Schedule a triggered update if any destination has changed"""
+        if self.changed_destinations and self.triggered_handle is None and self.loop is not None:
+            # give closely spaced changes a moment to accumulate
+            self.triggered_handle = self.loop.call_later(TRIGGERED_UPDATE_DELAY, self.run_triggered_update)
+
+    def run_triggered_update(self):
+        """Timer callback sending the changed destinations"""
+        self.triggered_handle = None
+        if self.running:
+            self.send_update_to_neighbors(changed_only=True)
+
+    def handle_crash_command(self):
+        """Handle the crash command to close all connections
+
+        Stops the timers, closes the endpoint and lets run_servers() return
+        """
+        print("crash SUCCESS")
+        print("Server crashing - closing all connections")
+        self.stop()
+
+    def stop(self):
+        """Stop the server's timers and close its endpoint"""
+        self.running = False
+        for handle in (self.periodic_handle, self.triggered_handle, self.liveness_handle):
+            if handle is not None:
+                handle.cancel()
+        if self.socket:
+            self.socket.close()
+        if self.stopped is not None and not self.stopped.done():
+            self.stopped.set_result(None)
+
+
+async def read_commands(server):
+    """
+    Read commands from stdin and execute them on a server
+
+    Args:
+        server: AsyncDVServer to send the commands to
+    """
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+        readline = reader.readline
+    except (NotImplementedError, ValueError, OSError):
+        # stdin cannot be watched by this event loop (e.g. Windows), read it in a worker
+        def readline():
+            return loop.run_in_executor(None, sys.stdin.buffer.readline)
+
+    print(f"\nServer ready. Enter commands ({COMMANDS}):")
+
+    while server.running:
+        line = await readline()
+        if not line:
+            # handle EOF
+            break
+        try:
+            server.execute_command(line.decode())
+        except Exception as e:
+            if server.running:
+                logger.error("Error processing command: %s", e)
+
+
+async def serve(servers, read_commands_for=None):
+    """
+    Run servers on the current event loop until all of them have stopped,
+    or until the command reader stops if there is one
+
+    Args:
+        servers: List of AsyncDVServer instances
+        read_commands_for: Optional server to read stdin commands for
+    """
+    for server in servers:
+        await server.start()
+
+    try:
+        if read_commands_for is not None:
+            # like the threaded runtime, stdin EOF or crash ends the run
+            await read_commands(read_commands_for)
+        else:
+            await asyncio.gather(*(server.stopped for server in servers))
+    finally:
+        for server in servers:
+            server.stop()
+
+
+def run_servers(servers, read_commands=False):
+    """
+    Run servers on a new event loop until they crash or Ctrl-C is pressed
+
+    Args:
+        servers: List of AsyncDVServer instances
+        read_commands: Read stdin commands for the first server
+    """
+    try:
+        asyncio.run(serve(servers, servers[0] if read_commands else None))
+    except KeyboardInterrupt:
+        print("\nShutting down server...")
@@ -0,0 +1,456 @@
+"""
+NumPy engine for the Distance Vector Routing Protocol
+
+Keeps the neighbor distance vectors in a dense array with one row per
+neighbor and one column per destination, so applying an update, the
+c(x,v) + D_v(y) min-reduction, next-hop selection and change detection
+are array operations instead of a Python loop over destinations. Only the
+routes that changed are written back to the dict routing_table, which
+stays the view used for display and advertisements.
+
+NumPy is optional: DVServer imports this module only for -e numpy.
+"""
+
+import numpy as np
+
+from router import RoutingEntry, shared_next_hops
+
+NO_NEXT_HOP = -1  # next hop row of unreachable routes and routes not via a neighbor
+
+
+class NumpyRouteEngine:
+    """
+    Vectorized Bellman-Ford over dense per-neighbor cost arrays
+
+    Rows are the server's neighbors, columns are destinations in the order
+    they were first seen. Every method must be called with server.lock held.
+    """
+
+    def __init__(self, server):
+        """
+        Args:
+            server: DVServer whose routing table the engine maintains
+        """
+        self.server = server
+        self.neighbor_ids = list(server.neighbors)
+        self.rows = {neighbor_id: row for row, neighbor_id in enumerate(self.neighbor_ids)}
+        self.link_costs = np.empty(len(self.neighbor_ids))  # c(x,v) per row
+        self.refresh_link_costs()
+
+        self.dest_ids = []  # column -> destination_id
+        self.vectors = np.empty((len(self.neighbor_ids), 0))  # D_v(y), inf if not advertised
+        self.costs = np.empty(0)  # current cost per column
+        self.next_hops = np.empty(0, dtype=np.intp)  # current next hop row per column
+        self.multipath = np.empty((len(self.neighbor_ids), 0), dtype=bool)  # equal-cost next hop rows
+        self.backup_costs = np.empty(0)  # feasible successor cost per column
+        self.backup_rows = np.empty(0, dtype=np.intp)  # feasible successor row per column
+        self.published_backup_rows = np.empty(0, dtype=np.intp)  # backup row in the published snapshot
+
+        self.hop_tuples = {}  # packed multipath bits of a column -> shared next hop tuple
+
+        # sorted destination IDs and their columns, for vectorized lookups
+        self.sorted_ids = np.empty(0, dtype=np.int64)
+        self.sorted_columns = np.empty(0, dtype=np.intp)
+
+        for dest_id in server.routing_table:
+            self.add_destination(dest_id)
+        self.index_destinations()
+        self.self_column = self.sorted_columns[np.searchsorted(self.sorted_ids, server.server_id)]
+
+        # start from the vectors the server already holds
+        for neighbor_id, vector in server.neighbor_vectors.items():
+            row = self.rows.get(neighbor_id)
+            vector = {dest_id: cost for dest_id, cost in vector.items()
+                      if dest_id != neighbor_id and dest_id != server.server_id}
+            if row is not None and vector:
+                columns = self.lookup(np.fromiter(vector, dtype=np.int64, count=len(vector)))
+                self.vectors[row, columns] = list(vector.values())
+
+    def refresh_link_costs(self):
+        """Copy the current link costs from the server's neighbor table"""
+        for row, neighbor_id in enumerate(self.neighbor_ids):
+            self.link_costs[row] = self.server.neighbors[neighbor_id]['cost']
+
+    def add_destination(self, dest_id):
+        """Add a column for a destination, and a routing table entry if it has none
+
+        Call index_destinations() after adding destinations.
+        """
+        column = len(self.dest_ids)
+        if column == self.costs.shape[0]:
+            self.grow(max(16, 2 * column))
+        self.dest_ids.append(dest_id)
+
+        entry = self.server.routing_table.get(dest_id)
+        if entry is None:
+            # unknown destination, initialize with inf
+            entry = RoutingEntry(destination_id=dest_id, next_hop_id=None, cost=float('inf'),
+                                 now=self.server.clock.time())
+            self.server.routing_table[dest_id] = entry
+            self.server.snapshot_pending.add(dest_id)
+            self.server.table_version += 1
+
+        self.costs[column] = entry.cost
+        self.next_hops[column] = self.rows.get(entry.next_hop_id, NO_NEXT_HOP)
+        self.multipath[:, column] = False
+        for next_hop_id in entry.next_hop_ids:
+            if next_hop_id in self.rows:
+                self.multipath[self.rows[next_hop_id], column] = True
+        self.backup_costs[column] = entry.backup_cost
+        self.backup_rows[column] = self.rows.get(entry.backup_next_hop_id, NO_NEXT_HOP)
+        self.published_backup_rows[column] = NO_NEXT_HOP
+        self.vectors[:, column] = np.inf
+        if dest_id in self.rows:
+            # a neighbor's cost to itself is 0, even before it has advertised
+            self.vectors[self.rows[dest_id], column] = 0
+
+    def grow(self, capacity):
+        """Reallocate the per-destination arrays to hold capacity columns"""
+        used = len(self.dest_ids)
+
+        vectors = np.full((len(self.neighbor_ids), capacity), np.inf)
+        vectors[:, :used] = self.vectors[:, :used]
+        costs = np.full(capacity, np.inf)
+        costs[:used] = self.costs[:used]
+        next_hops = np.full(capacity, NO_NEXT_HOP, dtype=np.intp)
+        next_hops[:used] = self.next_hops[:used]
+        multipath = np.zeros((len(self.neighbor_ids), capacity), dtype=bool)
+        multipath[:, :used] = self.multipath[:, :used]
+        backup_costs = np.full(capacity, np.inf)
+        backup_costs[:used] = self.backup_costs[:used]
+        backup_rows = np.full(capacity, NO_NEXT_HOP, dtype=np.intp)
+        backup_rows[:used] = self.backup_rows[:used]
+        published_backup_rows = np.full(capacity, NO_NEXT_HOP, dtype=np.intp)
+        published_backup_rows[:used] = self.published_backup_rows[:used]
+
+        self.vectors, self.costs, self.next_hops, self.multipath = vectors, costs, next_hops, multipath
+        self.backup_costs, self.backup_rows = backup_costs, backup_rows
+        self.published_backup_rows = published_backup_rows
+
+    def index_destinations(self):
+        """Rebuild the sorted ID index after destinations were added"""
+        ids = np.array(self.dest_ids, dtype=np.int64)
+        self.sorted_columns = np.argsort(ids, kind='stable')
+        self.sorted_ids = ids[self.sorted_columns]
+
+    def lookup(self, ids):
+        """Map an array of destination IDs to columns, adding unknown destinations
+
+        Args:
+            ids: int64 array of destination IDs
+
+        Returns:
+            Array of columns parallel to ids
+        """
+        positions = np.searchsorted(self.sorted_ids, ids)
+        np.minimum(positions, len(self.sorted_ids) - 1, out=positions)
+        found = self.sorted_ids[positions] == ids
+
+        if not found.all():
+            for dest_id in np.unique(ids[~found]).tolist():
+                self.add_destination(dest_id)
+            self.index_destinations()
+            positions = np.searchsorted(self.sorted_ids, ids)
+
+        return self.sorted_columns[positions]
+
+    def apply_update(self, sender_id, dest_ids, costs, infinity):
+        """Store a received distance vector and recompute the destinations it changed
+
+        Args:
+            sender_id: ID of the neighbor sending the update
+            dest_ids: Destination IDs from sender's routing table
+            costs: Sender's cost to each destination (parallel to dest_ids)
+            infinity: Cost value meaning unreachable in costs
+
+        Returns:
+            True if the routing table changed
+        """
+        row = self.rows.get(sender_id)
+        if row is None or not len(dest_ids):
+            return False
+
+        ids = np.asarray(dest_ids, dtype=np.int64)
+        new_costs = np.array(costs, dtype=np.float64)
+
+        # skip the entry for this server, and the sender's own entry (its cost to itself is 0)
+        keep = (ids != self.server.server_id) & (ids != sender_id)
+        if not keep.all():
+            ids = ids[keep]
+            new_costs = new_costs[keep]
+
+        # convert the wire infinity, and costs at the max metric, back to inf
+        new_costs[new_costs >= min(infinity, self.server.max_metric)] = np.inf
+
+        columns = self.lookup(ids)
+        changed = self.vectors[row, columns] != new_costs
+        if not changed.any():
+            return False
+
+        columns = columns[changed]
+        self.vectors[row, columns] = new_costs[changed]
+        return self.recompute(columns)
+
+    def recompute_routes_via(self, neighbor_id):
+        """Recompute every route a change to a neighbor's link cost or vector can affect
+
+        Returns:
+            True if any route changed
+        """
+        self.refresh_link_costs()
+        row = self.rows.get(neighbor_id)
+        if row is None:
+            return False
+
+        used = len(self.dest_ids)
+        affected = np.isfinite(self.vectors[row, :used]) | self.multipath[row, :used]
+        return self.recompute(np.flatnonzero(affected))
+
+    def recompute_routes(self, dest_ids):
+        """Recompute the routes to some destinations, see DVServer.recompute_routes
+
+        Returns:
+            True if any route changed
+        """
+        if not len(dest_ids):
+            return False
+        self.refresh_link_costs()
+        return self.recompute(self.lookup(np.asarray(dest_ids, dtype=np.int64)))
+
+    def switch_to_backups(self, neighbor_id):
+        """Move the routes through a failed neighbor to their other next hops or backups
+
+        See DVServer.switch_to_backups.
+
+        Returns:
+            List of the destinations whose route changed
+        """
+        self.refresh_link_costs()
+        row = self.rows.get(neighbor_id)
+        if row is None:
+            return []
+
+        server = self.server
+        now = server.clock.time()
+        used = len(self.dest_ids)
+        columns = np.flatnonzero(self.multipath[row, :used])
+
+        # one of several equal-cost next hops failed, the route still goes via the others
+        secondary = columns[self.next_hops[columns] != row]
+        self.multipath[row, secondary] = False
+        lost_backup = secondary[self.backup_rows[secondary] == row]
+        self.backup_rows[lost_backup] = NO_NEXT_HOP
+        self.backup_costs[lost_backup] = np.inf
+        for column in secondary.tolist():
+            entry = server.routing_table[self.dest_ids[column]]
+            remaining = tuple(next_hop_id for next_hop_id in entry.next_hop_ids if next_hop_id != neighbor_id)
+            server.set_route(entry, entry.next_hop_id, entry.cost, now, remaining)
+            if entry.backup_next_hop_id == neighbor_id:
+                entry.backup_next_hop_id = None
+                entry.backup_cost = float('inf')
+
+        columns = columns[self.next_hops[columns] == row]
+        backup_rows = self.backup_rows[columns]
+
+        # backups are only refreshed when their route is recomputed, check them again
+        has_backup = backup_rows != NO_NEXT_HOP
+        columns = columns[has_backup]
+        backup_rows = backup_rows[has_backup]
+        reported = self.vectors[backup_rows, columns]
+        backup_costs = self.link_costs[backup_rows] + reported
+        usable = (reported < self.costs[columns]) & (backup_costs < self.server.max_metric)
+        columns = columns[usable]
+        backup_rows = backup_rows[usable]
+        backup_costs = backup_costs[usable]
+
+        self.costs[columns] = backup_costs
+        self.next_hops[columns] = backup_rows
+        self.multipath[row, columns] = False
+        self.backup_costs[columns] = np.inf
+        self.backup_rows[columns] = NO_NEXT_HOP
+
+        for column, cost, backup_row in zip(columns.tolist(), backup_costs.tolist(), backup_rows.tolist()):
+            entry = server.routing_table[self.dest_ids[column]]
+            backup = self.neighbor_ids[backup_row]
+            remaining = tuple(next_hop_id for next_hop_id in entry.next_hop_ids if next_hop_id != neighbor_id)
+            if backup not in remaining:
+                remaining = (backup,)
+                self.multipath[:, column] = False
+                self.multipath[backup_row, column] = True
+            server.set_route(entry, backup, cost, now, remaining)
+            entry.backup_next_hop_id = None
+            entry.backup_cost = float('inf')
+
+        dest_ids = self.dest_ids
+        return [dest_ids[column] for column in secondary.tolist() + columns.tolist()]
+
+    def routes_with_backup(self, neighbor_id):
+        """Return the destinations whose backup next hop is a neighbor, see DVServer.routes_with_backup"""
+        row = self.rows.get(neighbor_id)
+        if row is None:
+            return []
+        columns = np.flatnonzero(self.backup_rows[:len(self.dest_ids)] == row)
+        return [self.dest_ids[column] for column in columns.tolist()]
+
+    def next_hop_tuples(self, ties):
+        """Return the shared next hop tuple of each column of a multipath block
+
+        Columns are keyed by their packed bits, so each distinct set of
+        equal-cost next hops is converted to a tuple once.
+
+        Args:
+            ties: Boolean array, one row per neighbor and one column per route
+
+        Returns:
+            List of sorted next hop ID tuples, one per column
+        """
+        packed = np.packbits(ties, axis=0).T
+        width = packed.shape[1]
+        packed = packed.tobytes()
+        hop_tuples = self.hop_tuples
+        tuples = []
+        for start in range(0, len(packed), width):
+            key = packed[start:start + width]
+            hops = hop_tuples.get(key)
+            if hops is None:
+                rows = np.flatnonzero(np.unpackbits(np.frombuffer(key, dtype=np.uint8))[:len(self.neighbor_ids)])
+                hops = hop_tuples[key] = shared_next_hops(tuple(sorted(self.neighbor_ids[row]
+                                                                       for row in rows.tolist())))
+            tuples.append(hops)
+        return tuples
+
+    def usable_backup(self, entry):
+        """Check a route's backup next hop, see DVServer.usable_backup"""
+        row = self.rows.get(entry.backup_next_hop_id)
+        if row is None:
+            return None, float('inf')
+
+        column = self.lookup(np.array([entry.destination_id], dtype=np.int64))[0]
+        reported = self.vectors[row, column]
+        cost = self.link_costs[row] + reported
+        if reported >= entry.cost or cost >= self.server.max_metric:
+            return None, float('inf')
+        return entry.backup_next_hop_id, float(cost)
+
+    def usable_backups(self, entries):
+        """Check the backup next hops of many routes at once, see DVServer.usable_backups
+
+        Called to publish the routes, so the result is also kept as their
+        published backup rows.
+        """
+        backups = [None] * len(entries)
+        if not entries:
+            return backups
+
+        columns = self.lookup(np.array([entry.destination_id for entry in entries], dtype=np.int64))
+        rows = self.backup_rows[columns]
+        checked = rows != NO_NEXT_HOP
+        route_costs = np.array([entry.cost for entry in entries], dtype=np.float64)
+        reported = self.vectors[np.where(checked, rows, 0), columns]
+        usable = checked & (reported < route_costs) & (self.link_costs[rows] + reported < self.server.max_metric)
+        self.published_backup_rows[columns] = np.where(usable, rows, NO_NEXT_HOP)
+        neighbor_ids = self.neighbor_ids
+        for i, row in zip(np.flatnonzero(usable).tolist(), rows[usable].tolist()):
+            backups[i] = neighbor_ids[row]
+        return backups
+
+    def drop_vector(self, neighbor_id):
+        """Forget the vector a neighbor advertised (its link cost still counts)"""
+        row = self.rows.get(neighbor_id)
+        if row is not None:
+            self.vectors[row, :] = np.inf
+            self.vectors[row, self.lookup(np.array([neighbor_id], dtype=np.int64))] = 0
+
+    def recompute(self, columns):
+        """Recompute the routes in some columns and write changed ones back
+
+        D_x(y) = min_v{c(x,v) + D_v(y)} for every column at once. On a tie
+        the current next hop is kept and all tied rows become equal-cost
+        next hops, and the feasible successor is kept as backup, as in
+        DVServer.recompute_route.
+
+        Args:
+            columns: Array of columns to recompute
+
+        Returns:
+            True if any route changed
+        """
+        columns = columns[columns != self.self_column]
+        if not len(columns) or not self.neighbor_ids:
+            return False
+
+        totals = self.link_costs[:, None] + self.vectors[:, columns]
+        span = np.arange(len(columns))
+        best_rows = totals.argmin(axis=0)
+        best_costs = totals[best_rows, span]
+
+        # on a tie keep the current next hop
+        current = self.next_hops[columns]
+        has_current = current != NO_NEXT_HOP
+        current_costs = totals[np.where(has_current, current, 0), span]
+        best_rows = np.where(has_current & (current_costs == best_costs), current, best_rows)
+        max_metric = self.server.max_metric
+        unreachable = best_costs >= max_metric
+        best_costs[unreachable] = np.inf
+        best_rows[unreachable] = NO_NEXT_HOP
+        ties = (totals == best_costs) & ~unreachable
+        multipath_changed = (ties != self.multipath[:, columns]).any(axis=0)
+
+        # feasible successor: reported distance below the new cost
+        feasible = ((self.vectors[:, columns] < best_costs)
+                    & (np.arange(len(self.neighbor_ids))[:, None] != best_rows))
+        backup_totals = np.where(feasible, totals, np.inf)
+        backup_rows = backup_totals.argmin(axis=0)
+        backup_costs = backup_totals[backup_rows, span]
+        unreachable = backup_costs >= max_metric
+        backup_costs[unreachable] = np.inf
+        backup_rows[unreachable] = NO_NEXT_HOP
+
+        changed = (best_costs != self.costs[columns]) | (best_rows != current) | multipath_changed
+        backup_changed = ((backup_rows != self.backup_rows[columns])
+                          | (backup_costs != self.backup_costs[columns]))
+        written = changed | backup_changed
+
+        # the published backup may have been unusable when it was taken, see DVServer.recompute_route
+        unwritten = columns[~written]
+        unwritten_backups = backup_rows[~written]
+        stale = unwritten[(unwritten_backups != NO_NEXT_HOP)
+                          & (self.published_backup_rows[unwritten] != unwritten_backups)]
+        if len(stale):
+            self.server.snapshot_pending.update(self.dest_ids[column] for column in stale.tolist())
+        if not written.any():
+            return False
+
+        columns = columns[written]
+        changed = changed[written]
+        best_costs = best_costs[written]
+        best_rows = best_rows[written]
+        ties = ties[:, written]
+        backup_costs = backup_costs[written]
+        backup_rows = backup_rows[written]
+        self.costs[columns] = best_costs
+        self.next_hops[columns] = best_rows
+        self.multipath[:, columns] = ties
+        self.backup_costs[columns] = backup_costs
+        self.backup_rows[columns] = backup_rows
+
+        # write the changed routes and backups back to the dict view, batched
+        server = self.server
+        neighbor_ids = self.neighbor_ids
+        dest_ids = self.dest_ids
+        routing_table = server.routing_table
+        entries = [routing_table[dest_ids[column]] for column in columns.tolist()]
+
+        changed_at = np.flatnonzero(changed)
+        if len(changed_at):
+            changed_entries = [entries[i] for i in changed_at.tolist()]
+            next_hops = [None if row == NO_NEXT_HOP else neighbor_ids[row] for row in best_rows[changed_at].tolist()]
+            server.set_routes(changed_entries, next_hops, best_costs[changed_at].tolist(),
+                              self.next_hop_tuples(ties[:, changed_at]), server.clock.time())
+        if len(changed_at) < len(entries):
+            server.snapshot_pending.update(entry.destination_id for entry in entries)
+
+        for entry, backup_row, backup_cost in zip(entries, backup_rows.tolist(), backup_costs.tolist()):
+            entry.backup_next_hop_id = None if backup_row == NO_NEXT_HOP else neighbor_ids[backup_row]
+            entry.backup_cost = backup_cost
+        return bool(len(changed_at))
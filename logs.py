@@ -0,0 +1,141 @@
+"""
+Logging for the Distance Vector Routing Protocol
+
+Servers log through the 'dv' logger. setup_logging() hands its records to
+a queue that a background thread formats and writes out. Per-packet
+events go through PacketLog, which checks the level before anything else
+(no formatting when it is off), rate-limits each key, and queues just the
+format string and arguments: even creating the LogRecord is left to the
+background thread, so the receive and send paths pay for one queue put.
+
+Command output (display, packets, ...) is not logging and is still printed.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+DEFAULT_LOG_LEVEL = 'info'
+PACKET_LOG_RATE = 10  # per-packet events logged per second and key once the burst is used up
+PACKET_LOG_BURST = 20  # per-packet events logged back to back per key
+
+logger = logging.getLogger('dv')
+log_queue = None  # queue of records and PacketLog events, once setup_logging() ran
+listener = None  # DeferredQueueListener writing them out
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves all formatting to the listener thread"""
+
+    def prepare(self, record):
+        # QueueHandler.prepare formats the message here, in the logging thread
+        return record
+
+
+class DeferredQueueListener(logging.handlers.QueueListener):
+    """QueueListener that also turns queued PacketLog events into records"""
+
+    def prepare(self, record):
+        if isinstance(record, tuple):
+            level, msg, args = record
+            record = logger.makeRecord(logger.name, level, None, 0, msg, args, None)
+        return record
+
+
+def setup_logging(level=DEFAULT_LOG_LEVEL, stream=None):
+    """Write the 'dv' logger's records to a stream from a background thread
+
+    Calling it again replaces the previous setup. Records still queued are
+    written out when the program exits.
+
+    Args:
+        level: One of LOG_LEVELS
+        stream: Stream to write to (default: sys.stdout, next to command output)
+    """
+    global listener, log_queue
+    stop_logging()
+
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stdout if stream is None else stream)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+
+    logger.handlers[:] = [DeferredQueueHandler(log_queue)]
+    logger.setLevel(getattr(logging, level.upper()))
+    logger.propagate = False
+
+    listener = DeferredQueueListener(log_queue, handler)
+    listener.start()
+
+
+def stop_logging():
+    """Write out the queued records and stop the background thread"""
+    global listener, log_queue
+    if listener is not None:
+        log_queue = None
+        listener.stop()
+        listener = None
+
+
+atexit.register(stop_logging)
+
+
+class PacketLog:
+    """
+    Rate-limited log of one kind of per-packet event
+
+    Every key (e.g. a neighbor ID) has a token bucket: PACKET_LOG_BURST
+    events are logged back to back, then PACKET_LOG_RATE per second.
+    Events over the limit are counted and the count is added to the next
+    event that is logged.
+    """
+
+    def __init__(self, level, rate=PACKET_LOG_RATE, burst=PACKET_LOG_BURST):
+        """
+        Args:
+            level: Logging level of the events (e.g. logging.DEBUG)
+            rate: Events logged per second and key once the burst is used up
+            burst: Events logged back to back per key
+        """
+        self.level = level
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}  # key -> [tokens, time of last event, suppressed events]
+
+    def log(self, key, msg, *args):
+        """Log an event unless its level is off or its key is over the rate
+
+        Args:
+            key: Key to rate-limit by
+            msg: %-style format string, only formatted if the event is written
+            args: Arguments for msg
+        """
+        if not logger.isEnabledFor(self.level):
+            return
+
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [self.burst, now, 0]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return
+        bucket[0] -= 1
+
+        if bucket[2]:
+            msg += " (%d similar events suppressed)"
+            args += (bucket[2],)
+            bucket[2] = 0
+
+        events = log_queue
+        if events is None:
+            logger.log(self.level, msg, *args)
+        else:
+            events.put((self.level, msg, args))
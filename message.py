@@ -0,0 +1,557 @@
+"""
+Binary encoding and decoding of distance vector update messages
+"""
+
+import socket
+import struct
+import sys
+from array import array
+
+# Cost used on the wire for unreachable destinations
+INFINITY = 999999
+
+# Default maximum size of one update datagram (also the receive buffer size)
+DEFAULT_MAX_DATAGRAM = 4096
+
+# Message layout (network byte order):
+#   header: num_fields (4), sender port (4), sender IP (4)
+#   entry:  dest IP (4), dest port (4), padding (4), dest ID (4), cost (4)
+HEADER = struct.Struct('!II4s')
+ENTRY = struct.Struct('!4sIIII')
+
+# Advertisements that do not fit in one datagram are split into segments.
+# A segment sets the top bit of num_fields and has an extra header after the
+# normal one: sequence (4), segment index (2), segment count (2).
+SEGMENTED_FLAG = 0x80000000
+SEGMENT = struct.Struct('!IHH')
+SEQUENCE_MODULUS = 1 << 32
+SEQUENCE_WINDOW = 1024  # sequences this far behind the newest one are stale
+
+# Packed server address: port (2), IP (4). This is exactly bytes 6-12 of the
+# header, since ports fit in the low half of the 4-byte port field.
+ADDRESS = struct.Struct('!H4s')
+ADDRESS_OFFSET = 6
+
+# Compact (v2) message layout, only sent to neighbors that support it:
+#   header: version (1), flags (1), sender address (6), num entries (2)
+#   segment header (FLAG_SEGMENTED): same as v1
+#   address block (FLAG_ADDRESSES): count (2), then server ID (4) + address (6) each
+#   destination IDs: sorted, 2 bytes each (4 with FLAG_WIDE_IDS)
+#   costs: 2 bytes each with 0xFFFF for unreachable (4 with FLAG_WIDE_COSTS)
+# IDs and costs are stored as two fixed-width columns so both encode and decode
+# are single array conversions. The first byte of a v1 message is 0x00 or 0x80,
+# so the version byte is unambiguous.
+COMPACT_VERSION = 2
+COMPACT_HEADER = struct.Struct('!BB6sH')
+COMPACT_ADDRESS = struct.Struct('!I6s')
+COMPACT_COUNT = struct.Struct('!H')
+FLAG_SEGMENTED = 0x01
+FLAG_WIDE_IDS = 0x02
+FLAG_WIDE_COSTS = 0x04
+FLAG_ADDRESSES = 0x08
+NARROW_INFINITY = 0xFFFF
+
+# Capability bits, carried in the padding word of every v1 entry
+CAPABILITY_COMPACT = 0x1
+
+
+def pack_address(ip, port):
+    """
+    Pack a server address into its 6-byte form
+
+    Args:
+        ip: IP address string
+        port: Port number
+
+    Returns:
+        bytes: Packed address
+    """
+    return ADDRESS.pack(port, socket.inet_aton(ip))
+
+
+def unpack_address(packed):
+    """
+    Unpack a 6-byte server address
+
+    Args:
+        packed: Packed address
+
+    Returns:
+        tuple: (ip, port)
+    """
+    port, ip_bytes = ADDRESS.unpack(packed)
+    return socket.inet_ntoa(ip_bytes), port
+
+
+class UpdateMessage:
+    """Decoded update message"""
+
+    def __init__(self, version, sender_address, dest_ids, costs, segment=None,
+                 capabilities=None, addresses=(), infinity=INFINITY):
+        """
+        Args:
+            version: Wire format version (1 or 2)
+            sender_address: Packed 6-byte address of the sender
+            dest_ids: Array of destination IDs
+            costs: Array of wire costs, parallel to dest_ids
+            segment: (sequence, index, count) or None for an unsegmented message
+            capabilities: Capability bits of the sender (None if unknown)
+            addresses: List of (server_id, packed address) changes (v2 only)
+            infinity: Wire cost meaning unreachable in this message
+        """
+        self.version = version
+        self.sender_address = sender_address
+        self.dest_ids = dest_ids
+        self.costs = costs
+        self.infinity = infinity
+        self.segment = segment
+        self.capabilities = capabilities
+        self.addresses = addresses
+
+
+class AddressIndex:
+    """
+    Index from server address to server ID
+
+    Lookups work on (ip, port) pairs or on the packed 6-byte address taken
+    straight from a message header.
+    """
+
+    def __init__(self):
+        """Initialize an empty index"""
+        self.by_address = {}  # (ip, port) -> server_id
+        self.by_packed = {}  # packed address -> server_id
+        self.addresses = {}  # server_id -> (ip, port)
+
+    def rebuild(self, all_servers):
+        """
+        Rebuild the index from the server list
+
+        Args:
+            all_servers: Dictionary of server_id -> {'ip': ip, 'port': port}
+        """
+        self.by_address = {}
+        self.by_packed = {}
+        self.addresses = {}
+        for server_id, info in all_servers.items():
+            self.add(server_id, info['ip'], info['port'])
+
+    def add(self, server_id, ip, port):
+        """
+        Add a server or change its address
+
+        Args:
+            server_id: ID of the server
+            ip: IP address of the server
+            port: Port of the server
+        """
+        self.remove(server_id)
+        self.addresses[server_id] = (ip, port)
+        self.by_address[(ip, port)] = server_id
+        self.by_packed[pack_address(ip, port)] = server_id
+
+    def remove(self, server_id):
+        """Remove a server from the index if present"""
+        address = self.addresses.pop(server_id, None)
+        if address is not None and self.by_address.get(address) == server_id:
+            del self.by_address[address]
+            del self.by_packed[pack_address(*address)]
+
+    def lookup(self, ip, port):
+        """Return the server ID for an (ip, port) address, or None"""
+        return self.by_address.get((ip, port))
+
+    def lookup_packed(self, packed):
+        """Return the server ID for a packed 6-byte address, or None"""
+        return self.by_packed.get(packed)
+
+
+class UpdateEncoder:
+    """
+    Encoder for distance vector update messages
+
+    The destination IP/port/ID part of every entry only depends on the
+    server list, so it is converted once per destination and cached.
+    Encoding a table then packs the cached prefix and the cost straight
+    into a preallocated buffer, which keeps the cost linear in the table size.
+    """
+
+    def __init__(self, server_ip, server_port, capabilities=0, max_metric=INFINITY):
+        """
+        Initialize encoder for the sending server
+
+        Args:
+            server_ip: IP address of this server
+            server_port: Port of this server
+            capabilities: Capability bits to advertise in v1 messages
+            max_metric: Costs at or above this are encoded as unreachable
+        """
+        self.server_ip_bytes = socket.inet_aton(server_ip)
+        self.server_port = server_port
+        self.server_address = pack_address(server_ip, server_port)
+        self.capabilities = capabilities
+        self.max_metric = min(max_metric, INFINITY)
+        self.prefixes = {}  # dest_id -> (dest IP bytes, dest port, padding, dest ID)
+        self.buffer = bytearray()
+
+    def rebuild(self, all_servers):
+        """
+        Rebuild the cached entry prefixes from the server list
+
+        Must be called whenever a server is added or changes address.
+
+        Args:
+            all_servers: Dictionary of server_id -> {'ip': ip, 'port': port}
+        """
+        self.prefixes = {
+            server_id: (socket.inet_aton(info['ip']), info['port'], self.capabilities, server_id)
+            for server_id, info in all_servers.items()
+        }
+
+    def prefix(self, dest_id):
+        """Return the cached entry prefix for a destination"""
+        prefix = self.prefixes.get(dest_id)
+        if prefix is None:
+            # destination not in the server list, advertise with an empty address
+            prefix = (bytes(4), 0, self.capabilities, dest_id)
+            self.prefixes[dest_id] = prefix
+        return prefix
+
+    def encode(self, entries, segment=None):
+        """
+        Encode routing entries into an update message
+
+        Args:
+            entries: List of (destination_id, cost) tuples
+            segment: Optional (sequence, index, count) for a segmented advertisement
+
+        Returns:
+            bytes: Encoded update message
+        """
+        offset = HEADER.size if segment is None else HEADER.size + SEGMENT.size
+        size = offset + len(entries) * ENTRY.size
+        if len(self.buffer) < size:
+            self.buffer = bytearray(size)
+        buf = self.buffer
+
+        if segment is None:
+            HEADER.pack_into(buf, 0, len(entries), self.server_port, self.server_ip_bytes)
+        else:
+            HEADER.pack_into(buf, 0, len(entries) | SEGMENTED_FLAG, self.server_port, self.server_ip_bytes)
+            SEGMENT.pack_into(buf, HEADER.size, *segment)
+
+        prefixes = self.prefixes
+        pack_entry = ENTRY.pack_into
+        max_metric = self.max_metric
+        for dest_id, cost in entries:
+            prefix = prefixes.get(dest_id) or self.prefix(dest_id)
+            pack_entry(buf, offset, *prefix, INFINITY if cost >= max_metric else int(cost))
+            offset += ENTRY.size
+
+        return bytes(memoryview(buf)[:size])
+
+    def encode_compact(self, dest_ids, costs, flags, segment=None, addresses=None):
+        """
+        Encode sorted destination IDs and wire costs into a compact (v2) message
+
+        Args:
+            dest_ids: Sorted list of destination IDs
+            costs: List of wire costs (NARROW_INFINITY for unreachable unless
+                FLAG_WIDE_COSTS is set), parallel to dest_ids
+            flags: FLAG_WIDE_IDS / FLAG_WIDE_COSTS
+            segment: Optional (sequence, index, count) for a segmented advertisement
+            addresses: Optional list of (server_id, packed address) to include
+
+        Returns:
+            bytes: Encoded update message
+        """
+        if segment is not None:
+            flags |= FLAG_SEGMENTED
+        if addresses:
+            flags |= FLAG_ADDRESSES
+
+        parts = [COMPACT_HEADER.pack(COMPACT_VERSION, flags, self.server_address, len(dest_ids))]
+        if segment is not None:
+            parts.append(SEGMENT.pack(*segment))
+        if addresses:
+            parts.append(COMPACT_COUNT.pack(len(addresses)))
+            parts.extend(COMPACT_ADDRESS.pack(server_id, packed) for server_id, packed in addresses)
+
+        id_array = array('I' if flags & FLAG_WIDE_IDS else 'H', dest_ids)
+        cost_array = array('I' if flags & FLAG_WIDE_COSTS else 'H', costs)
+        if sys.byteorder == 'little':
+            id_array.byteswap()
+            cost_array.byteswap()
+        parts.append(id_array.tobytes())
+        parts.append(cost_array.tobytes())
+
+        return b''.join(parts)
+
+    def encode_segments(self, entries, sequence, max_size=DEFAULT_MAX_DATAGRAM, version=1, addresses=None):
+        """
+        Encode routing entries into one or more datagrams of at most max_size bytes
+
+        An advertisement that fits in one datagram is sent as a plain
+        (unsegmented) message, so small networks stay compatible with
+        servers that do not understand segments.
+
+        Args:
+            entries: List of (destination_id, cost) tuples
+            sequence: Sequence number of this advertisement
+            max_size: Maximum datagram size in bytes
+            version: Wire format version (1 or 2)
+            addresses: Optional list of (server_id, packed address) changes
+                to include (v2 only, sent in the first datagram)
+
+        Returns:
+            list: Encoded datagrams
+
+        Raises:
+            ValueError: If max_size is too small or too many segments are needed
+        """
+        if version == COMPACT_VERSION:
+            return self.encode_compact_segments(entries, sequence, max_size, addresses)
+
+        if HEADER.size + len(entries) * ENTRY.size <= max_size:
+            return [self.encode(entries)]
+
+        per_segment = (max_size - HEADER.size - SEGMENT.size) // ENTRY.size
+        if per_segment < 1:
+            raise ValueError(f"Maximum datagram size too small: {max_size}")
+
+        count = -(-len(entries) // per_segment)
+        if count > 0xFFFF:
+            raise ValueError(f"Advertisement needs too many segments: {count}")
+
+        sequence %= SEQUENCE_MODULUS
+        return [
+            self.encode(entries[index * per_segment:(index + 1) * per_segment], (sequence, index, count))
+            for index in range(count)
+        ]
+
+    def encode_compact_segments(self, entries, sequence, max_size, addresses=None):
+        """Compact (v2) version of encode_segments"""
+        entries = sorted(entries)
+        dest_ids = [dest_id for dest_id, _ in entries]
+        max_metric = self.max_metric
+        costs = [INFINITY if cost >= max_metric else int(cost) for _, cost in entries]
+
+        flags = 0
+        if dest_ids and dest_ids[-1] > 0xFFFF:
+            flags |= FLAG_WIDE_IDS
+        if max((cost for cost in costs if cost != INFINITY), default=0) >= NARROW_INFINITY:
+            flags |= FLAG_WIDE_COSTS
+        else:
+            costs = [NARROW_INFINITY if cost == INFINITY else cost for cost in costs]
+
+        entry_size = (4 if flags & FLAG_WIDE_IDS else 2) + (4 if flags & FLAG_WIDE_COSTS else 2)
+        header_size = COMPACT_HEADER.size
+        if addresses:
+            header_size += COMPACT_COUNT.size + len(addresses) * COMPACT_ADDRESS.size
+
+        if header_size + len(entries) * entry_size <= max_size:
+            return [self.encode_compact(dest_ids, costs, flags, addresses=addresses)]
+
+        # every segment reserves room for the address block, which only the first one carries
+        per_segment = (max_size - header_size - SEGMENT.size) // entry_size
+        if per_segment < 1:
+            raise ValueError(f"Maximum datagram size too small: {max_size}")
+
+        count = -(-len(entries) // per_segment)
+        if count > 0xFFFF:
+            raise ValueError(f"Advertisement needs too many segments: {count}")
+
+        sequence %= SEQUENCE_MODULUS
+        return [
+            self.encode_compact(dest_ids[index * per_segment:(index + 1) * per_segment],
+                                costs[index * per_segment:(index + 1) * per_segment],
+                                flags, (sequence, index, count),
+                                addresses if index == 0 else None)
+            for index in range(count)
+        ]
+
+
+def set_sequence(datagram, sequence):
+    """
+    Return a datagram with its segment sequence number replaced
+
+    Lets a cached advertisement be resent under a new sequence number
+    without encoding it again. Unsegmented datagrams are returned unchanged.
+
+    Args:
+        datagram: Encoded update message (v1 or v2)
+        sequence: New sequence number
+
+    Returns:
+        bytes: Datagram with the new sequence number
+    """
+    if datagram[0] == COMPACT_VERSION:
+        if not datagram[1] & FLAG_SEGMENTED:
+            return datagram
+        offset = COMPACT_HEADER.size
+    elif datagram[0] & 0x80:
+        offset = HEADER.size
+    else:
+        return datagram
+
+    patched = bytearray(datagram)
+    struct.pack_into('!I', patched, offset, sequence % SEQUENCE_MODULUS)
+    return bytes(patched)
+
+
+class SegmentTracker:
+    """
+    Tracks segmented advertisements received from each sender
+
+    Segments carry complete (destination, cost) pairs and are applied as soon
+    as they arrive. The tracker only filters out duplicates and segments that
+    belong to an advertisement older than the newest one seen.
+    """
+
+    def __init__(self):
+        """Initialize an empty tracker"""
+        self.state = {}  # sender_id -> (sequence, set of received indices, count)
+
+    def accept(self, sender_id, sequence, index, count):
+        """
+        Record a received segment
+
+        Args:
+            sender_id: ID of the sending server
+            sequence: Advertisement sequence number
+            index: Segment index
+            count: Number of segments in the advertisement
+
+        Returns:
+            bool: True if the segment should be applied
+        """
+        if index >= count:
+            return False
+
+        current = self.state.get(sender_id)
+        if current is not None:
+            current_sequence, received, _ = current
+            if sequence == current_sequence:
+                if index in received:
+                    return False
+                received.add(index)
+                return True
+
+            # serial number comparison, so the sequence can wrap around
+            behind = (current_sequence - sequence) % SEQUENCE_MODULUS
+            if behind < SEQUENCE_WINDOW:
+                return False
+
+        self.state[sender_id] = (sequence, {index}, count)
+        return True
+
+    def is_complete(self, sender_id):
+        """Return True if every segment of the newest advertisement has arrived"""
+        current = self.state.get(sender_id)
+        return current is not None and len(current[1]) == current[2]
+
+    def reset(self, sender_id):
+        """Forget the state for a sender (e.g. after it timed out)"""
+        self.state.pop(sender_id, None)
+
+
+def decode_update(data):
+    """
+    Decode an update message in either wire format
+
+    The entry block is converted in one pass into an array of 32-bit words,
+    so no per-entry objects are created. Only the destination IDs and costs
+    are returned since the per-entry addresses are not used for routing.
+
+    Args:
+        data: Received message (bytes-like)
+
+    Returns:
+        UpdateMessage: The decoded message
+
+    Raises:
+        ValueError: If the message is malformed or shorter than its header says
+    """
+    view = memoryview(data)
+    if len(view) < HEADER.size:
+        raise ValueError(f"Message too short: {len(view)} bytes")
+
+    if view[0] == COMPACT_VERSION:
+        return decode_compact(view)
+
+    num_fields, sender_port, sender_ip_bytes = HEADER.unpack_from(view)
+    if sender_port > 0xFFFF:
+        raise ValueError(f"Invalid sender port: {sender_port}")
+
+    start = HEADER.size
+    segment = None
+    if num_fields & SEGMENTED_FLAG:
+        num_fields &= ~SEGMENTED_FLAG
+        if len(view) < start + SEGMENT.size:
+            raise ValueError("Message truncated: missing segment header")
+        segment = SEGMENT.unpack_from(view, start)
+        start += SEGMENT.size
+
+    end = start + num_fields * ENTRY.size
+    if len(view) < end:
+        raise ValueError(f"Message truncated: expected {end} bytes, got {len(view)}")
+
+    words = array('I')
+    words.frombytes(view[start:end])
+    if sys.byteorder == 'little':
+        words.byteswap()
+
+    # each entry is 5 words: dest IP, dest port, padding, dest ID, cost
+    sender_address = bytes(view[ADDRESS_OFFSET:HEADER.size])
+    capabilities = words[2] if num_fields else None
+    return UpdateMessage(1, sender_address, words[3::5], words[4::5], segment, capabilities)
+
+
+def decode_compact(view):
+    """
+    Decode a compact (v2) update message
+
+    Args:
+        view: memoryview of the received message
+
+    Returns:
+        UpdateMessage: The decoded message
+
+    Raises:
+        ValueError: If the message is malformed or truncated
+    """
+    _, flags, sender_address, num_entries = COMPACT_HEADER.unpack_from(view)
+    offset = COMPACT_HEADER.size
+
+    try:
+        segment = None
+        if flags & FLAG_SEGMENTED:
+            segment = SEGMENT.unpack_from(view, offset)
+            offset += SEGMENT.size
+
+        addresses = []
+        if flags & FLAG_ADDRESSES:
+            (count,) = COMPACT_COUNT.unpack_from(view, offset)
+            offset += COMPACT_COUNT.size
+            for _ in range(count):
+                addresses.append(COMPACT_ADDRESS.unpack_from(view, offset))
+                offset += COMPACT_ADDRESS.size
+    except struct.error:
+        raise ValueError("Message truncated: incomplete compact header")
+
+    dest_ids = array('I' if flags & FLAG_WIDE_IDS else 'H')
+    costs = array('I' if flags & FLAG_WIDE_COSTS else 'H')
+    ids_end = offset + num_entries * dest_ids.itemsize
+    end = ids_end + num_entries * costs.itemsize
+    if len(view) < end:
+        raise ValueError(f"Message truncated: expected {end} bytes, got {len(view)}")
+
+    dest_ids.frombytes(view[offset:ids_end])
+    costs.frombytes(view[ids_end:end])
+    if sys.byteorder == 'little':
+        dest_ids.byteswap()
+        costs.byteswap()
+
+    infinity = INFINITY if flags & FLAG_WIDE_COSTS else NARROW_INFINITY
+    return UpdateMessage(COMPACT_VERSION, sender_address, dest_ids, costs, segment,
+                         CAPABILITY_COMPACT, addresses, infinity)
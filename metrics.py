@@ -0,0 +1,189 @@
+"""
+Metrics for the Distance Vector Routing Protocol
+
+A Metrics registry holds counters and latency histograms and renders them
+in the Prometheus text exposition format, which serve_metrics() offers
+over HTTP on a local port:
+
+    curl http://127.0.0.1:9100/metrics
+
+Updating a metric is a dict or list increment. Each metric is updated
+from one thread at a time (the receive thread, the sender holding
+send_lock, or whoever holds the server lock), so no extra locking is
+needed; rendering reads copies of the values.
+"""
+
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# seconds, for lock waits and encode/decode durations
+LATENCY_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class CounterMetric:
+    """Monotonic counter, optionally split by the value of one label"""
+
+    def __init__(self, name, help_text, label=None):
+        """
+        Args:
+            name: Metric name, ending in _total
+            help_text: One-line description
+            label: Name of the label that splits the counter (e.g. 'neighbor'), or None
+        """
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.values = {}  # label value (None without a label) -> count
+
+    def inc(self, amount=1, label_value=None):
+        """Add amount to the counter (for label_value if the counter has a label)"""
+        values = self.values
+        values[label_value] = values.get(label_value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        values = dict(self.values)
+        if self.label is None:
+            lines.append(f"{self.name} {values.get(None, 0)}")
+        else:
+            for label_value, count in sorted(values.items()):
+                lines.append(f'{self.name}{{{self.label}="{label_value}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class HistogramMetric:
+    """Distribution of observed values over fixed buckets"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            name: Metric name
+            help_text: One-line description
+            buckets: Sorted upper bounds of the buckets (an +Inf bucket is added)
+        """
+        self.name = name
+        self.help_text = help_text
+        self.bounds = buckets
+        self.counts = [0] * (len(buckets) + 1)  # per bucket, not cumulative; the last is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record one value"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def render(self):
+        counts = list(self.counts)
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.bounds, counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound:g}"}} {cumulative}')
+        cumulative += counts[-1]
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum:.9g}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+class Metrics:
+    """Registry of the metrics of one server"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, help_text, label=None):
+        """Create and register a CounterMetric"""
+        metric = CounterMetric(name, help_text, label)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        """Create and register a HistogramMetric"""
+        metric = HistogramMetric(name, help_text, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every metric in the text exposition format"""
+        return ''.join(metric.render() for metric in self.metrics)
+
+
+class TimedLock:
+    """
+    threading.Lock that records how long each acquire waited
+
+    The wait is recorded while the lock is held, so the histogram needs no
+    lock of its own. An uncontended acquire costs one extra non-blocking
+    attempt.
+    """
+
+    def __init__(self, histogram):
+        """
+        Args:
+            histogram: HistogramMetric for the wait times in seconds
+        """
+        self.lock = threading.Lock()
+        self.histogram = histogram
+
+    def acquire(self):
+        if self.lock.acquire(False):
+            self.histogram.observe(0.0)
+            return True
+        start = time.perf_counter()
+        self.lock.acquire()
+        self.histogram.observe(time.perf_counter() - start)
+        return True
+
+    def release(self):
+        self.lock.release()
+
+    def locked(self):
+        return self.lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET /metrics with the registry of the server it belongs to"""
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes are not worth a line on the console
+        pass
+
+
+def serve_metrics(metrics, port, host='127.0.0.1'):
+    """Serve a registry over HTTP from a background thread
+
+    Args:
+        metrics: Metrics registry to expose
+        port: TCP port to listen on (0 picks a free one)
+        host: Address to listen on; local only by default
+
+    Returns:
+        The ThreadingHTTPServer; call shutdown() to stop it
+    """
+    httpd = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    httpd.daemon_threads = True
+    httpd.metrics = metrics
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
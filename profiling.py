@@ -0,0 +1,185 @@
+"""
+On-demand profiling for the Distance Vector Routing Protocol
+
+SamplingProfiler samples the stacks of every thread from a background
+thread, so it sees the receive, update and command threads (or the event
+loop) of a running server, which cProfile, tracing only the thread that
+enabled it, would not. MemoryProfiler wraps tracemalloc. Both write
+plain text reports to disk.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+PROFILE_INTERVAL = 0.005  # seconds between stack samples
+PROFILE_TOP = 40  # functions listed per report section
+MEMPROFILE_FRAMES = 1  # stack frames tracemalloc keeps per allocation; reports group by line
+MEMPROFILE_TOP = 30  # source lines listed per report section
+
+
+def frame_key(code):
+    """Return a short (location, function) key for a code object"""
+    return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno}", code.co_name
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler over all threads
+
+    Every PROFILE_INTERVAL seconds the stack of each thread is recorded:
+    the innermost function gets a self sample, every function on the stack
+    a total sample. Functions waiting in select() or a lock show up as well,
+    so compare the hot path's total samples with its thread's samples.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()  # guards the counts, between the sampler and dump()
+        self.keys = {}  # code object -> frame_key(), so sampling a known stack allocates nothing
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.started = None
+        self.stopped = None
+        self.thread_samples = Counter()  # thread ID -> samples
+        self.thread_names = {}  # thread ID -> name
+        self.self_samples = Counter()  # (location, function) -> samples as innermost frame
+        self.total_samples = Counter()  # (location, function) -> samples anywhere on the stack
+
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        """Start sampling, dropping the samples of a previous run"""
+        if self.running():
+            raise RuntimeError("profiler is already running")
+        with self.lock:
+            self.reset()
+            self.started = time.time()
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling; the samples are kept for dump()"""
+        if not self.running():
+            raise RuntimeError("profiler is not running")
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+        self.stopped = time.time()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Record the current stack of every other thread"""
+        own_id = threading.get_ident()
+        frames = sys._current_frames()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        with self.lock:
+            self.samples += 1
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                self.thread_samples[thread_id] += 1
+                self.thread_names[thread_id] = names.get(thread_id, str(thread_id))
+
+                keys = self.keys
+                innermost = True
+                seen = set()
+                while frame is not None:
+                    code = frame.f_code
+                    key = keys.get(code)
+                    if key is None:
+                        key = keys[code] = frame_key(code)
+                    if innermost:
+                        self.self_samples[key] += 1
+                        innermost = False
+                    if key not in seen:
+                        # count recursive functions once per sample
+                        seen.add(key)
+                        self.total_samples[key] += 1
+                    frame = frame.f_back
+
+    def report(self):
+        """Return the samples as a text report"""
+        with self.lock:
+            end = self.stopped if self.stopped is not None and not self.running() else time.time()
+            lines = [f"Sampling profile: {self.samples} samples every {self.interval * 1e3:g} ms "
+                     f"over {end - self.started:.1f} s", "", "Samples per thread:"]
+            for thread_id, count in self.thread_samples.most_common():
+                lines.append(f"  {count:8d}  {self.thread_names[thread_id]}")
+
+            for title, counts in (("self", self.self_samples), ("total", self.total_samples)):
+                lines += ["", f"Top {PROFILE_TOP} functions by {title} samples:",
+                          f"  {'samples':>8s} {'%':>6s}  function (% of sampling rounds, up to 100 per thread)"]
+                for (location, function), count in counts.most_common(PROFILE_TOP):
+                    share = 100 * count / max(1, self.samples)
+                    lines.append(f"  {count:8d} {share:6.1f}  {function} ({location})")
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path):
+        """Write report() to a file"""
+        if self.started is None:
+            raise RuntimeError("profiler has not been started")
+        with open(path, 'w') as report_file:
+            report_file.write(self.report())
+
+
+class MemoryProfiler:
+    """
+    tracemalloc wrapper writing allocation reports, with growth since the previous one
+
+    Tracing makes every allocation several times slower, so keep it on for
+    the window being investigated only.
+    """
+
+    def __init__(self, frames=MEMPROFILE_FRAMES):
+        self.frames = frames
+        self.previous = None  # snapshot of the previous report
+
+    def start(self):
+        if tracemalloc.is_tracing():
+            raise RuntimeError("memory profiler is already running")
+        self.previous = None
+        tracemalloc.start(self.frames)
+
+    def stop(self):
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("memory profiler is not running")
+        tracemalloc.stop()
+        self.previous = None
+
+    def snapshot(self, path):
+        """Write the largest allocation sites, and their growth, to a file"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("memory profiler is not running")
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines = [f"Traced memory: {current / 1024:.1f} KiB current, {peak / 1024:.1f} KiB peak", "",
+                 f"Top {MEMPROFILE_TOP} lines by allocated size:"]
+        for stat in snapshot.statistics('lineno')[:MEMPROFILE_TOP]:
+            lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback[0]}")
+
+        if self.previous is not None:
+            lines += ["", f"Top {MEMPROFILE_TOP} lines by growth since the previous snapshot:"]
+            for stat in snapshot.compare_to(self.previous, 'lineno')[:MEMPROFILE_TOP]:
+                lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  "
+                             f"{stat.traceback[0]}")
+        self.previous = snapshot
+
+        with open(path, 'w') as report_file:
+            report_file.write('\n'.join(lines) + '\n')
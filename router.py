@@ -1,9 +1,98 @@
 import time
+import zlib
+
+SHARED_NEXT_HOPS = {(): ()}  # next hop tuple -> the one copy every route with those next hops uses
+UNREACHABLE = float('inf')  # cost shared by unreachable routes and missing backups
 
 class RoutingEntry:
-    """Data structure for routing table entry"""
-    def __init__(self, destination_id, next_hop_id, cost):
+    """Data structure for routing table entry
+
+    Entries use __slots__ instead of a per-instance __dict__ and share
+    their next hop tuples, which saves about 100 bytes per route (see
+    bench_dv.py memory).
+    """
+    __slots__ = ('destination_id', 'next_hop_id', 'next_hop_ids', 'cost', 'last_update_time',
+                 'backup_next_hop_id', 'backup_cost')
+
+    def __init__(self, destination_id, next_hop_id, cost, now=None):
+        """
+        Args:
+            destination_id: ID of the destination server
+            next_hop_id: ID of the next hop (None if unreachable)
+            cost: Cost of the route
+            now: Creation timestamp from the server's clock (default: time.time())
+        """
         self.destination_id = destination_id
         self.next_hop_id = next_hop_id
+        self.next_hop_ids = shared_next_hops(() if next_hop_id is None else (next_hop_id,))  # equal-cost next hops
         self.cost = cost
-        self.last_update_time = time.time()
\ No newline at end of file
+        self.last_update_time = time.time() if now is None else now
+        self.backup_next_hop_id = None
+        self.backup_cost = UNREACHABLE
+
+    def select_next_hop(self, flow=None):
+        """Pick one of the equal-cost next hops for a flow, see select_next_hop()"""
+        return select_next_hop(self.next_hop_id, self.next_hop_ids, flow)
+
+
+class RouteSnapshot:
+    """
+    Immutable copy of the routing table at one table version
+
+    routes maps destination_id -> (cost, next_hop_id, next_hop_ids,
+    backup_next_hop_id). A snapshot is never changed once DVServer has
+    published it, so it can be read from any thread without a lock.
+    """
+    def __init__(self, version, routes):
+        self.version = version  # table_version the snapshot was taken at
+        self.routes = routes
+
+    def lookup(self, dest_id, flow=None):
+        """Return the next hop for a destination, see select_next_hop()
+
+        Returns:
+            Next hop server ID, or None if the destination is unreachable or unknown
+        """
+        route = self.routes.get(dest_id)
+        if route is None:
+            return None
+        return select_next_hop(route[1], route[2], flow)
+
+    def table_routes(self):
+        """Return every route as (destination_id, cost, next_hop_ids)"""
+        return [(dest_id, route[0], route[2]) for dest_id, route in self.routes.items()]
+
+
+def shared_next_hops(next_hop_ids):
+    """Return the shared copy of a next hop tuple
+
+    Most routes go through one of a few neighbors, so sharing the tuples
+    saves one tuple per route.
+    """
+    return SHARED_NEXT_HOPS.setdefault(next_hop_ids, next_hop_ids)
+
+
+def select_next_hop(next_hop_id, next_hop_ids, flow=None):
+    """Pick one of a route's equal-cost next hops for a flow
+
+    Uses rendezvous hashing: every (flow, next hop) pair gets a CRC32
+    weight and the highest weight wins. The choice is the same in every
+    process, and when a next hop is added or removed only the flows
+    that move to or from it change next hop.
+
+    Args:
+        next_hop_id: Primary next hop (None if unreachable)
+        next_hop_ids: All equal-cost next hops
+        flow: Flow key (bytes, or any value with a stable repr such as
+            a (source, destination, port) tuple), None for next_hop_id
+
+    Returns:
+        Next hop server ID, or None if unreachable
+    """
+    if flow is None or len(next_hop_ids) < 2:
+        return next_hop_id
+
+    if not isinstance(flow, (bytes, bytearray)):
+        flow = repr(flow).encode()
+    seed = zlib.crc32(flow)
+    return max(next_hop_ids, key=lambda hop: zlib.crc32(hop.to_bytes(4, 'big'), seed))
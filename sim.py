@@ -0,0 +1,348 @@
+"""
+In-process simulator for the Distance Vector Routing Protocol
+
+Runs any number of DVServer instances in one process, without sockets,
+topology files, threads or stdin: each server gets its topology as data,
+sends through a VirtualTransport onto a shared VirtualNetwork and reads
+the time from a shared EventClock. The clock is a discrete-event
+scheduler: periodic updates, neighbor deadlines, triggered updates and
+datagram deliveries are events, and simulated time jumps from one to the
+next, so hours of protocol time run as fast as their events can be
+processed. Every random choice (update phases, link latency jitter,
+losses, advertisement sequence numbers) comes from one seeded generator,
+so a run with the same seed reproduces exactly.
+
+    simulator = Simulator(random_topology(1000, 4, seed=1), seed=1)
+    simulator.full_update()
+    seconds = simulator.converge()
+    simulator.schedule_command(600, 2, 'crash')
+    simulator.run(3600)
+    print(simulator.command(1, 'display'))
+"""
+
+import contextlib
+import io
+import random
+
+from dv_async import AsyncDVServer
+from logs import logger
+from message import AddressIndex, UpdateEncoder
+from timers import EventClock
+
+SIM_UPDATE_INTERVAL = 30  # seconds of simulated time between full updates
+SIM_PORT = 5000  # every simulated server listens on this port of its own address
+SIM_LATENCY = 0.001  # seconds of simulated time a datagram is in flight
+MAX_CONVERGE_TIME = 3600  # seconds of simulated time converge() runs before giving up
+
+
+def sim_address(server_id):
+    """Return the (ip, port) of a simulated server, 10.x.y.z for IDs up to 2**24"""
+    return f"10.{server_id >> 16 & 0xFF}.{server_id >> 8 & 0xFF}.{server_id & 0xFF}", SIM_PORT
+
+
+def random_topology(num_servers, degree, seed=None, max_cost=10):
+    """Build a connected random topology
+
+    Servers form a ring (so the network is connected) plus random links
+    until the average number of neighbors reaches degree.
+
+    Args:
+        num_servers: Number of servers, with IDs 1 to num_servers
+        degree: Average number of neighbors per server (at least 2)
+        seed: Seed for the link choice and costs
+        max_cost: Link costs are drawn from 1 to max_cost
+
+    Returns:
+        server_id -> {neighbor_id: cost}, with both directions of every link
+    """
+    rng = random.Random(seed)
+    topology = {server_id: {} for server_id in range(1, num_servers + 1)}
+
+    def link(first, second):
+        cost = rng.randint(1, max_cost)
+        topology[first][second] = cost
+        topology[second][first] = cost
+
+    for server_id in range(1, num_servers + 1):
+        link(server_id, server_id % num_servers + 1)
+
+    links = num_servers
+    target = min(num_servers * degree // 2, num_servers * (num_servers - 1) // 2)
+    while links < target:
+        first, second = rng.randint(1, num_servers), rng.randint(1, num_servers)
+        if first != second and second not in topology[first]:
+            link(first, second)
+            links += 1
+    return topology
+
+
+class VirtualNetwork:
+    """
+    Datagrams in flight between simulated servers
+
+    Each datagram arrives latency seconds (plus up to jitter) after it was
+    sent, or is lost with probability loss. Datagrams reaching a server at
+    the same time are processed as one batch, like the asyncio runtime does
+    with the datagrams of one event loop iteration.
+    """
+
+    def __init__(self, clock, rng, latency=SIM_LATENCY, jitter=0.0, loss=0.0):
+        """
+        Args:
+            clock: EventClock the deliveries are scheduled on
+            rng: random.Random for jitter and losses
+            latency: Seconds every datagram is in flight
+            jitter: Up to this many more seconds, drawn per datagram
+            loss: Probability that a datagram is lost
+        """
+        self.clock = clock
+        self.rng = rng
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.servers = {}  # (ip, port) -> attached DVServer
+        self.batches = {}  # (ip, port) -> datagrams arrived in this instant, not yet processed
+        self.in_flight = 0  # datagrams sent and not yet processed
+        self.datagrams_sent = 0
+        self.bytes_sent = 0
+        self.datagrams_lost = 0
+
+    def attach(self, server):
+        """Deliver the datagrams sent to a server's address to it"""
+        self.servers[(server.server_ip, server.server_port)] = server
+
+    def detach(self, address):
+        """Drop the datagrams sent to an address from now on, like a closed port"""
+        self.servers.pop(address, None)
+
+    def send(self, data, source, destination):
+        """Put a datagram in flight"""
+        self.datagrams_sent += 1
+        self.bytes_sent += len(data)
+        if self.loss and self.rng.random() < self.loss:
+            self.datagrams_lost += 1
+            return
+
+        delay = self.latency
+        if self.jitter:
+            delay += self.rng.uniform(0, self.jitter)
+        self.in_flight += 1
+        self.clock.call_later(delay, self.arrive, data, source, destination)
+
+    def arrive(self, data, source, destination):
+        """Event: a datagram reaches its destination address"""
+        batch = self.batches.get(destination)
+        if batch is None:
+            batch = self.batches[destination] = []
+            self.clock.call_soon(self.flush, destination)
+        batch.append((data, source))
+
+    def flush(self, destination):
+        """Event: process the datagrams that reached an address in this instant"""
+        batch = self.batches.pop(destination)
+        self.in_flight -= len(batch)
+        server = self.servers.get(destination)
+        if server is None or not server.running:
+            return
+        for start in range(0, len(batch), server.receive_batch):
+            chunk = batch[start:start + server.receive_batch]
+            server.batch_sizes[len(chunk)] += 1
+            server.process_batch(chunk)
+
+
+class VirtualTransport:
+    """Stand-in for a server's UDP socket that sends onto a VirtualNetwork"""
+
+    def __init__(self, network, address):
+        self.network = network
+        self.address = address
+
+    def sendto(self, data, address):
+        self.network.send(data, self.address, address)
+
+    def close(self):
+        self.network.detach(self.address)
+
+
+class SimDVServer(AsyncDVServer):
+    """
+    DVServer driven by a Simulator
+
+    The asyncio runtime's timers (periodic updates, neighbor deadlines,
+    triggered updates) run on the simulator's EventClock instead of an
+    event loop.
+    """
+
+    def __init__(self, simulator, *args, **kwargs):
+        self.simulator = simulator
+        super().__init__(*args, **kwargs)
+        self.loop = simulator.clock
+
+    def start(self, first_update):
+        """Schedule the first full update first_update seconds from now, and the liveness check"""
+        self.periodic_handle = self.loop.call_later(first_update, self.run_periodic_update)
+        self.schedule_liveness_check()
+
+    def load_server_list(self, servers):
+        """Use the server list, address index and entry prefixes shared by all simulated servers"""
+        super().load_server_list({})
+        shared = self.simulator.shared_addresses(self.encoder.capabilities)
+        self.all_servers, self.address_index, self.encoder.prefixes = shared
+
+    def set_server_address(self, server_id, ip, port):
+        """Stop sharing the server list before changing it"""
+        with self.lock:
+            if self.all_servers is self.simulator.all_servers:
+                self.all_servers = dict(self.all_servers)
+                self.address_index = AddressIndex()
+                self.address_index.rebuild(self.all_servers)
+        super().set_server_address(server_id, ip, port)
+
+    def trigger_update(self):
+        super().trigger_update()
+        if self.triggered_handle is not None:
+            self.simulator.triggered.add(self.server_id)
+
+    def run_triggered_update(self):
+        self.simulator.triggered.discard(self.server_id)
+        super().run_triggered_update()
+
+    def stop(self):
+        self.simulator.triggered.discard(self.server_id)
+        super().stop()
+
+
+class Simulator:
+    """
+    Network of SimDVServer instances in one process
+
+    Servers start at time 0 with their first full update at a random
+    point of their first update interval, as if they had been started by
+    hand one after the other.
+    """
+
+    def __init__(self, topology, update_interval=SIM_UPDATE_INTERVAL, seed=None, latency=SIM_LATENCY,
+                 jitter=0.0, loss=0.0, **server_options):
+        """
+        Args:
+            topology: server_id -> {neighbor_id: cost}, e.g. from random_topology()
+            update_interval: Seconds of simulated time between full updates
+            seed: Seed for every random choice of the run
+            latency: Seconds every datagram is in flight
+            jitter: Up to this many more seconds of flight, drawn per datagram
+            loss: Probability that a datagram is lost
+            server_options: Further DVServer arguments (split_horizon, engine, ...)
+        """
+        self.clock = EventClock()
+        self.rng = random.Random(seed)
+        self.network = VirtualNetwork(self.clock, self.rng, latency, jitter, loss)
+        self.update_interval = update_interval
+        self.triggered = set()  # IDs of servers with a triggered update scheduled
+        self.command_log = []  # (time, server_id, command_line, output) of scheduled commands
+
+        addresses = {server_id: sim_address(server_id) for server_id in topology}
+        # every server holds the same server list, so one copy of it and its indexes is shared
+        self.all_servers = {server_id: {'ip': ip, 'port': port} for server_id, (ip, port) in addresses.items()}
+        self.address_index = AddressIndex()
+        self.address_index.rebuild(self.all_servers)
+        self.entry_prefixes = {}  # capability bits -> UpdateEncoder.prefixes for them
+        self.servers = {}  # server_id -> SimDVServer
+        for server_id, neighbors in sorted(topology.items()):
+            ip, port = addresses[server_id]
+            topology_data = {
+                'num_servers': len(addresses),
+                'num_neighbors': len(neighbors),
+                'servers': addresses,
+                'neighbors': dict(neighbors),
+                'my_server_id': server_id,
+                'my_ip': ip,
+                'my_port': port
+            }
+            server = SimDVServer(self, None, update_interval, topology=topology_data,
+                                 transport=VirtualTransport(self.network, (ip, port)),
+                                 clock=self.clock, **server_options)
+            # DVServer draws this from the global generator
+            server.advertisement_sequence = self.rng.getrandbits(32)
+            self.network.attach(server)
+            self.servers[server_id] = server
+
+        for server in self.servers.values():
+            server.start(self.rng.uniform(0, update_interval))
+        logger.info("Simulating %d servers", len(self.servers))
+
+    def shared_addresses(self, capabilities):
+        """Return the shared (all_servers, address_index, entry prefixes) for a server
+
+        Entry prefixes carry the sender's capability bits, so there is one
+        copy per distinct capabilities value.
+        """
+        prefixes = self.entry_prefixes.get(capabilities)
+        if prefixes is None:
+            encoder = UpdateEncoder('0.0.0.0', 0, capabilities)
+            encoder.rebuild(self.all_servers)
+            prefixes = self.entry_prefixes[capabilities] = encoder.prefixes
+        return self.all_servers, self.address_index, prefixes
+
+    def idle(self):
+        """Return True if no datagram is in flight and no triggered update is pending"""
+        return not self.network.in_flight and not self.triggered
+
+    def full_update(self):
+        """Make every running server send a full update now, outside its own schedule"""
+        for server in self.servers.values():
+            if server.running:
+                server.send_update_to_neighbors()
+
+    def converge(self, max_time=MAX_CONVERGE_TIME):
+        """Run events until no datagram is in flight and no triggered update is pending
+
+        Periodic updates due meanwhile run as well.
+
+        Returns:
+            Seconds of simulated time it took, or None if the network was
+            still busy after max_time
+        """
+        clock = self.clock
+        start = clock.time()
+        end = start + max_time
+        while not self.idle():
+            when = clock.next_time()
+            if when is None or when > end:
+                return None
+            clock.step()
+        return clock.time() - start
+
+    def run(self, seconds):
+        """Run seconds of simulated time"""
+        self.clock.sleep(seconds)
+
+    def run_until(self, when):
+        """Run until simulated time when"""
+        self.clock.run_until(when)
+
+    def command(self, server_id, command_line):
+        """Execute a command on one server now
+
+        Args:
+            server_id: Server to run the command on
+            command_line: Command as typed at a server's prompt, e.g. 'disable 2'
+
+        Returns:
+            What the command printed
+        """
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.servers[server_id].execute_command(command_line)
+        return output.getvalue()
+
+    def schedule_command(self, when, server_id, command_line):
+        """Execute a command on one server at simulated time when
+
+        Its output is added to command_log.
+        """
+        self.clock.call_at(when, self.run_command, server_id, command_line)
+
+    def run_command(self, server_id, command_line):
+        """Event: execute a scheduled command"""
+        output = self.command(server_id, command_line)
+        self.command_log.append((self.clock.time(), server_id, command_line, output))
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Tests for update message encoding, decoding and segment tracking
+
+Run with pytest, or directly: python3 test_message.py
+"""
+
+import sys
+
+from dv import DVServer
+from message import (CAPABILITY_COMPACT, COMPACT_VERSION, FLAG_WIDE_COSTS, FLAG_WIDE_IDS, INFINITY,
+                     NARROW_INFINITY, SEQUENCE_MODULUS, SEQUENCE_WINDOW, SegmentTracker, UpdateEncoder,
+                     decode_update, pack_address, set_sequence)
+
+SERVERS = {server_id: {'ip': f"10.0.{server_id >> 8}.{server_id & 255}", 'port': 5000 + server_id}
+           for server_id in range(1, 301)}
+
+
+def make_encoder(capabilities=0):
+    """Return an encoder for server 1 that knows every address in SERVERS"""
+    encoder = UpdateEncoder('10.0.0.1', 5001, capabilities)
+    encoder.rebuild(SERVERS)
+    return encoder
+
+
+class NullTransport:
+    """Transport that drops every datagram, so a DVServer needs no socket"""
+
+    def sendto(self, data, address):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_server(wire_version=COMPACT_VERSION):
+    """Return server 1 of a two-server topology, with server 2 as its neighbor"""
+    topology = {
+        'num_servers': 2,
+        'num_neighbors': 1,
+        'servers': {1: ('10.0.0.1', 5001), 2: ('10.0.0.2', 5002)},
+        'neighbors': {2: 1},
+        'my_server_id': 1,
+        'my_ip': '10.0.0.1',
+        'my_port': 5001
+    }
+    return DVServer(None, 30, wire_version=wire_version, topology=topology, transport=NullTransport())
+
+
+def decoded_entries(datagrams):
+    """Decode datagrams and return their (destination_id, wire cost) pairs, in order"""
+    entries = []
+    for datagram in datagrams:
+        message = decode_update(datagram)
+        entries.extend(zip(message.dest_ids, message.costs))
+    return entries
+
+
+def test_v1_round_trip():
+    entries = [(1, 0), (2, 7), (3, float('inf')), (250, 42)]
+    datagrams = make_encoder().encode_segments(entries, 1)
+    assert len(datagrams) == 1
+
+    message = decode_update(datagrams[0])
+    assert message.version == 1
+    assert message.segment is None
+    assert message.sender_address == pack_address('10.0.0.1', 5001)
+    assert list(zip(message.dest_ids, message.costs)) == [(1, 0), (2, 7), (3, INFINITY), (250, 42)]
+
+
+def test_v1_segments():
+    entries = [(server_id, server_id % 50) for server_id in SERVERS]
+    datagrams = make_encoder().encode_segments(entries, 77, max_size=512)
+    assert len(datagrams) > 1
+    assert all(len(datagram) <= 512 for datagram in datagrams)
+
+    segments = [decode_update(datagram).segment for datagram in datagrams]
+    assert segments == [(77, index, len(datagrams)) for index in range(len(datagrams))]
+    assert decoded_entries(datagrams) == entries
+
+
+def test_set_sequence():
+    entries = [(server_id, 1) for server_id in SERVERS]
+    datagrams = make_encoder().encode_segments(entries, 0, max_size=512)
+    patched = [set_sequence(datagram, SEQUENCE_MODULUS + 5) for datagram in datagrams]
+    assert [decode_update(datagram).segment[0] for datagram in patched] == [5] * len(datagrams)
+    assert decoded_entries(patched) == decoded_entries(datagrams)
+
+    # unsegmented messages carry no sequence and are left alone
+    single = make_encoder().encode_segments(entries[:3], 0)[0]
+    assert set_sequence(single, 5) is single
+
+
+def test_truncated_message():
+    datagram = make_encoder().encode_segments([(1, 0), (2, 3)], 1)[0]
+    try:
+        decode_update(datagram[:-1])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("truncated message was decoded")
+
+
+def test_v2_narrow_round_trip():
+    entries = [(3, float('inf')), (1, 0), (250, 42), (2, 7)]
+    datagrams = make_encoder().encode_segments(entries, 1, version=COMPACT_VERSION)
+    assert len(datagrams) == 1
+    # 2-byte IDs and costs
+    assert len(datagrams[0]) == 10 + 4 * 4
+
+    message = decode_update(datagrams[0])
+    assert message.version == COMPACT_VERSION
+    assert message.capabilities == CAPABILITY_COMPACT
+    assert message.sender_address == pack_address('10.0.0.1', 5001)
+    assert message.infinity == NARROW_INFINITY
+    # compact messages are sorted by destination ID
+    assert list(zip(message.dest_ids, message.costs)) == [(1, 0), (2, 7), (3, NARROW_INFINITY), (250, 42)]
+
+
+def test_v2_wide_round_trip():
+    entries = [(70000, 5), (2, 70000), (3, float('inf'))]
+    datagram = make_encoder().encode_segments(entries, 1, version=COMPACT_VERSION)[0]
+    assert datagram[1] & FLAG_WIDE_IDS and datagram[1] & FLAG_WIDE_COSTS
+
+    message = decode_update(datagram)
+    assert message.infinity == INFINITY
+    assert list(zip(message.dest_ids, message.costs)) == [(2, 70000), (3, INFINITY), (70000, 5)]
+
+
+def test_v2_segments_and_addresses():
+    entries = [(server_id, server_id % 50) for server_id in SERVERS]
+    addresses = [(7, pack_address('192.168.1.7', 6007))]
+    datagrams = make_encoder().encode_segments(entries, 9, 128, COMPACT_VERSION, addresses)
+    assert len(datagrams) > 1
+    assert all(len(datagram) <= 128 for datagram in datagrams)
+
+    messages = [decode_update(datagram) for datagram in datagrams]
+    assert [message.segment for message in messages] == [(9, index, len(datagrams))
+                                                         for index in range(len(datagrams))]
+    # only the first segment carries the address changes
+    assert [list(message.addresses) for message in messages] == [addresses] + [[]] * (len(datagrams) - 1)
+    assert decoded_entries(datagrams) == entries
+
+    patched = [set_sequence(datagram, 10) for datagram in datagrams]
+    assert [decode_update(datagram).segment[0] for datagram in patched] == [10] * len(datagrams)
+
+
+def test_negotiate_wire_version():
+    server = make_server()
+    assert server.neighbor_versions[2] == 1
+    entries = [(1, 1), (2, 0)]
+
+    # a v1 message advertising the capability upgrades the neighbor
+    compact_capable = UpdateEncoder('10.0.0.2', 5002, CAPABILITY_COMPACT)
+    sender_id, _ = server.parse_update_message(compact_capable.encode(entries), ('10.0.0.2', 5002))
+    assert sender_id == 2
+    assert server.neighbor_versions[2] == COMPACT_VERSION
+
+    # a message without entries carries no capabilities and changes nothing
+    server.parse_update_message(compact_capable.encode([]), ('10.0.0.2', 5002))
+    assert server.neighbor_versions[2] == COMPACT_VERSION
+
+    # a v1 message without the capability falls back to v1
+    v1_only = UpdateEncoder('10.0.0.2', 5002)
+    server.parse_update_message(v1_only.encode(entries), ('10.0.0.2', 5002))
+    assert server.neighbor_versions[2] == 1
+
+    # a v2 message upgrades it again
+    compact = compact_capable.encode_segments(entries, 1, version=COMPACT_VERSION)[0]
+    server.parse_update_message(compact, ('10.0.0.2', 5002))
+    assert server.neighbor_versions[2] == COMPACT_VERSION
+
+
+def test_negotiate_wire_version_v1_server():
+    # a server limited to v1 keeps sending v1, even to a v2 neighbor
+    server = make_server(wire_version=1)
+    compact = UpdateEncoder('10.0.0.2', 5002, CAPABILITY_COMPACT).encode_segments([(1, 1)], 1,
+                                                                                  version=COMPACT_VERSION)[0]
+    server.parse_update_message(compact, ('10.0.0.2', 5002))
+    assert server.neighbor_versions[2] == 1
+
+
+def test_segment_tracker_duplicates():
+    tracker = SegmentTracker()
+    assert tracker.accept(2, 10, 0, 2)
+    assert not tracker.accept(2, 10, 0, 2)
+    assert not tracker.is_complete(2)
+    assert tracker.accept(2, 10, 1, 2)
+    assert tracker.is_complete(2)
+    # an index outside the advertisement is invalid
+    assert not tracker.accept(2, 10, 2, 2)
+
+
+def test_segment_tracker_stale():
+    tracker = SegmentTracker()
+    assert tracker.accept(2, 10, 0, 2)
+    assert tracker.accept(2, 11, 0, 2)
+    # segments of an older advertisement are dropped once a newer one arrived
+    assert not tracker.accept(2, 10, 1, 2)
+    # senders are tracked independently
+    assert tracker.accept(3, 10, 1, 2)
+
+    # a restarted sender far from the old sequence is accepted
+    assert tracker.accept(2, 11 + SEQUENCE_WINDOW * 4, 0, 1)
+
+    tracker.reset(2)
+    assert tracker.accept(2, 10, 1, 2)
+
+
+def test_segment_tracker_wraparound():
+    tracker = SegmentTracker()
+    last = SEQUENCE_MODULUS - 1
+    assert tracker.accept(2, last, 0, 1)
+    # the sequence after the largest one is 0, which is newer
+    assert tracker.accept(2, 0, 0, 1)
+    assert not tracker.accept(2, last, 0, 1)
+    assert not tracker.accept(2, last - 5, 0, 1)
+
+
+def main():
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_') and callable(test)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {name}: {e!r}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,451 @@
+#!/usr/bin/env python3
+"""
+Tests for route computation, run in the simulator and checked against Dijkstra
+
+Run with pytest, or directly: python3 test_routing.py
+"""
+
+import heapq
+import importlib.util
+import logging
+import random
+import sys
+
+from logs import logger
+from router import select_next_hop
+from sim import Simulator, random_topology
+
+# neighbor timeouts are expected in these tests
+logger.setLevel(logging.ERROR)
+
+ENGINES = ('dict', 'numpy') if importlib.util.find_spec('numpy') else ('dict',)
+
+# server 1 reaches 6 via 2 (cost 4), via 4 (cost 5) or via 3 (cost 6). When 2 crashes
+# the only feasible successor is 3: 4 reports 4, which is not below the cost of 4
+CRASH_TOPOLOGY = {1: {2: 2, 3: 4, 4: 1}, 2: {1: 2, 6: 2}, 3: {1: 4, 6: 2}, 4: {1: 1, 5: 1},
+                  5: {4: 1, 6: 3}, 6: {2: 2, 3: 2, 5: 3}}
+
+
+def shortest_paths(topology, source):
+    """Return the cost from source to every server it reaches (Dijkstra)"""
+    costs = {source: 0}
+    heap = [(0, source)]
+    while heap:
+        cost, server_id = heapq.heappop(heap)
+        if cost > costs[server_id]:
+            continue
+        for neighbor_id, link_cost in topology[server_id].items():
+            if cost + link_cost < costs.get(neighbor_id, float('inf')):
+                costs[neighbor_id] = cost + link_cost
+                heapq.heappush(heap, (cost + link_cost, neighbor_id))
+    return costs
+
+
+def expected_routes(topology, server_id, max_metric=float('inf')):
+    """Return destination_id -> (cost, equal-cost next hops) for one server
+
+    Costs at or above max_metric are unreachable, as in DVServer.
+    """
+    costs = {neighbor_id: shortest_paths(topology, neighbor_id) for neighbor_id in topology[server_id]}
+    routes = {}
+    for dest_id in topology:
+        if dest_id == server_id:
+            continue
+        totals = {neighbor_id: link_cost + costs[neighbor_id].get(dest_id, float('inf'))
+                  for neighbor_id, link_cost in topology[server_id].items()}
+        best = min(totals.values(), default=float('inf'))
+        if best >= max_metric:
+            best = float('inf')
+        next_hops = () if best == float('inf') else tuple(sorted(n for n, t in totals.items() if t == best))
+        routes[dest_id] = (best, next_hops)
+    return routes
+
+
+def live_topology(topology, down=()):
+    """Return topology without the servers in down and their links"""
+    return {server_id: {neighbor_id: cost for neighbor_id, cost in neighbors.items() if neighbor_id not in down}
+            for server_id, neighbors in topology.items() if server_id not in down}
+
+
+def check_tables(simulator, topology, down=()):
+    """Assert that every running server's table holds the shortest paths
+
+    The published snapshot must match the table, every backup must meet
+    the feasibility condition and be the cheapest neighbor that does, and
+    the next hop and backup indexes must match the routes.
+
+    Args:
+        simulator: Converged Simulator
+        topology: Current {server_id: {neighbor_id: cost}}, after link changes
+        down: Servers that crashed; routes to them must be unreachable
+    """
+    live = live_topology(topology, down)
+    distances = {server_id: shortest_paths(live, server_id) for server_id in live}
+    for server_id in live:
+        server = simulator.servers[server_id]
+        expected = expected_routes(live, server_id, server.max_metric)
+        expected.update((dest_id, (float('inf'), ())) for dest_id in down)
+        for dest_id, (cost, next_hops) in expected.items():
+            entry = server.routing_table[dest_id]
+            assert (entry.cost, entry.next_hop_ids) == (cost, next_hops), \
+                f"server {server_id} to {dest_id}: {(entry.cost, entry.next_hop_ids)} != {(cost, next_hops)}"
+            if next_hops:
+                assert entry.next_hop_id in next_hops
+            else:
+                assert entry.next_hop_id is None
+
+            # feasible successor: the cheapest other neighbor that is closer to the destination
+            feasible = [link_cost + distances[neighbor_id][dest_id]
+                        for neighbor_id, link_cost in live[server_id].items()
+                        if neighbor_id != entry.next_hop_id
+                        and distances[neighbor_id].get(dest_id, float('inf')) < cost]
+            backup_cost = min(feasible, default=float('inf'))
+            if backup_cost >= server.max_metric:
+                backup_cost = float('inf')
+            assert entry.backup_cost == backup_cost, f"server {server_id} to {dest_id}: backup"
+            assert (entry.backup_next_hop_id is None) == (backup_cost == float('inf'))
+
+        check_snapshot(server)
+        for neighbor_id in server.neighbors:
+            assert set(server.routes_via.get(neighbor_id, ())) == {
+                dest_id for dest_id, entry in server.routing_table.items() if neighbor_id in entry.next_hop_ids}
+            assert set(server.routes_with_backup(neighbor_id)) == {
+                dest_id for dest_id, entry in server.routing_table.items()
+                if entry.backup_next_hop_id == neighbor_id}
+
+
+def check_snapshot(server):
+    """Assert that a server's published snapshot matches its table at the current table_version"""
+    snapshot = server.snapshot
+    assert snapshot.version == server.table_version
+    assert set(snapshot.routes) == set(server.routing_table)
+    for dest_id, entry in server.routing_table.items():
+        assert snapshot.routes[dest_id] == (entry.cost, entry.next_hop_id, entry.next_hop_ids,
+                                            server.usable_backup(entry)[0])
+
+
+def change_link(simulator, topology, first, second, cost):
+    """Change a link's cost on both ends with the update command, and in topology"""
+    assert 'SUCCESS' in simulator.command(first, f'update {first} {second} {cost}')
+    assert 'SUCCESS' in simulator.command(second, f'update {second} {first} {cost}')
+    topology[first][second] = topology[second][first] = cost
+
+
+def copy_topology(topology):
+    return {server_id: dict(neighbors) for server_id, neighbors in topology.items()}
+
+
+def disable_link(simulator, topology, first, second):
+    """Disable a link on both ends with the disable command, and remove it from topology"""
+    assert 'SUCCESS' in simulator.command(first, f'disable {second}')
+    assert 'SUCCESS' in simulator.command(second, f'disable {first}')
+    del topology[first][second], topology[second][first]
+
+
+def converge_watching(simulator, dest_id):
+    """Converge, and return the highest finite cost to dest_id any server had meanwhile"""
+    highest = 0
+    while not simulator.idle():
+        assert simulator.clock.step()
+        for server in simulator.servers.values():
+            cost = server.routing_table[dest_id].cost
+            if cost != float('inf'):
+                highest = max(highest, cost)
+    return highest
+
+
+def converged(topology, engine='dict', split_horizon='poison', max_metric=32, seed=1):
+    """Return a Simulator of topology after its first full updates have converged"""
+    simulator = Simulator(topology, seed=seed, split_horizon=split_horizon, max_metric=max_metric,
+                          engine=engine)
+    simulator.full_update()
+    assert simulator.converge() is not None
+    return simulator
+
+
+def test_neighbor_vectors():
+    # 1 reaches 4 through 2 or 3; no datagram is delivered, the vectors are applied directly
+    topology = {1: {2: 1, 3: 2}, 2: {1: 1, 4: 5}, 3: {1: 2, 4: 5}, 4: {2: 5, 3: 5}}
+    for engine in ENGINES:
+        server = Simulator(topology, engine=engine).servers[1]
+        table = server.routing_table
+        assert table[4].cost == float('inf')
+
+        assert server.update_routing_table(2, [1, 2, 4], [1, 0, 2])
+        assert (table[4].cost, table[4].next_hop_id) == (3, 2)
+        # a worse path through another neighbor changes nothing, but is kept as backup
+        assert not server.update_routing_table(3, [1, 3, 4], [2, 0, 2])
+        assert (table[4].cost, table[4].next_hop_id, table[4].backup_next_hop_id) == (3, 2, 3)
+
+        # the next hop reports a worse cost: the stored vector of 3 wins at once
+        assert server.update_routing_table(2, [4], [10])
+        assert (table[4].cost, table[4].next_hop_ids) == (4, (3,)), engine
+        # a better path arrives
+        assert server.update_routing_table(2, [4], [1])
+        assert (table[4].cost, table[4].next_hop_ids) == (2, (2,))
+        # an equal-cost path joins the route
+        assert server.update_routing_table(3, [4], [0])
+        assert (table[4].cost, table[4].next_hop_ids, table[4].next_hop_id) == (2, (2, 3), 2)
+        # the same vector again changes nothing
+        assert not server.update_routing_table(3, [4], [0])
+
+        # unreachable costs, on the wire or at the max metric
+        assert server.update_routing_table(2, [4], [server.max_metric])
+        assert server.update_routing_table(3, [4], [float('inf')])
+        assert (table[4].cost, table[4].next_hop_id, table[4].next_hop_ids) == (float('inf'), None, ())
+        check_snapshot(server)
+
+
+def test_better_path():
+    for engine in ENGINES:
+        topology = copy_topology(CRASH_TOPOLOGY)
+        simulator = converged(topology, engine)
+        # 1 reaches 5 via 4 at cost 2, and 6 via 2 at cost 4
+        change_link(simulator, topology, 5, 6, 1)
+        simulator.converge()
+        check_tables(simulator, topology)
+        entry = simulator.servers[1].routing_table[6]
+        assert (entry.cost, entry.next_hop_ids) == (3, (4,))
+
+
+def test_worse_path_from_next_hop():
+    for engine in ENGINES:
+        topology = copy_topology(CRASH_TOPOLOGY)
+        simulator = converged(topology, engine)
+        # 2, the next hop of 1 to 6, loses its cheap link to 6
+        change_link(simulator, topology, 2, 6, 20)
+        simulator.converge()
+        check_tables(simulator, topology)
+        entry = simulator.servers[1].routing_table[6]
+        assert (entry.cost, entry.next_hop_ids) == (5, (4,))
+
+
+def test_link_cost_changes():
+    for engine in ENGINES:
+        topology = random_topology(15, 3, seed=7)
+        simulator = converged(topology, engine)
+        rng = random.Random(7)
+        for _ in range(6):
+            first = rng.choice(sorted(topology))
+            second = rng.choice(sorted(topology[first]))
+            change_link(simulator, topology, first, second, rng.randint(1, 12))
+            assert simulator.converge() is not None
+            check_tables(simulator, topology)
+
+
+# split horizon only stops loops between two servers, so partitions are tested on a line
+LINE_TOPOLOGY = {1: {2: 1}, 2: {1: 1, 3: 1}, 3: {2: 1, 4: 1}, 4: {3: 1}}
+# 1 reaches 3 and 4 via 2, or directly at a higher cost
+TRIANGLE_TOPOLOGY = {1: {2: 1, 3: 5}, 2: {1: 1, 3: 1}, 3: {1: 5, 2: 1, 4: 1}, 4: {3: 1}}
+
+
+def check_withdrawn(simulator, dest_id, down=()):
+    """Assert that every running server has dropped dest_id and so has every stored vector"""
+    for server_id, server in simulator.servers.items():
+        if server_id in down or server_id == dest_id:
+            continue
+        assert server.routing_table[dest_id].cost == float('inf')
+        assert server.lookup(dest_id) is None
+        for neighbor_id, vector in server.neighbor_vectors.items():
+            assert vector.get(dest_id, float('inf')) == float('inf'), \
+                f"server {server_id} still has {dest_id} from {neighbor_id}"
+
+
+def test_split_horizon_partition():
+    for split_horizon in ('none', 'split', 'poison'):
+        topology = copy_topology(LINE_TOPOLOGY)
+        simulator = converged(topology, split_horizon=split_horizon)
+        disable_link(simulator, topology, 3, 4)
+        highest = converge_watching(simulator, 4)
+        if split_horizon == 'none':
+            # 2 and 3 route 4 through each other and count up until the max metric
+            assert 3 < highest < simulator.servers[1].max_metric
+        else:
+            # no server routes 4 through the server it came from, so no cost ever rises
+            assert highest == 3, split_horizon
+        check_withdrawn(simulator, 4)
+        check_tables(simulator, topology)
+
+        # full updates bring back no stale cost
+        simulator.run(4 * simulator.update_interval)
+        check_withdrawn(simulator, 4)
+
+
+def test_split_horizon_reroute():
+    for split_horizon in ('none', 'split', 'poison'):
+        topology = copy_topology(TRIANGLE_TOPOLOGY)
+        simulator = converged(topology, split_horizon=split_horizon)
+        # 1 reaches 3 and 4 via 2; afterwards directly, at a higher cost
+        disable_link(simulator, topology, 1, 2)
+        assert converge_watching(simulator, 4) <= 6, split_horizon
+        check_tables(simulator, topology)
+        simulator.run(4 * simulator.update_interval)
+        check_tables(simulator, topology)
+
+
+def test_split_withdrawals():
+    # 1 reaches 3 directly; when 2-3 gets cheap, 1 moves to 2 and must stop advertising 3 to
+    # it, including when the triggered update carrying the withdrawal is lost
+    for lost in (False, True):
+        topology = {1: {2: 1, 3: 5}, 2: {1: 1, 3: 10}, 3: {1: 5, 2: 10}}
+        simulator = converged(topology, split_horizon='split', seed=0)
+        change_link(simulator, topology, 2, 3, 1)
+        simulator.run(0.15)
+        if lost:
+            simulator.network.loss = 1.0
+            simulator.run(0.1)
+            simulator.network.loss = 0.0
+        else:
+            # a full update goes out before the next triggered one
+            simulator.servers[1].send_update_to_neighbors()
+        simulator.converge()
+        simulator.run(200)
+        check_tables(simulator, topology)
+        assert simulator.servers[2].neighbor_vectors[1][3] == float('inf')
+
+
+# 1 reaches 5 through 2, 3 and 4 at the same cost
+ECMP_TOPOLOGY = {1: {2: 2, 3: 2, 4: 2}, 2: {1: 2, 5: 2}, 3: {1: 2, 5: 2}, 4: {1: 2, 5: 2},
+                 5: {2: 2, 3: 2, 4: 2}}
+FLOWS = [('10.0.0.1', '10.0.0.5', port) for port in range(1000, 1300)]
+
+
+def test_select_next_hop():
+    assert select_next_hop(None, (), FLOWS[0]) is None
+    assert select_next_hop(2, (2,), FLOWS[0]) == 2
+    assert select_next_hop(3, (2, 3, 4)) == 3
+    assert select_next_hop(3, (2, 3, 4), b'flow') == select_next_hop(3, (2, 3, 4), bytearray(b'flow'))
+
+    chosen = {flow: select_next_hop(2, (2, 3, 4), flow) for flow in FLOWS}
+    # every hop gets a fair share of the flows
+    assert all(list(chosen.values()).count(hop) > len(FLOWS) // 5 for hop in (2, 3, 4))
+
+    # removing a hop only moves its own flows, adding it back restores them
+    without = {flow: select_next_hop(2, (2, 4), flow) for flow in FLOWS}
+    assert all(without[flow] == hop for flow, hop in chosen.items() if hop != 3)
+    assert {flow: select_next_hop(2, (2, 3, 4), flow) for flow in FLOWS} == chosen
+
+
+def test_equal_cost_next_hops():
+    for engine in ENGINES:
+        topology = copy_topology(ECMP_TOPOLOGY)
+        simulator = converged(topology, engine)
+        check_tables(simulator, topology)
+        server = simulator.servers[1]
+        entry = server.routing_table[5]
+        assert (entry.cost, entry.next_hop_ids) == (4, (2, 3, 4))
+        chosen = {flow: server.lookup(5, flow) for flow in FLOWS}
+        assert set(chosen.values()) == {2, 3, 4}
+        assert server.lookup(5) == entry.next_hop_id
+
+        # one equal-cost next hop fails: only its flows move, the route keeps its cost
+        disable_link(simulator, topology, 1, 3)
+        assert (entry.cost, entry.next_hop_ids) == (4, (2, 4)), engine
+        moved = {flow: server.lookup(5, flow) for flow in FLOWS}
+        assert all(moved[flow] == hop for flow, hop in chosen.items() if hop != 3)
+        assert set(moved.values()) == {2, 4}
+
+        simulator.converge()
+        check_tables(simulator, topology)
+
+        # a cheaper link replaces the set, an equal one joins it again
+        change_link(simulator, topology, 1, 4, 1)
+        simulator.converge()
+        check_tables(simulator, topology)
+        assert entry.next_hop_ids == (4,)
+        change_link(simulator, topology, 1, 4, 2)
+        simulator.converge()
+        check_tables(simulator, topology)
+        assert entry.next_hop_ids == (2, 4)
+
+
+def test_snapshots():
+    for engine in ENGINES:
+        topology = copy_topology(CRASH_TOPOLOGY)
+        simulator = converged(topology, engine)
+        server = simulator.servers[1]
+        old = server.snapshot
+        old_routes = dict(old.routes)
+        old_version = old.version
+
+        # after every event of the runs below, each snapshot matches its table
+        change_link(simulator, topology, 4, 5, 7)
+        disable_link(simulator, topology, 1, 3)
+        simulator.command(6, 'crash')
+        while simulator.clock.time() < 1000 and simulator.clock.step():
+            for server_id, running in simulator.servers.items():
+                if server_id != 6:
+                    check_snapshot(running)
+        check_tables(simulator, topology, down={6})
+
+        # the published snapshot was replaced, never changed
+        assert server.snapshot is not old
+        assert server.snapshot.version > old_version
+        assert old.version == old_version
+        assert old.routes == old_routes
+        assert old.lookup(6) == 2 and server.lookup(6) is None
+
+
+def test_crash_moves_backup_routes_to_best_path():
+    for engine in ENGINES:
+        simulator = converged(CRASH_TOPOLOGY, engine)
+        check_tables(simulator, CRASH_TOPOLOGY)
+        entry = simulator.servers[1].routing_table[6]
+        assert (entry.cost, entry.next_hop_ids, entry.backup_next_hop_id) == (4, (2,), 3)
+
+        simulator.command(2, 'crash')
+        simulator.run(1000)
+        # the switch to the backup via 3 is followed by a recompute that finds 4
+        entry = simulator.servers[1].routing_table[6]
+        assert (entry.cost, entry.next_hop_ids) == (5, (4,)), engine
+        check_tables(simulator, CRASH_TOPOLOGY, down={2})
+
+
+def test_crash_random_networks():
+    for seed in range(4):
+        topology = random_topology(20, 3, seed=seed)
+        crashed = random.Random(seed).choice(sorted(topology))
+        for engine in ENGINES:
+            for split_horizon in ('split', 'poison'):
+                simulator = converged(topology, engine, split_horizon, seed=seed)
+                check_tables(simulator, topology)
+                simulator.command(crashed, 'crash')
+                simulator.run(1000)
+                check_tables(simulator, topology, down={crashed})
+
+
+def test_disable_switches_to_backup_at_once():
+    for engine in ENGINES:
+        simulator = converged(CRASH_TOPOLOGY, engine)
+        server = simulator.servers[1]
+        # both ends disable the link, then nothing is sent before checking
+        simulator.command(2, 'disable 1')
+        simulator.command(1, 'disable 2')
+        # 2 advertised 6, so 1 already recomputed it from the vectors of 3 and 4
+        entry = server.routing_table[6]
+        assert (entry.cost, entry.next_hop_ids) == (5, (4,)), engine
+        assert server.lookup(6) == 4
+        check_snapshot(server)
+
+        simulator.converge()
+        topology = {server_id: dict(neighbors) for server_id, neighbors in CRASH_TOPOLOGY.items()}
+        del topology[1][2], topology[2][1]
+        check_tables(simulator, topology)
+
+
+def main():
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_') and callable(test)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {name}: {e!r}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Tests for the neighbor deadline heap
+
+Run with pytest, or directly: python3 test_timers.py
+"""
+
+import sys
+
+from timers import DeadlineHeap
+
+
+def test_pop_order():
+    deadlines = DeadlineHeap()
+    deadlines.set(3, 30.0)
+    deadlines.set(1, 10.0)
+    deadlines.set(2, 20.0)
+    assert len(deadlines) == 3
+    assert deadlines.next_deadline() == 10.0
+
+    assert deadlines.pop_expired(5.0) == []
+    # a deadline equal to now has expired
+    assert deadlines.pop_expired(20.0) == [1, 2]
+    assert 1 not in deadlines and 3 in deadlines
+    assert deadlines.pop_expired(100.0) == [3]
+    assert deadlines.next_deadline() is None
+
+
+def test_refresh():
+    deadlines = DeadlineHeap()
+    deadlines.set(1, 10.0)
+    deadlines.set(2, 20.0)
+    for deadline in range(11, 60):
+        deadlines.set(1, float(deadline))
+    # later deadlines only update the dictionary
+    assert len(deadlines.heap) == 2
+
+    assert deadlines.next_deadline() == 20.0
+    assert deadlines.pop_expired(30.0) == [2]
+    assert deadlines.pop_expired(58.0) == []
+    assert deadlines.pop_expired(59.0) == [1]
+
+    # an earlier deadline takes effect immediately
+    deadlines.set(1, 50.0)
+    deadlines.set(1, 5.0)
+    assert deadlines.next_deadline() == 5.0
+    assert deadlines.pop_expired(5.0) == [1]
+    assert deadlines.pop_expired(50.0) == []
+
+
+def test_remove():
+    deadlines = DeadlineHeap()
+    deadlines.set(1, 10.0)
+    deadlines.set(2, 20.0)
+    deadlines.remove(1)
+    deadlines.remove(7)
+    assert 1 not in deadlines
+    assert deadlines.next_deadline() == 20.0
+
+    # a removed key can be set again without its old entry expiring it early
+    deadlines.set(1, 40.0)
+    assert deadlines.pop_expired(30.0) == [2]
+    assert deadlines.pop_expired(40.0) == [1]
+
+
+def main():
+    tests = [(name, test) for name, test in globals().items() if name.startswith('test_') and callable(test)]
+    failed = 0
+    for name, test in tests:
+        try:
+            test()
+            print(f"✓ {name}")
+        except Exception as e:
+            failed += 1
+            print(f"✗ {name}: {e!r}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Timer structures for the Distance Vector Routing Protocol
+"""
+
+import heapq
+
+
+class DeadlineHeap:
+    """
+    Per-key deadlines kept in a min-heap
+
+    Refreshing a key to a later deadline only updates a dictionary; the
+    key's heap entry is moved when it reaches the top of the heap. So the
+    heap holds about one entry per key however often deadlines are
+    refreshed, setting a deadline is O(log n) at most, and finding the
+    next deadline to expire is O(1) amortized.
+    """
+
+    def __init__(self):
+        self.deadlines = {}  # key -> current deadline
+        self.heap = []  # (deadline, key), may hold outdated entries
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def set(self, key, deadline):
+        """Set or refresh the deadline of a key
+
+        Args:
+            key: Key to set the deadline for (e.g. a neighbor ID)
+            deadline: Time at which the key expires
+        """
+        current = self.deadlines.get(key)
+        self.deadlines[key] = deadline
+        if current is None or deadline < current:
+            heapq.heappush(self.heap, (deadline, key))
+
+    def remove(self, key):
+        """Remove a key's deadline if it has one"""
+        self.deadlines.pop(key, None)
+
+    def next_deadline(self):
+        """Return the earliest deadline, or None if there is none"""
+        heap = self.heap
+        while heap:
+            deadline, key = heap[0]
+            current = self.deadlines.get(key)
+            if current == deadline:
+                return deadline
+            if current is not None and current > deadline:
+                # refreshed since it was pushed: move the entry to its new deadline
+                heapq.heapreplace(heap, (current, key))
+            else:
+                heapq.heappop(heap)
+        return None
+
+    def pop_expired(self, now):
+        """Remove and return the keys whose deadline is at or before now
+
+        Args:
+            now: Current time
+
+        Returns:
+            List of expired keys, earliest deadline first
+        """
+        expired = []
+        deadline = self.next_deadline()
+        while deadline is not None and deadline <= now:
+            _, key = heapq.heappop(self.heap)
+            del self.deadlines[key]
+            expired.append(key)
+            deadline = self.next_deadline()
+        return expired
+
+
+class TimerHandle:
+    """A callback scheduled on an EventClock; cancel() keeps it from running"""
+
+    __slots__ = ('when', 'callback', 'args', 'cancelled')
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class EventClock:
+    """
+    Discrete-event scheduler with a virtual clock
+
+    Callbacks run in order of their time, and in the order they were
+    scheduled when their times are equal, so a run is fully determined by
+    its inputs. time() is the time of the event being run: the clock jumps
+    from one event to the next, so simulated hours take as long as their
+    events take to process. call_later(), call_soon() and handles with
+    cancel() work like those of an asyncio event loop, which lets the
+    asyncio runtime's timers run on it unchanged.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        self.heap = []  # (time, sequence, TimerHandle), may hold cancelled handles
+        self.sequence = 0  # breaks ties between events scheduled for the same time
+        self.events_run = 0
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args):
+        """Schedule callback(*args) at simulated time when (now, if when has passed)
+
+        Returns:
+            TimerHandle that can cancel the callback
+        """
+        handle = TimerHandle(max(when, self.now), callback, args)
+        self.sequence += 1
+        heapq.heappush(self.heap, (handle.when, self.sequence, handle))
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) delay seconds from now"""
+        return self.call_at(self.now + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        """Schedule callback(*args) now, after the callbacks already due"""
+        return self.call_at(self.now, callback, *args)
+
+    def next_time(self):
+        """Return the time of the next pending event, or None if there is none"""
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def step(self):
+        """Run the next pending event
+
+        Returns:
+            False if there was no event to run
+        """
+        if self.next_time() is None:
+            return False
+        when, _, handle = heapq.heappop(self.heap)
+        self.now = when
+        self.events_run += 1
+        handle.callback(*handle.args)
+        return True
+
+    def run_until(self, end):
+        """Run every event due at or before end, then move the clock to end"""
+        while True:
+            when = self.next_time()
+            if when is None or when > end:
+                break
+            self.step()
+        self.now = max(self.now, end)
+
+    def sleep(self, seconds):
+        """Let seconds of simulated time pass, running the events due meanwhile"""
+        self.run_until(self.now + seconds)